@@ -0,0 +1,22 @@
+// Callbacks exécutés dans le navigateur (sans aller-retour avec le serveur)
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    immoviz: {
+        // Jours du mois choisi (années bissextiles comprises) ; le jour courant est ramené au dernier
+        update_days: function(month, year, currentDay) {
+            const maxDays = new Date(year, month, 0).getDate() || 31;
+            const options = [];
+            for (let i = 1; i <= maxDays; i++) {
+                options.push({label: i, value: i});
+            }
+            return [options, currentDay > maxDays ? maxDays : currentDay];
+        },
+
+        // Bandeau d'estimation retiré quand toutes les parties ont rendu le résultat exact
+        clear_badge: function(doneKeys, state) {
+            if (state && doneKeys.every(key => key === state.key)) {
+                return null;
+            }
+            return window.dash_clientside.no_update;
+        }
+    }
+});
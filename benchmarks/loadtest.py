@@ -0,0 +1,519 @@
+# loadtest.py
+"""
+Test de charge du serveur Dash : des utilisateurs simulés, en parallèle, rejouent des
+sessions de filtres réalistes sur /_dash-update-component, avec le même enchaînement de
+callbacks que le navigateur (aperçu, puis les parties du dashboard en parallèle).
+
+    python -m benchmarks.loadtest --users 20 --duration 60
+    python -m benchmarks.loadtest --rows 1m --users 50 \\
+        --config "1w:workers=1 threads=8" --config "4w:workers=4 threads=4"
+    python -m benchmarks.loadtest --config "cache:" --config "sans-cache:IMMOVIZ_CACHE_MB=0"
+
+Une configuration s'écrit nom:réglages, séparés par des espaces : en minuscules les réglages
+du serveur (workers, threads : gunicorn), en majuscules des variables d'environnement.
+Chaque configuration démarre son propre serveur sur les mêmes données et rejoue les mêmes
+sessions (même --seed). Rapport : débit, latences p50/p95/p99 par callback et par action
+(filtres appliqués -> toutes les parties affichées), mémoire (RSS) du serveur et de ses
+workers au cours du test (Linux, via /proc).
+
+Sans gunicorn, un seul worker est possible : le serveur de développement Flask (un thread
+par requête) le remplace.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from benchmarks.run import ROOT, spawn
+
+HAS_GUNICORN = importlib.util.find_spec("gunicorn") is not None
+
+# Réglages serveur d'une configuration (le reste : variables d'environnement)
+SERVER_SETTINGS = {'workers': 1, 'threads': 8}
+
+# Intervalle d'échantillonnage de la mémoire du serveur (s)
+RSS_INTERVAL = 0.5
+# Délai maximal de chargement des données au démarrage (s)
+STARTUP_TIMEOUT = 600
+REQUEST_TIMEOUT = 120
+
+# Déroulement d'une session : nombre d'actualisations avant de recharger la page,
+# probabilité d'un clic sur la carte après une actualisation, puis d'effacer la sélection
+SESSION_ACTIONS = (3, 10)
+CLICK_RATE = 0.2
+CLEAR_RATE = 0.5
+
+# Filtre modifié entre deux actualisations (poids)
+FILTER_CHANGES = {'dept': 4, 'types': 2, 'dates': 3, 'price': 2, 'stat': 1, 'min_sales': 1}
+
+
+def parse_config(text):
+    """'nom:workers=4 threads=4 IMMOVIZ_CACHE_MB=0' -> {'name', 'workers', 'threads', 'env'}."""
+    name, _, settings = text.partition(':')
+    config = dict(SERVER_SETTINGS, name=name or 'defaut', env={})
+    for item in settings.split():
+        key, _, value = item.partition('=')
+        if key.isupper():
+            config['env'][key] = value
+        elif key in SERVER_SETTINGS:
+            config[key] = int(value)
+        else:
+            raise ValueError(f"Réglage inconnu : {key}")
+    return config
+
+
+# --- SERVEUR ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(config, port):
+    if HAS_GUNICORN:
+        return [sys.executable, "-m", "gunicorn", "-w", str(config['workers']), "--threads", str(config['threads']),
+                "-b", f"127.0.0.1:{port}", "--timeout", str(REQUEST_TIMEOUT), "main:wsgi()"]
+    if config['workers'] > 1:
+        raise RuntimeError(f"{config['name']} : plusieurs workers nécessitent gunicorn (pip install gunicorn)")
+    return [sys.executable, "-m", "benchmarks.loadtest", "--serve", str(port)]
+
+
+def serve(port):
+    """Processus serveur sans gunicorn : serveur Flask, un thread par requête."""
+    sys.path.insert(0, ROOT)
+    import main
+    main.create_app().run(host="127.0.0.1", port=port, debug=False, threaded=True)
+
+
+def start_server(config, data_dir, log_path):
+    """Démarre le serveur d'une configuration et attend /ready -> (processus, URL, secondes)."""
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+               IMMOVIZ_DATA_DIR=data_dir, IMMOVIZ_WARMUP="0")
+    env.pop("IMMOVIZ_CACHE_DIR", None)  # pas de résultats d'un test précédent
+    env.update(config['env'])
+    log = open(log_path, 'w')
+    # Groupe de processus dédié : l'arrêt emporte les workers
+    proc = subprocess.Popen(server_command(config, port), cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+    log.close()
+    url = f"http://127.0.0.1:{port}"
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < STARTUP_TIMEOUT:
+        if proc.poll() is not None:
+            with open(log_path) as f:
+                sys.stderr.write(f.read()[-4000:])
+            raise RuntimeError(f"{config['name']} : le serveur s'est arrêté au démarrage")
+        try:
+            if requests.get(url + "/ready", timeout=5).status_code == 200:
+                return proc, url, time.perf_counter() - t0
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    stop_server(proc)
+    raise RuntimeError(f"{config['name']} : serveur non prêt après {STARTUP_TIMEOUT} s")
+
+
+def stop_server(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    except ProcessLookupError:
+        pass
+
+
+def tree_rss_mb(pid):
+    """RSS cumulée (Mo) d'un processus et de ses descendants (workers gunicorn)."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total_kb, todo = 0, [pid]
+    while todo:
+        p = todo.pop()
+        todo += children.get(p, [])
+        try:
+            with open(f"/proc/{p}/status") as f:
+                total_kb += next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+def sample_rss(pid, t0, samples, stop):
+    while not stop.is_set():
+        samples.append((round(time.perf_counter() - t0, 2), round(tree_rss_mb(pid), 1)))
+        stop.wait(RSS_INTERVAL)
+
+
+# --- CLIENT DASH ---
+
+def _outputs(dep):
+    """Sorties déclarées par /_dash-dependencies ('..a.b...c.d..', ids dict, suffixes @hash)."""
+    def spec(text):
+        if text.startswith('{'):
+            i = text.rindex('}.')
+            return {'id': json.loads(text[:i + 1]), 'property': text[i + 2:].split('@')[0]}
+        component, prop = text.split('.', 1)
+        return {'id': component, 'property': prop.split('@')[0]}
+    if dep['output'].startswith('..'):
+        return [spec(o) for o in dep['output'][2:-2].split('...')]
+    return spec(dep['output'])
+
+
+class DashClient:
+    """Callbacks du dashboard, appelés comme le navigateur (une session HTTP par thread)."""
+
+    def __init__(self, url):
+        self.url = url
+        self.local = threading.local()
+        deps = [d for d in requests.get(url + "/_dash-dependencies", timeout=REQUEST_TIMEOUT).json()
+                if not d.get('clientside_function') and d['inputs']]
+        self.callbacks = {}
+        for dep in deps:
+            first = dep['inputs'][0]['id']
+            outputs = _outputs(dep)
+            if first == 'btn-update':
+                name = 'preview_dashboard'
+            elif first == 'dashboard-state':
+                parts = [o['id']['part'] for o in outputs if isinstance(o['id'], dict)]
+                name = f"update_{parts[0]}" if parts else 'update_export_links'
+            elif first == 'map-graph':
+                name = 'select_communes'
+            else:
+                continue
+            self.callbacks[name] = dict(dep, outputs=outputs)
+        # Callbacks déclenchés par un nouvel état (parties du dashboard, liens d'export)
+        self.parts = [n for n, dep in self.callbacks.items() if dep['inputs'][0]['id'] == 'dashboard-state']
+
+    @property
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def call(self, name, props, changed):
+        """
+        POST d'un callback ; props : valeurs par 'composant.propriété'.
+        -> (secondes, statut, réponse JSON ou None).
+        """
+        dep = self.callbacks[name]
+
+        def values(specs):
+            return [{'id': s['id'], 'property': s['property'], 'value': props.get(f"{s['id']}.{s['property']}")}
+                    for s in specs]
+        body = {'output': dep['output'], 'outputs': dep['outputs'], 'inputs': values(dep['inputs']),
+                'state': values(dep['state']), 'changedPropIds': [changed]}
+        t0 = time.perf_counter()
+        r = self.session.post(self.url + "/_dash-update-component", json=body, timeout=REQUEST_TIMEOUT)
+        data = r.json() if r.status_code == 200 else None
+        return time.perf_counter() - t0, r.status_code, data
+
+
+# --- SESSIONS ---
+
+def default_props(meta):
+    """Valeurs initiales des contrôles de la sidebar (voir layout.py)."""
+    annees = meta['annees']
+    return {'filter-dept.value': 'all', 'filter-type.value': list(meta['types_biens']),
+            'start-day.value': 1, 'start-month.value': 1, 'start-year.value': annees[0],
+            'end-day.value': 31, 'end-month.value': 12, 'end-year.value': annees[-1],
+            'filter-price.value': [meta['min_price'], meta['max_price']],
+            'filter-stat.value': 'mean', 'filter-min-sales.value': 2}
+
+
+def change_filter(rng, props, meta, popular, stats):
+    """Modifie un filtre, comme un visiteur entre deux clics sur Actualiser."""
+    change = rng.choices(list(FILTER_CHANGES), weights=list(FILTER_CHANGES.values()))[0]
+    if change == 'dept':
+        # Surtout la France entière et les grandes villes, puis le reste des départements
+        roll = rng.random()
+        if roll < 0.3:
+            props['filter-dept.value'] = 'all'
+        elif roll < 0.6 and popular:
+            props['filter-dept.value'] = rng.choice(popular)
+        else:
+            props['filter-dept.value'] = rng.choice(meta['departements'])
+    elif change == 'types':
+        types = list(meta['types_biens'])
+        props['filter-type.value'] = types if rng.random() < 0.4 else rng.sample(types, rng.randint(1, len(types)))
+    elif change == 'dates':
+        annees = meta['annees']
+        if rng.random() < 0.3:
+            start, end = (1, 1, annees[0]), (31, 12, annees[-1])
+        else:
+            start = (rng.randint(1, 28), rng.randint(1, 12), rng.choice(annees))
+            end = (rng.randint(1, 31), rng.randint(1, 12), rng.choice([a for a in annees if a >= start[2]]))
+            if (end[2], end[1]) < (start[2], start[1]):
+                start, end = (start[0], end[1], start[2]), (end[0], start[1], end[2])
+        for prefix, (day, month, year) in (('start', start), ('end', end)):
+            props.update({f'{prefix}-day.value': day, f'{prefix}-month.value': month, f'{prefix}-year.value': year})
+    elif change == 'price':
+        lo, hi = meta['min_price'], meta['max_price']
+        if rng.random() < 0.3:
+            props['filter-price.value'] = [lo, hi]
+        else:
+            # Pas de 1 €/m² du RangeSlider
+            a, b = sorted(rng.uniform(lo, hi) for _ in range(2))
+            props['filter-price.value'] = [round(a), round(b)]
+    elif change == 'stat':
+        props['filter-stat.value'] = 'mean' if rng.random() < 0.5 else rng.choice(stats)
+    else:
+        props['filter-min-sales.value'] = rng.choice([0, 1, 2, 2, 5, 10])
+
+
+class Recorder:
+    """Latences (s) et erreurs par callback, partagées par les utilisateurs simulés."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, name, seconds, ok=True):
+        with self.lock:
+            if ok:
+                self.latencies.setdefault(name, []).append(seconds)
+            else:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def simulate_user(client, meta, communes, rng, deadline, think, recorder, pool):
+    """Sessions successives d'un visiteur jusqu'à l'échéance."""
+    from src.components.layout import PRICE_STATS
+    from src.utils.warmup import POPULAR_DEPARTEMENTS
+    popular = [d for d in POPULAR_DEPARTEMENTS if d in meta['departements']]
+    stats = [s for s in PRICE_STATS if s != 'mean']
+
+    def call(name, props, changed):
+        try:
+            seconds, status, data = client.call(name, props, changed)
+        except requests.RequestException:
+            recorder.add(name, 0, ok=False)
+            return None
+        # 204 : PreventUpdate, réponse normale
+        recorder.add(name, seconds, ok=status in (200, 204))
+        return data
+
+    def render(props, changed):
+        """Parties du dashboard en parallèle (comme le navigateur), après un nouvel état."""
+        futures = [pool.submit(call, part, props, changed) for part in client.parts]
+        return all(f.result() is not None for f in futures)
+
+    while time.perf_counter() < deadline:
+        # Nouvelle session : page rechargée, filtres par défaut
+        props = default_props(meta)
+        for n_clicks in range(1, rng.randint(*SESSION_ACTIONS) + 1):
+            if time.perf_counter() >= deadline:
+                return
+            if n_clicks > 1:
+                for _ in range(rng.choice([1, 1, 2])):
+                    change_filter(rng, props, meta, popular, stats)
+            props['btn-update.n_clicks'] = n_clicks
+
+            t0 = time.perf_counter()
+            data = call('preview_dashboard', props, 'btn-update.n_clicks')
+            if data is None:
+                recorder.add('action', 0, ok=False)
+                continue
+            props['dashboard-state.data'] = data['response']['dashboard-state']['data']
+            ok = render(props, 'dashboard-state.data')
+            recorder.add('action', time.perf_counter() - t0, ok=ok)
+            time.sleep(rng.expovariate(1 / think) if think > 0 else 0)
+
+            # Clic sur une commune du département affiché, puis parfois effacement
+            dept = props['filter-dept.value']
+            codes = communes.get(dept) or communes.get('all')
+            if codes and 'select_communes' in client.callbacks and rng.random() < CLICK_RATE:
+                props['map-graph.clickData'] = {'points': [{'location': rng.choice(codes)}]}
+                steps = ['map-graph.clickData']
+                if rng.random() < CLEAR_RATE:
+                    steps.append('btn-clear-selection.n_clicks')
+                for changed in steps:
+                    if changed == 'btn-clear-selection.n_clicks':
+                        props[changed] = (props.get(changed) or 0) + 1
+                    t0 = time.perf_counter()
+                    data = call('select_communes', props, changed)
+                    if data is None:
+                        continue
+                    props['dashboard-state.data'] = data['response']['dashboard-state']['data']
+                    ok = render(props, 'dashboard-state.data')
+                    recorder.add('selection', time.perf_counter() - t0, ok=ok)
+                    time.sleep(rng.expovariate(1 / think) if think > 0 else 0)
+                props['map-graph.clickData'] = None
+
+
+def commune_codes(url):
+    """Codes commune par département (clics sur la carte), via l'API de l'application."""
+    r = requests.get(url + "/api/v1/aggregates", params={'parts': 'communes'}, timeout=REQUEST_TIMEOUT)
+    communes = r.json()['results']['all']['communes']
+    codes = {'all': [str(c) for c in communes['code_commune']]}
+    for code, dept in zip(communes['code_commune'], communes['code_departement']):
+        codes.setdefault(str(dept), []).append(str(code))
+    return codes
+
+
+def run_config(config, data_dir, args, log_dir):
+    """Démarre le serveur d'une configuration, lance les utilisateurs et résume les mesures."""
+    log_path = os.path.join(log_dir, f"{config['name']}.log")
+    proc, url, startup = start_server(config, data_dir, log_path)
+    samples, stop = [], threading.Event()
+    try:
+        client = DashClient(url)
+        meta = requests.get(url + "/api/v1/metadata", timeout=REQUEST_TIMEOUT).json()
+        communes = commune_codes(url)
+        recorder = Recorder()
+
+        t0 = time.perf_counter()
+        sampler = threading.Thread(target=sample_rss, args=(proc.pid, t0, samples, stop), daemon=True)
+        sampler.start()
+        deadline = t0 + args.duration
+        pools = [ThreadPoolExecutor(len(client.parts)) for _ in range(args.users)]
+        users = [threading.Thread(target=simulate_user,
+                                  args=(client, meta, communes, random.Random(args.seed + i), deadline,
+                                        args.think, recorder, pools[i]))
+                 for i in range(args.users)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.perf_counter() - t0
+        for pool in pools:
+            pool.shutdown()
+    finally:
+        stop.set()
+        stop_server(proc)
+    return summarize(config, recorder, elapsed, startup, samples)
+
+
+def summarize(config, recorder, elapsed, startup, samples):
+    callbacks = {}
+    for name in sorted(set(recorder.latencies) | set(recorder.errors)):
+        values = np.array(recorder.latencies.get(name, [])) * 1000
+        callbacks[name] = {
+            'count': len(values), 'errors': recorder.errors.get(name, 0),
+            'per_second': round(len(values) / elapsed, 2),
+            **({f'p{q}_ms': round(float(np.percentile(values, q)), 1) for q in (50, 95, 99)} if len(values) else {}),
+            'mean_ms': round(float(values.mean()), 1) if len(values) else None,
+        }
+    requests_done = sum(c['count'] for n, c in callbacks.items() if n not in ('action', 'selection'))
+    rss = [mb for _, mb in samples] or [0]
+    return {
+        'config': {k: config[k] for k in ('name', 'workers', 'threads', 'env')},
+        'server': 'gunicorn' if HAS_GUNICORN else 'flask',
+        'startup_seconds': round(startup, 2), 'seconds': round(elapsed, 2),
+        'requests_per_second': round(requests_done / elapsed, 2),
+        'callbacks': callbacks,
+        'rss_mb': {'min': min(rss), 'mean': round(sum(rss) / len(rss), 1), 'max': max(rss), 'timeline': samples},
+    }
+
+
+# --- RAPPORT ---
+
+def print_report(result):
+    cfg = result['config']
+    settings = ' '.join([f"workers={cfg['workers']}", f"threads={cfg['threads']}"]
+                        + [f"{k}={v}" for k, v in cfg['env'].items()])
+    print(f"\n== {cfg['name']} ({result['server']} {settings})")
+    print(f"démarrage {result['startup_seconds']:.1f} s, {result['requests_per_second']:.1f} requêtes/s "
+          f"sur {result['seconds']:.0f} s")
+    print(f"{'callback':<22}{'n':>7}{'/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'moy ms':>9}{'err':>6}")
+    for name, c in result['callbacks'].items():
+        print(f"{name:<22}{c['count']:>7}{c['per_second']:>8.2f}"
+              + ''.join(f"{c.get(k) if c.get(k) is not None else '-':>9}" for k in ('p50_ms', 'p95_ms', 'p99_ms', 'mean_ms'))
+              + f"{c['errors']:>6}")
+    rss = result['rss_mb']
+    print(f"RSS serveur : min {rss['min']:.0f} Mo, moy {rss['mean']:.0f} Mo, max {rss['max']:.0f} Mo")
+
+
+def print_comparison(results):
+    """Configurations côte à côte : débit puis p95 de chaque callback."""
+    names = [r['config']['name'] for r in results]
+    width = max(12, *(len(n) + 2 for n in names))
+    print("\n== Comparaison (p95 ms)")
+    print(f"{'':<22}" + ''.join(f"{n:>{width}}" for n in names))
+    print(f"{'requêtes/s':<22}" + ''.join(f"{r['requests_per_second']:>{width}.1f}" for r in results))
+    print(f"{'RSS max Mo':<22}" + ''.join(f"{r['rss_mb']['max']:>{width}.0f}" for r in results))
+    callbacks = list(dict.fromkeys(n for r in results for n in r['callbacks']))
+    for name in callbacks:
+        values = [r['callbacks'].get(name, {}).get('p95_ms') for r in results]
+        print(f"{name:<22}" + ''.join(f"{v if v is not None else '-':>{width}}" for v in values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge du dashboard ImmoViz (utilisateurs simulés)")
+    parser.add_argument("--users", type=int, default=20, help="Utilisateurs simultanés")
+    parser.add_argument("--duration", type=float, default=60, help="Durée de chaque test (s)")
+    parser.add_argument("--think", type=float, default=2.0,
+                        help="Temps de réflexion moyen entre deux actions (s, loi exponentielle ; 0 : aucun)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--config", type=parse_config, action="append",
+                        help="nom:réglages, répétable pour comparer (ex. \"4w:workers=4 threads=4 IMMOVIZ_CACHE_MB=0\")")
+    parser.add_argument("--data-dir", default=None,
+                        help="Données de l'application (IMMOVIZ_DATA_DIR ou data/ par défaut)")
+    parser.add_argument("--rows", default=None, help="Données synthétiques générées pour le test (100k, 1m...)")
+    parser.add_argument("--output", default=None, help="Résultats détaillés en JSON (RSS au cours du temps compris)")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return 0
+
+    configs = args.config or [parse_config("defaut:")]
+    for config in configs:
+        server_command(config, 0)  # configuration impossible : erreur avant tout démarrage
+
+    work_dir = tempfile.mkdtemp(prefix="immoviz-load-")
+    try:
+        if args.rows:
+            for stage in ('generate', 'clean', 'geo'):
+                spawn(stage, work_dir, args.rows)
+            data_dir = os.path.join(work_dir, "data")
+        else:
+            data_dir = os.path.abspath(args.data_dir or os.environ.get("IMMOVIZ_DATA_DIR", os.path.join(ROOT, "data")))
+
+        results = []
+        for config in configs:
+            print(f"[INFO] {config['name']} : {args.users} utilisateurs pendant {args.duration:.0f} s...")
+            results.append(run_config(config, data_dir, args, work_dir))
+            print_report(results[-1])
+        if len(results) > 1:
+            print_comparison(results)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'users': args.users, 'duration': args.duration, 'think': args.think, 'seed': args.seed,
+                       'results': results}, f, indent=2)
+        print(f"Résultats enregistrés dans {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+# run.py
+"""
+Benchmarks des chemins critiques sur données synthétiques :
+nettoyage, chargement, contours et index spatial, démarrage de l'application et calcul
+du tableau de bord.
+
+    python -m benchmarks.run --rows 100k            # compare à benchmarks/baseline.json
+    python -m benchmarks.run --rows 100k --update-baseline
+
+Chaque étape (génération comprise) tourne dans un processus neuf : le temps et le pic
+de mémoire (RSS) mesurés ne dépendent pas des étapes précédentes. Le script sort en erreur si une
+étape régresse de plus de --tolerance par rapport à la référence.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+STAGES = ['clean', 'load', 'geo', 'spatial', 'startup', 'dashboard']
+
+# Régression tolérée (temps et mémoire) avant d'échouer
+TOLERANCE = 0.25
+# En dessous de ce temps, les écarts relatifs ne sont que du bruit
+MIN_SECONDS = 0.5
+
+
+def dashboard_filters(main):
+    """Jeux de filtres représentatifs : vue nationale, un département, un type, une fenêtre de prix."""
+    meta = main.metadata
+    types = meta['types_biens']
+    dept = meta['departements'][len(meta['departements']) // 2]
+    start = main.pd.Timestamp(meta['min_date'])
+    end = main.pd.Timestamp(meta['max_date']) + main.pd.offsets.MonthEnd(0)
+    full = [meta['min_price'], meta['max_price']]
+    return [
+        ('all', types, start, end, full, 2),
+        (dept, types, start, end, full, 2),
+        ('all', types[:1], start, end, full, 2),
+        ('all', types, start, start + main.pd.DateOffset(months=3), [2000, 6000], 5),
+    ]
+
+
+def run_stage(stage, data_dir, rows=None):
+    """Exécute une étape dans le processus courant (appelé par le processus parent)."""
+    os.environ["IMMOVIZ_DATA_DIR"] = data_dir
+    os.environ["IMMOVIZ_CACHE_MB"] = "0"  # on mesure le calcul, pas le cache
+    os.environ.pop("IMMOVIZ_CACHE_DIR", None)
+    os.environ["IMMOVIZ_WARMUP"] = "0"  # pas de calcul en arrière-plan pendant la mesure
+    sys.path.insert(0, ROOT)
+
+    t0 = time.perf_counter()
+    extra = {}
+    if stage == 'generate':
+        from benchmarks.synthetic import generate, parse_rows
+        generate(data_dir, parse_rows(rows))
+    elif stage == 'clean':
+        from src.utils import clean_data
+        clean_data.process()
+    elif stage == 'load':
+        from src.utils.load_data import load_detail
+        extra['rows'] = len(load_detail(data_dir))
+    elif stage == 'geo':
+        from src.utils.geo_store import build_geo_store
+        with open(os.path.join(data_dir, "raw", "etalab_communes.geojson"), 'r', encoding='utf-8') as f:
+            geojson = json.load(f)
+        build_geo_store(geojson, os.path.join(data_dir, "cleaned", "geo"))
+    elif stage == 'spatial':
+        # Index spatial de la sélection sur la carte (sinon construit au premier chargement)
+        from src.utils.spatial import SpatialIndex
+        with open(os.path.join(data_dir, "raw", "etalab_communes.geojson"), 'r', encoding='utf-8') as f:
+            geojson = json.load(f)
+        SpatialIndex.build(geojson).save(os.path.join(data_dir, "cleaned", "geo"))
+    elif stage == 'startup':
+        # Application prête à répondre (layout), puis données chargées
+        import main
+        main.create_app()
+        extra['app_seconds'] = round(time.perf_counter() - t0, 3)
+        main.dataset.get()
+    elif stage == 'dashboard':
+        import main
+        main.create_app()
+        main.dataset.get()
+        t0 = time.perf_counter()
+        for filters in dashboard_filters(main):
+            main.compute_dashboard(*filters)
+        extra['queries'] = len(dashboard_filters(main))
+    seconds = time.perf_counter() - t0
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss est en Ko sous Linux ; les workers de nettoyage comptent aussi
+    peak_mb = max(usage.ru_maxrss, children.ru_maxrss) / 1024
+    return dict(extra, seconds=round(seconds, 3), peak_rss_mb=round(peak_mb, 1))
+
+
+def spawn(stage, work_dir, rows):
+    """
+    Lance une étape dans un sous-processus, depuis work_dir (chemins relatifs data/...).
+    Le parent reste léger : sous Linux, le pic de RSS d'un parent est hérité par exec.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    cmd = [sys.executable, "-m", "benchmarks.run", "--stage", stage, "--rows", str(rows),
+           "--data-dir", os.path.join(work_dir, "data")]
+    proc = subprocess.run(cmd, cwd=work_dir, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stdout + proc.stderr)
+        raise RuntimeError(f"Étape {stage} en échec")
+    # La mesure est la dernière ligne, après les messages des scripts
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """Liste des régressions (étape, mesure, référence, valeur)."""
+    regressions = []
+    for stage, res in results.items():
+        ref = baseline.get(stage)
+        if not ref:
+            continue
+        if res['seconds'] > MIN_SECONDS and res['seconds'] > ref['seconds'] * (1 + tolerance):
+            regressions.append((stage, 'seconds', ref['seconds'], res['seconds']))
+        if res['peak_rss_mb'] > ref['peak_rss_mb'] * (1 + tolerance):
+            regressions.append((stage, 'peak_rss_mb', ref['peak_rss_mb'], res['peak_rss_mb']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks ImmoViz sur données synthétiques")
+    parser.add_argument("--rows", default="100k", help="Taille du jeu de données (100k, 1m, 10m)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Enregistre les mesures comme nouvelle référence")
+    parser.add_argument("--work-dir", default=None, help="Dossier de travail conservé (temporaire sinon)")
+    parser.add_argument("--stage", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        # Processus enfant : une seule étape, résultat en JSON sur la dernière ligne
+        print(json.dumps(run_stage(args.stage, args.data_dir, args.rows)))
+        return 0
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="immoviz-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        spawn('generate', work_dir, args.rows)
+        results = {}
+        for stage in args.stages:
+            results[stage] = spawn(stage, work_dir, args.rows)
+            print(f"{stage:<10} {results[stage]['seconds']:>8.2f} s  {results[stage]['peak_rss_mb']:>8.1f} Mo")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baselines = json.load(f)
+    scale = str(args.rows).lower()
+
+    if args.update_baseline:
+        baselines[scale] = results
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Référence {scale} enregistrée dans {args.baseline}")
+        return 0
+
+    if scale not in baselines:
+        print(f"Pas de référence pour {scale} (lancer avec --update-baseline)")
+        return 0
+    regressions = compare(results, baselines[scale], args.tolerance)
+    for stage, metric, ref, value in regressions:
+        print(f"[REGRESSION] {stage} {metric} : {value} (référence {ref})")
+    if not regressions:
+        print(f"[OK] Aucune régression au-delà de {args.tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
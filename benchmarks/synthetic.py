@@ -0,0 +1,149 @@
+# synthetic.py
+"""
+Générateur déterministe de données au format DVF (CSV.GZ) et de contours de communes
+(GeoJSON), pour mesurer les performances sans télécharger les vraies données.
+
+    python -m benchmarks.synthetic --rows 1m --out /tmp/immoviz-1m
+"""
+import argparse
+import gzip
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from src.components.layout import DEPARTEMENTS
+
+# Colonnes principales du fichier geo-dvf (les colonnes de lots sont omises)
+DVF_COLUMNS = ['id_mutation', 'date_mutation', 'numero_disposition', 'nature_mutation',
+               'valeur_fonciere', 'adresse_numero', 'adresse_nom_voie', 'code_postal',
+               'code_commune', 'nom_commune', 'code_departement', 'id_parcelle', 'nombre_lots',
+               'code_type_local', 'type_local', 'surface_reelle_bati', 'nombre_pieces_principales',
+               'surface_terrain', 'longitude', 'latitude']
+
+NATURES = ['Vente', "Vente en l'état futur d'achèvement", 'Echange', 'Adjudication']
+NATURES_P = [0.88, 0.07, 0.03, 0.02]
+TYPES = ['Maison', 'Appartement', 'Dépendance', 'Local industriel. commercial ou assimilé', '']
+TYPES_P = [0.33, 0.30, 0.22, 0.05, 0.10]
+
+# Tailles nommées : 100k, 1m, 10m
+SCALES = {'100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+
+# Lignes générées par lot (mémoire bornée même à 10 M de lignes)
+BATCH_ROWS = 500_000
+
+
+def parse_rows(value):
+    value = str(value).lower()
+    return SCALES.get(value) or int(float(value))
+
+
+def make_communes(n_communes, seed=0):
+    """Communes réparties sur les départements, avec un centre et un rayon."""
+    rng = np.random.default_rng(seed)
+    depts = list(DEPARTEMENTS)
+    rows = []
+    for i in range(n_communes):
+        dept = depts[i % len(depts)]
+        num = i // len(depts) + 1
+        code = f"{dept}{num:02d}" if len(dept) == 3 else f"{dept}{num:03d}"
+        d = depts.index(dept)
+        # Départements en grille sur la métropole, communes autour du centre du département
+        lon = -4.5 + (d % 10) * 1.3 + rng.normal(0, 0.3)
+        lat = 42.5 + (d // 10) * 0.85 + rng.normal(0, 0.25)
+        rows.append((dept, code, f"Commune {code}", lon, lat, rng.uniform(0.01, 0.05),
+                     rng.lognormal(7.9, 0.45)))
+    return pd.DataFrame(rows, columns=['code_departement', 'code_commune', 'nom_commune',
+                                       'lon', 'lat', 'radius', 'prix_base'])
+
+
+def write_geojson(communes, path, vertices=60, seed=0):
+    """Contours irréguliers (un Polygon, ou un MultiPolygon pour une commune sur sept)."""
+    rng = np.random.default_rng(seed)
+    features = []
+    t = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    for i, c in enumerate(communes.itertuples()):
+        r = c.radius * (1 + 0.25 * np.sin(t * rng.integers(3, 9)) + rng.normal(0, 0.03, vertices))
+        ring = np.round(np.c_[c.lon + r * np.cos(t), c.lat + r * np.sin(t)], 5).tolist()
+        ring.append(ring[0])
+        if i % 7 == 0:
+            island = [[x + c.radius * 1.5, y] for x, y in ring[::4]] + [[ring[0][0] + c.radius * 1.5, ring[0][1]]]
+            geom = {'type': 'MultiPolygon', 'coordinates': [[ring], [island]]}
+        else:
+            geom = {'type': 'Polygon', 'coordinates': [ring]}
+        features.append({'type': 'Feature', 'properties': {'code': c.code_commune, 'nom': c.nom_commune},
+                         'geometry': geom})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+
+
+def make_batch(communes, n, start_id, year, rng):
+    """Un lot de transactions au format DVF."""
+    idx = rng.integers(0, len(communes), n)
+    c = communes.iloc[idx]
+    types = rng.choice(TYPES, n, p=TYPES_P)
+    surface = np.where(types == 'Appartement', rng.gamma(3.0, 20.0, n), rng.gamma(5.0, 22.0, n)).round()
+    surface[rng.random(n) < 0.08] = np.nan
+    prix_m2 = c['prix_base'].to_numpy() * rng.lognormal(0, 0.35, n)
+    valeur = (surface * prix_m2).round(-2)
+    valeur[rng.random(n) < 0.01] = np.nan
+    days = rng.integers(0, 365, n)
+    dates = (pd.Timestamp(year, 1, 1) + pd.to_timedelta(np.sort(days), unit='D')).strftime('%Y-%m-%d')
+
+    return pd.DataFrame({
+        'id_mutation': [f"{year}-{i}" for i in range(start_id, start_id + n)],
+        'date_mutation': dates,
+        'numero_disposition': 1,
+        'nature_mutation': rng.choice(NATURES, n, p=NATURES_P),
+        'valeur_fonciere': valeur,
+        'adresse_numero': rng.integers(1, 200, n),
+        'adresse_nom_voie': rng.choice(['RUE DE LA PAIX', 'AV DES FLEURS', 'CHE DU MOULIN', 'BD VICTOR HUGO'], n),
+        'code_postal': c['code_commune'].str[:2].to_numpy() + '000',
+        'code_commune': c['code_commune'].to_numpy(),
+        'nom_commune': c['nom_commune'].to_numpy(),
+        'code_departement': c['code_departement'].to_numpy(),
+        'id_parcelle': c['code_commune'].to_numpy() + '000AB' + pd.Series(rng.integers(1, 9999, n)).astype(str).str.zfill(4).to_numpy(),
+        'nombre_lots': rng.integers(0, 3, n),
+        'code_type_local': pd.Series(types).map({'Maison': 1, 'Appartement': 2, 'Dépendance': 3}).to_numpy(),
+        'type_local': types,
+        'surface_reelle_bati': surface,
+        'nombre_pieces_principales': rng.integers(1, 7, n),
+        'surface_terrain': rng.integers(0, 2000, n),
+        'longitude': (c['lon'].to_numpy() + rng.normal(0, 0.01, n)).round(6),
+        'latitude': (c['lat'].to_numpy() + rng.normal(0, 0.01, n)).round(6),
+    }, columns=DVF_COLUMNS)
+
+
+def generate(out_dir, rows, year=2023, n_communes=None, seed=42):
+    """
+    Écrit out_dir/raw/dvf_<year>.csv.gz et out_dir/raw/etalab_communes.geojson.
+    Même (rows, year, seed) -> mêmes fichiers, octet pour octet.
+    """
+    raw_dir = os.path.join(out_dir, "raw")
+    os.makedirs(raw_dir, exist_ok=True)
+    os.makedirs(os.path.join(out_dir, "cleaned"), exist_ok=True)
+    n_communes = n_communes or int(min(35_000, max(500, rows // 30)))
+
+    communes = make_communes(n_communes, seed)
+    write_geojson(communes, os.path.join(raw_dir, "etalab_communes.geojson"), seed=seed)
+
+    rng = np.random.default_rng(seed + year)
+    path = os.path.join(raw_dir, f"dvf_{year}.csv.gz")
+    # mtime=0 : le gzip ne dépend pas de l'heure de génération
+    with gzip.GzipFile(path, 'wb', mtime=0) as f:
+        for start in range(0, rows, BATCH_ROWS):
+            n = min(BATCH_ROWS, rows - start)
+            batch = make_batch(communes, n, start, year, rng)
+            f.write(batch.to_csv(index=False, header=(start == 0)).encode('utf-8'))
+    print(f"{rows:,} transactions, {n_communes:,} communes -> {raw_dir}")
+    return out_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Génère des données DVF synthétiques")
+    parser.add_argument("--rows", default="100k", help="Nombre de lignes (100k, 1m, 10m ou un entier)")
+    parser.add_argument("--out", required=True, help="Dossier de sortie (contiendra raw/ et cleaned/)")
+    parser.add_argument("--year", type=int, default=2023)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate(args.out, parse_rows(args.rows), args.year, seed=args.seed)
@@ -1,262 +1,504 @@
 import dash
-from dash import dcc, html, Input, Output, State
+from dash import dcc, html, callback, clientside_callback, no_update, ClientsideFunction, Input, Output, State
 import dash_bootstrap_components as dbc
 import plotly.express as px
 import pandas as pd
 import json
 import os
+import functools
 import numpy as np
+from urllib.parse import urlencode
 
 # Import layout
-from src.components.layout import create_layout
+from src.components.layout import create_layout, DASHBOARD_PARTS, PRICE_STATS
+from src.components.figures import build_pie, build_histogram
+from src.utils.load_data import load_metadata, write_metadata
+from src.utils.dataset import Dataset
+from src.utils.geo_store import level_for_zoom, map_view
+from src.utils.cache import ResultCache, SharedResults, data_version, filter_key
+from src.utils.sketch import frame_quantiles
+from src.utils.warmup import WARMUP_ENABLED, POPULAR_DEPARTEMENTS, WarmupScheduler
+from src.utils.metrics import REGISTRY, instrument, span, record_payload, register_metrics_route
+from src.utils.api import format_polygon, register_api_routes
+from plotly.utils import PlotlyJSONEncoder
+from flask import jsonify
 
 # --- CONFIGURATION & DONNÉES ---
 pd.options.mode.chained_assignment = None
 
-print("Chargement des données...")
-# Chemins relatifs (adaptés à l'arborescence utilisateur)
-DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
-DETAIL_CSV = os.path.join(DATA_DIR, "cleaned", "data_detail.csv")
-GEO_JSON = os.path.join(DATA_DIR, "raw", "etalab_communes.geojson")
-
-# Lecture des données principales
-df = pd.read_csv(DETAIL_CSV, dtype={'code_commune': str, 'code_departement': str, 'mois': str})
-
-# Conversion de la date pour le tri correct
-df['date_mutation'] = pd.to_datetime(df['date_mutation'])
-df['month_date'] = df['date_mutation'].dt.to_period('M').astype(str) # Assurez format YYYY-MM
-
-# --- PRÉPARATION DES FILTRES ---
-# Liste des départements triée
-departements = sorted(df['code_departement'].unique())
-
-# Liste des types de biens
-types_biens = sorted(df['type_local'].unique())
-
-# Plage de dates (Mois min et max)
-mes_mois = sorted(df['month_date'].unique())
-min_date = mes_mois[0]
-max_date = mes_mois[-1]
-
-# Prix min/max
-min_price = int(df['prix_m2'].min())
-max_price = int(df['prix_m2'].max())
-
-# Dates pour le DatePicker
-min_date_dt = pd.to_datetime(min_date)
-max_date_dt = pd.to_datetime(max_date)
-
-# --- LOGIQUE GEOJSON (COPIÉE ET ADAPTÉE) ---
-# Mapping des arrondissements pour le GeoJSON (Paris, Lyon, Marseille)
-arrondissements_mapping = {
-    ('Paris', 1): '75101', ('Paris', 2): '75102', ('Paris', 3): '75103', ('Paris', 4): '75104',
-    ('Paris', 5): '75105', ('Paris', 6): '75106', ('Paris', 7): '75107', ('Paris', 8): '75108',
-    ('Paris', 9): '75109', ('Paris', 10): '75110', ('Paris', 11): '75111', ('Paris', 12): '75112',
-    ('Paris', 13): '75113', ('Paris', 14): '75114', ('Paris', 15): '75115', ('Paris', 16): '75116',
-    ('Paris', 17): '75117', ('Paris', 18): '75118', ('Paris', 19): '75119', ('Paris', 20): '75120',
-    ('Lyon', 1): '69381', ('Lyon', 2): '69382', ('Lyon', 3): '69383', ('Lyon', 4): '69384',
-    ('Lyon', 5): '69385', ('Lyon', 6): '69386', ('Lyon', 7): '69387', ('Lyon', 8): '69388', ('Lyon', 9): '69389',
-    ('Marseille', 1): '13201', ('Marseille', 2): '13202', ('Marseille', 3): '13203', ('Marseille', 4): '13204',
-    ('Marseille', 5): '13205', ('Marseille', 6): '13206', ('Marseille', 7): '13207', ('Marseille', 8): '13208',
-    ('Marseille', 9): '13209', ('Marseille', 10): '13210', ('Marseille', 11): '13211', ('Marseille', 12): '13212',
-    ('Marseille', 13): '13213', ('Marseille', 14): '13214', ('Marseille', 15): '13215', ('Marseille', 16): '13216',
-}
-
-def extract_arrondissement_number(nom_commune):
-    if 'Arrondissement' in nom_commune:
-        parts = nom_commune.split()
-        for i, part in enumerate(parts):
-            if 'Arrondissement' in part and i > 0:
-                try:
-                    num_str = parts[i-1].replace('er', '').replace('e', '').replace('ème', '')
-                    return int(num_str)
-                except:
-                    return None
-    return None
+# Chemins relatifs (adaptés à l'arborescence utilisateur), surchargeables pour les benchmarks
+DATA_DIR = os.environ.get("IMMOVIZ_DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
 
-def get_geojson_code(row):
-    return row 
+# Cache des résultats, invalidé automatiquement quand les données nettoyées changent
+CACHE_MAX_MB = int(os.environ.get("IMMOVIZ_CACHE_MB", "64"))
+CACHE_DIR = os.environ.get("IMMOVIZ_CACHE_DIR")  # dossier partagé entre processus (optionnel)
 
-# Chargement GeoJSON
-with open(GEO_JSON, 'r', encoding='utf-8') as f:
-    geojson = json.load(f)
+# Moteur des filtres et agrégations : 'pandas' (en mémoire) ou 'duckdb' (Parquet sur disque)
+BACKEND = os.environ.get("IMMOVIZ_BACKEND", "pandas")
 
-# --- PRÉ-CALCUL CENTROIDES DÉPARTEMENTS ---
-dept_centers = {} 
-temp_dept_coords = {} 
-
-for feature in geojson['features']:
-    try:
-        code_com = feature['properties']['code']
-        if code_com.startswith('97'):
-            dept = code_com[:3]
-        else:
-            dept = code_com[:2]
-            
-        geom = feature['geometry']
-        coords = []
-        if geom['type'] == 'Polygon':
-            coords = geom['coordinates'][0] 
-        elif geom['type'] == 'MultiPolygon':
-            coords = geom['coordinates'][0][0] 
-            
-        if coords:
-            lons = [p[0] for p in coords]
-            lats = [p[1] for p in coords]
-            avg_lon = sum(lons) / len(lons)
-            avg_lat = sum(lats) / len(lats)
-            
-            if dept not in temp_dept_coords:
-                temp_dept_coords[dept] = {'lats': [], 'lons': []}
-            
-            temp_dept_coords[dept]['lats'].append(avg_lat)
-            temp_dept_coords[dept]['lons'].append(avg_lon)
-            
-    except Exception as e:
-        continue
-
-for dept, data in temp_dept_coords.items():
-    if data['lats']:
-        dept_centers[dept] = {
-            'lat': sum(data['lats']) / len(data['lats']),
-            'lon': sum(data['lons']) / len(data['lons'])
-        }
-
-print(f"Centraux calculés pour {len(dept_centers)} départements.")
+# Renseignés par create_app (une application par processus)
+dataset = None       # Dataset : détail, cube, contours, chargés en arrière-plan
+metadata = None      # bornes des filtres (départements, types, prix, années)
+result_cache = None  # ResultCache
+state_cache = None   # SharedResults : agrégats partagés par les callbacks des parties
+warmup = None        # WarmupScheduler : préchauffage du cache (None si désactivé)
 
 # --- APPLICATION ---
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.LUX])
-app.title = "ImmoViz France"
-
-# --- LAYOUT ---
-app.layout = create_layout(departements, types_biens, min_price, max_price)
+def create_app(data_dir=DATA_DIR, preload=True):
+    """
+    Crée l'application Dash sans charger les données : le layout ne dépend que des
+    métadonnées écrites par clean_data.py. Le jeu de données est chargé en arrière-plan
+    (preload) ou à la première requête ; /ready indique quand il est prêt.
+    """
+    global dataset, metadata, result_cache, state_cache, warmup
+    version = data_version(data_dir)
+    dataset = Dataset(data_dir, version, shared_dir=os.environ.get("IMMOVIZ_SHARED_DIR"), backend=BACKEND)
+
+    metadata = load_metadata(data_dir, version)
+    if metadata is None:
+        # Données nettoyées par une version précédente : calcul (bloquant) puis sauvegarde
+        print("Métadonnées absentes, calcul à partir des données...")
+        metadata = dataset.get().backend.metadata()
+        try:
+            write_metadata(data_dir, version, metadata)
+        except OSError:
+            pass
+
+    result_cache = ResultCache(version, max_bytes=CACHE_MAX_MB * 1024 * 1024, disk_dir=CACHE_DIR)
+    state_cache = SharedResults()
+
+    app = dash.Dash(__name__, external_stylesheets=[dbc.themes.LUX])
+    app.title = "ImmoViz France"
+
+    # --- LAYOUT ---
+    app.layout = create_layout(metadata['departements'], metadata['types_biens'],
+                               metadata['min_price'], metadata['max_price'], metadata['annees'])
+
+    # --- MÉTRIQUES ET ÉTAT ---
+    # Latences par callback et par étape, au format Prometheus sur /metrics
+    register_metrics_route(app.server)
+
+    @app.server.route("/health")
+    def health():
+        return jsonify(status='ok')
+
+    @app.server.route("/ready")
+    def ready():
+        # 503 tant que les données ne sont pas chargées (pour les load balancers)
+        status = dataset.status()
+        return jsonify(status=status, load_seconds=dataset.load_seconds,
+                       warmup=warmup.status() if warmup else None), 200 if status == 'ready' else 503
+
+    def api_ready():
+        # Sans préchargement, le premier appel à l'API lance le chargement (réponse 503 en attendant)
+        dataset.start()
+        return dataset.ready.is_set()
+
+    # Agrégats du dashboard en JSON (/api/v1/aggregates), mêmes calculs que les callbacks
+    # et export des transactions filtrées en flux (/api/v1/export)
+    register_api_routes(app.server, dashboard_state, metadata, version,
+                        result_cache, api_ready,
+                        export_batches=lambda filters: dataset.get().backend.export_batches(*filters),
+                        polygon_communes=lambda points: selection_communes({'points': points}))
+
+    if preload:
+        dataset.start()
+
+    # Préchauffage des combinaisons les plus demandées, une fois les données chargées
+    warmup = None
+    if preload and WARMUP_ENABLED:
+        warmup = WarmupScheduler(warmup_tasks(), warm_filters, is_cached)
+        warmup.start(wait_for=dataset.get)
+    return app
+
+
+REGISTRY.add_collector(lambda: [
+    (f"immoviz_warmup_{k}", f"Préchauffage du cache : {k}", v)
+    for k, v in (warmup.status().items() if warmup else []) if k != 'state'
+])
+REGISTRY.add_collector(lambda: [
+    (f"immoviz_cache_{k}", f"Cache des résultats : {k}", v)
+    for k, v in (result_cache.stats().items() if result_cache else []) if k != 'version'
+] + [("immoviz_data_ready", "Données chargées (1) ou non (0)", int(bool(dataset and dataset.ready.is_set())))])
 
 # --- CALLBACKS ---
 
+# Sorties du dashboard (nom utilisé pour la taille de chaque sortie dans /metrics)
+DASHBOARD_OUTPUTS = ['map-graph', 'line-evol', 'pie-type', 'bar-top10', 'hist-dist',
+                     'kpi-price', 'kpi-volume', 'kpi-top-city', 'kpi-top-price', 'kpi-surface', 'kpi-price-label']
+
+# Sorties de chaque partie (dans l'ordre de DASHBOARD_OUTPUTS), rendues par des callbacks
+# indépendants : Dash les lance en parallèle et affiche chacune dès qu'elle est prête
+PART_OUTPUTS = {
+    'map': ['map-graph'],
+    'line': ['line-evol'],
+    'pie': ['pie-type'],
+    'bar': ['bar-top10'],
+    'hist': ['hist-dist'],
+    'kpis': ['kpi-price', 'kpi-volume', 'kpi-top-city', 'kpi-top-price', 'kpi-surface', 'kpi-price-label'],
+}
+# Parties qui dépendent de la statistique de prix choisie (moyenne ou quantile)
+STAT_PARTS = ['map', 'bar', 'kpis']
+
 def apply_geojson_logic(df_mapp):
     df_mapp['code_geojson'] = df_mapp['code_commune']
     return df_mapp
 
-@app.callback(
-    [Output('start-day', 'options'), Output('start-day', 'value')],
-    [Input('start-month', 'value')],
-    [State('start-day', 'value')]
-)
-def update_start_day(month, current_day):
-    days_30 = [4, 6, 9, 11]
-    if month == 2:
-        max_days = 28
-    elif month in days_30:
-        max_days = 30
-    else:
-        max_days = 31
-        
-    options = [{'label': i, 'value': i} for i in range(1, max_days + 1)]
-    
-    new_day = current_day
-    if current_day > max_days:
-        new_day = max_days
-        
-    return options, new_day
-
-@app.callback(
-    [Output('end-day', 'options'), Output('end-day', 'value')],
-    [Input('end-month', 'value')],
-    [State('end-day', 'value')]
-)
-def update_end_day(month, current_day):
-    days_30 = [4, 6, 9, 11]
-    if month == 2:
-        max_days = 28
-    elif month in days_30:
-        max_days = 30
-    else:
-        max_days = 31
-        
-    options = [{'label': i, 'value': i} for i in range(1, max_days + 1)]
-    
-    new_day = current_day
-    if current_day > max_days:
-        new_day = max_days
-        
-    return options, new_day
-
-
-@app.callback(
-    [Output('map-graph', 'figure'),
-     Output('line-evol', 'figure'),
-     Output('pie-type', 'figure'),
-     Output('bar-top10', 'figure'),
-     Output('hist-dist', 'figure'),
-     Output('kpi-price', 'children'),
-     Output('kpi-volume', 'children'),
-     Output('kpi-top-city', 'children'),
-     Output('kpi-top-price', 'children'),
-     Output('kpi-surface', 'children')],
-    [Input('btn-update', 'n_clicks')],
-    [State('filter-dept', 'value'),
-     State('filter-type', 'value'),
-     State('start-day', 'value'),
-     State('start-month', 'value'),
-     State('end-day', 'value'),
-     State('end-month', 'value'),
-     State('filter-price', 'value'),
-     State('filter-min-sales', 'value')]
-)
-def update_dashboard(n_clicks, selected_dept, selected_types, s_day, s_month, e_day, e_month, price_range, min_sales):
+# Jours du mois choisi : calculés dans le navigateur (assets/clientside.js), sans requête
+for prefix in ('start', 'end'):
+    clientside_callback(
+        ClientsideFunction(namespace='immoviz', function_name='update_days'),
+        [Output(f'{prefix}-day', 'options'), Output(f'{prefix}-day', 'value')],
+        [Input(f'{prefix}-month', 'value'), Input(f'{prefix}-year', 'value')],
+        [State(f'{prefix}-day', 'value')]
+    )
+
+
+def dashboard_outputs(names=DASHBOARD_OUTPUTS, **kwargs):
+    """Sorties du dashboard (figures puis KPIs)."""
+    return [Output(name, 'children' if name.startswith('kpi-') else 'figure', **kwargs) for name in names]
+
+
+FILTER_STATES = [State('filter-dept', 'value'),
+                 State('filter-type', 'value'),
+                 State('start-day', 'value'),
+                 State('start-month', 'value'),
+                 State('start-year', 'value'),
+                 State('end-day', 'value'),
+                 State('end-month', 'value'),
+                 State('end-year', 'value'),
+                 State('filter-price', 'value'),
+                 State('filter-min-sales', 'value')]
+
+
+def parse_filters(selected_dept, selected_types, s_day, s_month, s_year, e_day, e_month, e_year, price_range, min_sales,
+                  communes=None):
+    """
+    Valeurs des filtres -> (département, types, début, fin, prix, ventes min, communes).
+    communes : codes sélectionnés sur la carte (voir selection_communes), None sinon.
+    """
+    # Bornes par défaut : toute la période chargée
+    annees = metadata['annees']
+    default_start = pd.Timestamp(annees[0], 1, 1)
+    default_end = pd.Timestamp(annees[-1], 12, 31)
     try:
-        start_date = pd.to_datetime(f"2023-{s_month}-{s_day}", format='%Y-%m-%d', errors='coerce')
-        end_date = pd.to_datetime(f"2023-{e_month}-{e_day}", format='%Y-%m-%d', errors='coerce')
+        start_date = pd.to_datetime(f"{s_year}-{s_month}-{s_day}", format='%Y-%m-%d', errors='coerce')
+        end_date = pd.to_datetime(f"{e_year}-{e_month}-{e_day}", format='%Y-%m-%d', errors='coerce')
         
         if pd.isna(start_date):
-            start_date = pd.to_datetime("2023-01-01")
+            start_date = default_start
         if pd.isna(end_date):
-            end_date = pd.to_datetime("2023-12-31")
+            end_date = default_end
             
     except:
-        start_date = pd.to_datetime("2023-01-01")
-        end_date = pd.to_datetime("2023-12-31")
-    
-    mask = (df['date_mutation'] >= start_date) & (df['date_mutation'] <= end_date) & \
-           (df['type_local'].isin(selected_types)) & \
-           (df['prix_m2'] >= price_range[0]) & (df['prix_m2'] <= price_range[1])
-    
-    if selected_dept != 'all':
-        mask = mask & (df['code_departement'] == selected_dept)
-    
-    filtered_df = df[mask]
-    
-    if filtered_df.empty:
-        empty_fig = px.scatter(title="Aucune donnée disponible pour ces filtres")
-        return empty_fig, empty_fig, empty_fig, empty_fig, empty_fig, "-", "0", "-", "-", "-"
+        start_date = default_start
+        end_date = default_end
+    return selected_dept, selected_types, start_date, end_date, price_range, min_sales, communes
+
+
+def dashboard_state(filters):
+    """
+    Agrégats exacts d'un jeu de filtres, calculés une fois par processus et partagés par
+    les callbacks des parties (et l'API) : les autres attendent le premier calcul.
+    """
+    return state_cache.get_or_compute(filter_key(*filters), lambda: dashboard_aggregates(*filters))
+
+
+def part_key(key, part, stat='mean'):
+    return f"{key}|{part}|{stat}" if part in STAT_PARTS else f"{key}|{part}"
+
+
+def is_cached(filters, stat='mean'):
+    """Toutes les parties de cette combinaison sont en cache."""
+    key = filter_key(*filters)
+    return all(result_cache.contains(part_key(key, part, stat)) for part in DASHBOARD_PARTS)
+
+
+def part_result(part, filters, stat='mean', decode=True):
+    """Sorties exactes d'une partie : depuis le cache, sinon calculées puis mises en cache."""
+    key = filter_key(*filters)
+    if decode:
+        with span('cache_lookup'):
+            cached = result_cache.get(part_key(key, part, stat))
+        if cached is not None:
+            return cached
+
+    if part == 'hist':
+        # L'histogramme interroge directement le moteur, sans attendre les agrégats
+        return store_part(part, build_part(part, None, filters), key, stat, decode)
+
+    # Avec un cache disque partagé (IMMOVIZ_CACHE_DIR), les callbacks d'une même combinaison
+    # peuvent arriver sur des workers différents : le premier calcule les agrégats et met en
+    # cache toutes les parties qui en dépendent, les autres attendent le verrou puis les lisent.
+    with result_cache.lock(key):
+        if result_cache.disk_dir and result_cache.contains(part_key(key, part, stat)):
+            return result_cache.get(part_key(key, part, stat)) if decode else None
+        with span('aggregates'):
+            agg = dashboard_state(filters)
+        if result_cache.disk_dir:
+            for other in DASHBOARD_PARTS:
+                if other not in (part, 'hist') and not result_cache.contains(part_key(key, other, stat)):
+                    store_part(other, build_part(other, agg, filters, stat=stat), key, stat, decode=False)
+        return store_part(part, build_part(part, agg, filters, stat=stat), key, stat, decode)
+
+
+def store_part(part, outputs, key, stat='mean', decode=True):
+    """Met en cache les sorties d'une partie (sérialisées sortie par sortie)."""
+    # Sérialisation sortie par sortie pour mesurer la taille de chaque figure
+    with span('serialize'):
+        parts = [json.dumps(o, cls=PlotlyJSONEncoder) for o in outputs]
+    for name, payload in zip(PART_OUTPUTS[part], parts):
+        record_payload(name, len(payload))
+    with span('cache_store'):
+        return result_cache.set_payload(part_key(key, part, stat), '[' + ','.join(parts) + ']', decode=decode)
+
+
+def default_filters(selected_dept):
+    """Filtres par défaut du layout (tous les types, toute la période) pour un département."""
+    annees = metadata['annees']
+    return parse_filters(selected_dept, metadata['types_biens'], 1, 1, annees[0], 31, 12, annees[-1],
+                         [metadata['min_price'], metadata['max_price']], 2)
+
+
+def warmup_tasks():
+    """Combinaisons préchauffées, par priorité : France entière, grandes villes, puis chaque département."""
+    depts = [d for d in POPULAR_DEPARTEMENTS if d in metadata['departements']]
+    depts += [d for d in metadata['departements'] if d not in depts]
+    return [("France entière", default_filters('all'))] + [(f"département {d}", default_filters(d)) for d in depts]
+
+
+def warm_filters(filters):
+    """Calcule et met en cache toutes les parties d'une combinaison (sans renvoyer les sorties)."""
+    key = filter_key(*filters)
+    for part in DASHBOARD_PARTS:
+        if not result_cache.contains(part_key(key, part)):
+            part_result(part, filters, decode=False)
+
+
+def mark_estimate(outputs):
+    """Préfixe les KPIs chiffrés d'un « ≈ » (valeurs estimées sur l'échantillon)."""
+    outputs = list(outputs)
+    for i in (5, 6, 8, 9):  # prix moyen, volume, prix de la commune top, surface
+        if outputs[i] not in ("-", "0"):
+            outputs[i] = f"≈ {outputs[i]}"
+    return outputs
+
+
+@callback(
+    [Output('export-csv', 'href'), Output('export-parquet', 'href')],
+    [Input('dashboard-state', 'data')],
+    prevent_initial_call=True
+)
+def update_export_links(state):
+    """Liens d'export des transactions pour les filtres appliqués et la sélection sur la carte."""
+    if not state:
+        return no_update, no_update
+    selected_dept, selected_types, start_date, end_date, price_range = parse_filters(*state['filters'])[:5]
+    # types vide (aucun type coché) : export vide comme le dashboard, et non tous les types
+    params = {'dept': selected_dept, 'types': ','.join(selected_types or []),
+              'start': start_date.date().isoformat(), 'end': end_date.date().isoformat(),
+              'price_min': price_range[0], 'price_max': price_range[1]}
+    # Sélection compacte (commune cliquée ou polygone du lasso), résolue par l'API : la
+    # liste des codes d'un grand lasso dépasserait la longueur maximale d'une URL
+    selection = state.get('selection')
+    if selection and 'code' in selection:
+        params['communes'] = selection['code']
+    elif selection:
+        params['polygon'] = format_polygon(selection['points'])
+    query = urlencode(params, doseq=True, safe=',;')
+    return [f"/api/v1/export?format={fmt}&{query}" for fmt in ('csv', 'parquet')]
+
+
+# Rendu progressif : preview_dashboard répond au clic et publie les filtres appliqués dans
+# dashboard-state ; chaque partie (carte, courbe, camembert, top 10, histogramme, KPIs) a
+# ensuite son callback, exécutés en parallèle sur les agrégats partagés (dashboard_state).
+# Pour la France entière (hors cache), preview_dashboard affiche d'abord une estimation sur
+# l'échantillon stratifié, signalée par le bandeau, que les parties remplacent une à une.
+@callback(
+    dashboard_outputs(allow_duplicate=True) + [Output('estimate-badge', 'children'), Output('dashboard-state', 'data'),
+                                               Output('selection-info', 'children')],
+    [Input('btn-update', 'n_clicks')],
+    FILTER_STATES + [State('filter-stat', 'value')],
+    prevent_initial_call='initial_duplicate'
+)
+@instrument('preview_dashboard')
+def preview_dashboard(n_clicks, *values):
+    *values, stat = values
+    filters = parse_filters(*values)
+    # Nouvelle carte : la sélection précédente est abandonnée
+    state = {'key': f"{filter_key(*filters)}|{stat}", 'filters': list(values), 'stat': stat, 'n_clicks': n_clicks,
+             'selection': None}
+    with span('cache_lookup'):
+        cached = is_cached(filters, stat)
+    if filters[0] != 'all' or cached:
+        # Département ou combinaison en cache : les parties affichent directement le résultat exact
+        return [no_update] * len(DASHBOARD_OUTPUTS) + [None, state, None]
+
+    with span('data_ready'):
+        preview = dataset.get().preview
+    outputs = mark_estimate(compute_dashboard(*filters, backend=preview, stat=stat))
+    n_sample = f"{preview.rows:,}".replace(",", " ")
+    badge = f"Estimation sur un échantillon de {n_sample} transactions, calcul exact en cours..."
+    return outputs + [badge, state, None]
+
+
+@functools.lru_cache(maxsize=64)
+def _polygon_communes(points):
+    with span('spatial_query'):
+        return tuple(dataset.get().spatial.polygon(json.loads(points)))
+
+
+def selection_communes(selection):
+    """
+    Codes commune d'une sélection sur la carte (None : pas de sélection) : commune cliquée,
+    ou communes qui intersectent le lasso / rectangle (index spatial, voir spatial.py).
+    """
+    if not selection:
+        return None
+    if 'code' in selection:
+        return (selection['code'],)
+    return _polygon_communes(json.dumps(selection['points']))
+
+
+def compact_polygon(points, max_points=100, decimals=5):
+    """
+    Polygone du lasso allégé (au plus max_points sommets, coordonnées au mètre près) : il
+    tient en ~2 Ko dans le lien d'export, et le dashboard comme l'export résolvent ce polygone.
+    """
+    step = -(-len(points) // max_points)
+    return [[round(float(x), decimals), round(float(y), decimals)] for x, y in points[::step]]
+
+
+def map_selection(prop_id, click_data, selected_data):
+    """Événement de la carte -> sélection ({'code'} ou {'points'} du polygone), None si vide."""
+    if prop_id == 'map-graph.clickData':
+        points = (click_data or {}).get('points') or []
+        return {'code': str(points[0]['location'])} if points and 'location' in points[0] else None
+    if prop_id == 'map-graph.selectedData' and selected_data:
+        if 'lassoPoints' in selected_data:
+            return {'points': compact_polygon(selected_data['lassoPoints']['mapbox'])}
+        if 'range' in selected_data:
+            (lon0, lat0), (lon1, lat1) = selected_data['range']['mapbox']
+            return {'points': compact_polygon([[lon0, lat0], [lon1, lat0], [lon1, lat1], [lon0, lat1]])}
+    return None
+
+
+# Filtrage croisé : un clic ou un lasso sur la carte restreint les autres parties aux
+# communes sélectionnées ; la carte elle-même reste affichée telle quelle
+@callback(
+    [Output('dashboard-state', 'data', allow_duplicate=True),
+     Output('selection-info', 'children', allow_duplicate=True)],
+    [Input('map-graph', 'clickData'), Input('map-graph', 'selectedData'), Input('btn-clear-selection', 'n_clicks')],
+    [State('dashboard-state', 'data')],
+    prevent_initial_call=True
+)
+@instrument('select_communes')
+def select_communes(click_data, selected_data, n_clear, state):
+    if not state:
+        return no_update, no_update
+    selection = map_selection(dash.ctx.triggered[0]['prop_id'], click_data, selected_data)
+    if selection == state.get('selection'):
+        return no_update, no_update
+    communes = selection_communes(selection)
+    filters = parse_filters(*state['filters'], communes=communes)
+    state = dict(state, key=f"{filter_key(*filters)}|{state['stat']}", selection=selection, keep_map=True)
+    if communes is None:
+        return state, None
+    n = len(communes)
+    return state, f"{n} commune{'s' if n > 1 else ''} sélectionnée{'s' if n > 1 else ''} sur la carte"
+
+
+def register_part_callback(part):
+    """Callback d'une partie : résultat exact pour les filtres de dashboard-state."""
+    @callback(
+        dashboard_outputs(PART_OUTPUTS[part]) + [Output({'type': 'part-done', 'part': part}, 'data')],
+        [Input('dashboard-state', 'data')],
+        prevent_initial_call=True
+    )
+    @instrument(f'update_{part}')
+    def update_part(state):
+        if part == 'map':
+            # La carte montre toutes les communes (source de la sélection) : inchangée par un clic ou un lasso
+            if state.get('keep_map'):
+                return [no_update, state['key']]
+            filters = parse_filters(*state['filters'])
+        else:
+            filters = parse_filters(*state['filters'], communes=selection_communes(state.get('selection')))
+        return part_result(part, filters, state.get('stat', 'mean')) + [state['key']]
+    return update_part
+
+
+for _part in DASHBOARD_PARTS:
+    register_part_callback(_part)
+
+# Bandeau d'estimation retiré quand toutes les parties ont rendu le résultat exact
+clientside_callback(
+    ClientsideFunction(namespace='immoviz', function_name='clear_badge'),
+    Output('estimate-badge', 'children', allow_duplicate=True),
+    [Input({'type': 'part-done', 'part': dash.ALL}, 'data')],
+    [State('dashboard-state', 'data')],
+    prevent_initial_call=True
+)
+
+
+def dashboard_aggregates(selected_dept, selected_types, start_date, end_date, price_range, min_sales, communes=None,
+                         backend=None):
+    """
+    Agrégats du dashboard, sans figure (partagés par les parties et l'API JSON).
+    Retourne None si aucune vente, sinon un dict : 'result' (sorties du moteur de requête),
+    'kpis', 'city_stats' (prix moyen et ventes par commune), 'map' (communes affichées
+    sur la carte) et 'top10' (communes les plus chères). Quantiles : voir with_quantiles.
+    """
+    # Attend la fin du chargement (ou le déclenche) à la première requête
+    with span('data_ready'):
+        data = dataset.get()
+    backend = backend or data.backend
+
+    # Agrégats calculés par le moteur de requête (KPIs, carte, top 10, évolution)
+    with span('query') as s:
+        result = backend.aggregate(selected_dept, selected_types, start_date, end_date, price_range, communes)
+        s['rows'] = len(result['communes'])
+    totals = result['totals']
+
+    if totals['nb_ventes'] == 0:
+        return None
 
     # --- KPIs ---
-    avg_price = filtered_df['prix_m2'].mean()
-    total_vol = len(filtered_df)
-    avg_surface = filtered_df['surface_reelle_bati'].mean()
+    avg_price = totals['sum_prix_m2'] / totals['nb_ventes']
+    total_vol = int(totals['nb_ventes'])
+    avg_surface = totals['sum_surface'] / totals['nb_ventes']
     
-    city_stats = filtered_df.groupby('nom_commune').agg({'prix_m2': 'mean', 'valeur_fonciere': 'count'})
-    valid_cities = city_stats[city_stats['valeur_fonciere'] >= 5]
-    if not valid_cities.empty:
-        top_city_row = valid_cities['prix_m2'].idxmax()
-        top_city_price = valid_cities['prix_m2'].max()
-    else:
-        top_city_row = "-"
-        top_city_price = 0
-
-    kpi_price_str = f"{avg_price:.0f}"
-    kpi_vol_str = f"{total_vol:,}".replace(",", " ")
-    kpi_top_city_str = str(top_city_row)
-    kpi_top_price_str = f"{top_city_price:.0f} €/m²"
-    kpi_surf_str = f"{avg_surface:.0f}"
+    with span('groupby', rows=len(result['communes'])):
+        by_city = result['communes'].groupby('nom_commune')[['sum_prix_m2', 'nb_ventes']].sum()
+        city_stats = pd.DataFrame({'prix_m2': by_city['sum_prix_m2'] / by_city['nb_ventes'],
+                                   'valeur_fonciere': by_city['nb_ventes']})
+    top_city_row, top_city_price = top_city(city_stats, 'prix_m2')
+    top_cities = top_ten(city_stats, 'prix_m2')
 
     # --- MAP DATA PREPARATION ---
-    df_map_ag = filtered_df.groupby(['code_commune', 'nom_commune', 'code_departement'])['prix_m2'].agg(['mean', 'count']).reset_index()
-    df_map_ag.columns = ['code_commune', 'nom_commune', 'code_departement', 'prix_moyen', 'nb_ventes']
+    df_map_ag = result['communes'][['code_commune', 'nom_commune', 'code_departement']].copy()
+    df_map_ag['prix_moyen'] = result['communes']['sum_prix_m2'] / result['communes']['nb_ventes']
+    df_map_ag['nb_ventes'] = result['communes']['nb_ventes'].astype(int)
     
     min_s = min_sales if min_sales is not None else 0
     df_map_ag = df_map_ag[df_map_ag['nb_ventes'] >= min_s] 
-    
+
+    return {
+        'result': result,
+        'kpis': {'avg_price': avg_price, 'total_vol': total_vol, 'avg_surface': avg_surface,
+                 'top_city': top_city_row, 'top_city_price': top_city_price},
+        'city_stats': city_stats,
+        'map': df_map_ag,
+        'top10': top_cities,
+    }
+
+
+def map_figure(agg, selected_dept, stat='mean'):
+    """Carte choroplèthe des prix par commune (moyenne ou quantile, voir PRICE_STATS)."""
+    data = dataset.get()
+    geo_store, dept_centers = data.geo_store, data.dept_centers
+    df_map_ag = agg['map']
+
     if not df_map_ag.empty:
         df_map_ag = apply_geojson_logic(df_map_ag)
         
@@ -265,64 +507,189 @@ def update_dashboard(n_clicks, selected_dept, selected_types, s_day, s_month, e_
 
         if selected_dept != 'all':
              if selected_dept in dept_centers:
-                 map_center = dept_centers[selected_dept]
-                 if len(selected_dept) == 3: # DOM
-                     zoom = 8.5
-                 elif selected_dept == '75': # Paris
-                     zoom = 11
-                 else:
-                     zoom = 8.5 
+                 # Centre et zoom ajustés à l'emprise du département
+                 map_center, zoom = map_view(dept_centers[selected_dept]['bbox'])
              else:
                  zoom = 6 
-        else:
-             zoom = 5
         
-        fig_map = px.choropleth_mapbox(
-            df_map_ag,
-            geojson=geojson,
-            locations='code_geojson',
-            featureidkey="properties.code",
-            color='prix_moyen',
-            color_continuous_scale="Spectral_r",
-            range_color=[1000, 8000],
-            mapbox_style="carto-positron",
-            zoom=zoom, 
-            center=map_center,
-            opacity=0.6,
-            hover_name='nom_commune',
-            hover_data={'prix_moyen':':.0f', 'nb_ventes':True},
-        )
-        fig_map.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+        # Seules les communes affichées, au niveau de détail du zoom
+        with span('geo_subset', rows=len(df_map_ag)):
+            geojson_view = geo_store.subset(df_map_ag['code_geojson'].astype(str), level_for_zoom(zoom))
+
+        color = 'prix_moyen' if stat == 'mean' else stat
+        with span('fig_map', rows=len(df_map_ag)):
+            fig_map = px.choropleth_mapbox(
+                df_map_ag,
+                geojson=geojson_view,
+                locations='code_geojson',
+                featureidkey="properties.code",
+                color=color,
+                color_continuous_scale="Spectral_r",
+                range_color=[1000, 8000],
+                mapbox_style="carto-positron",
+                zoom=zoom, 
+                center=map_center,
+                opacity=0.6,
+                hover_name='nom_commune',
+                hover_data={color:':.0f', 'nb_ventes':True},
+                labels={} if stat == 'mean' else {stat: PRICE_STATS[stat]},
+            )
+            fig_map.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
     else:
         fig_map = px.scatter_mapbox(bs="carto-positron", zoom=5)
-
-    # --- CHARTS ---
-    
-    # 1. Line
-    df_evol = filtered_df.groupby('month_date')['prix_m2'].mean().reset_index()
-    df_evol['month_date'] = df_evol['month_date'].astype(str)
-    fig_line = px.line(df_evol, x='month_date', y='prix_m2', markers=True)
-    fig_line.update_layout(margin=dict(l=20, r=20, t=20, b=20), paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
-
-    # 2. Pie
-    fig_pie = px.pie(filtered_df, names='type_local', values='valeur_fonciere', hole=0.4,
-                     color='type_local', color_discrete_map={'Maison':'#e74c3c', 'Appartement':'#3498db'})
-    fig_pie.update_layout(margin=dict(l=20, r=20, t=20, b=20), paper_bgcolor='rgba(0,0,0,0)', showlegend=True)
-    
-    # 3. Bar Top 10
-    top_cities = city_stats[city_stats['valeur_fonciere'] > 10].nlargest(10, 'prix_m2').sort_values('prix_m2', ascending=True).reset_index()
-    if not top_cities.empty:
-        fig_bar = px.bar(top_cities, x='prix_m2', y='nom_commune', orientation='h', 
-                         text_auto='.0f', color='prix_m2', color_continuous_scale='Viridis')
-        fig_bar.update_layout(margin=dict(l=20, r=20, t=20, b=20), paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', coloraxis_showscale=False)
+    return fig_map
+
+
+def line_figure(agg):
+    """Évolution mensuelle du prix moyen au m²."""
+    result = agg['result']
+    with span('fig_line', rows=len(result['monthly'])):
+        df_evol = result['monthly'][['month_date']].copy()
+        df_evol['prix_m2'] = result['monthly']['sum_prix_m2'] / result['monthly']['nb_ventes']
+        fig_line = px.line(df_evol, x='month_date', y='prix_m2', markers=True)
+        fig_line.update_layout(margin=dict(l=20, r=20, t=20, b=20), paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
+    return fig_line
+
+
+def bar_figure(agg, stat='mean'):
+    """Top 10 des communes les plus chères (selon la statistique choisie)."""
+    with span('fig_bar', rows=len(agg['city_stats'])):
+        column = stat_column(stat)
+        top_cities = agg['top10'] if stat == 'mean' else top_ten(agg['city_stats'], column)
+        if not top_cities.empty:
+            fig_bar = px.bar(top_cities, x=column, y='nom_commune', orientation='h', 
+                             text_auto='.0f', color=column, color_continuous_scale='Viridis',
+                             labels={} if stat == 'mean' else {column: PRICE_STATS[stat]})
+            fig_bar.update_layout(margin=dict(l=20, r=20, t=20, b=20), paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', coloraxis_showscale=False)
+        else:
+            fig_bar = px.bar(title="Pas assez de données")
+    return fig_bar
+
+
+def hist_figure(filters, backend=None):
+    """Histogramme des prix/m² : seules les classes des prix filtrés sont calculées (par le moteur)."""
+    selected_dept, selected_types, start_date, end_date, price_range, _, communes = filters
+    backend = backend or dataset.get().backend
+    with span('histogram', rows=backend.rows):
+        df_hist = backend.histogram(selected_dept, selected_types, start_date, end_date, price_range, communes, nbins=50)
+    if df_hist['count'].sum() == 0:
+        return empty_figure()
+    with span('fig_hist', rows=int(df_hist['count'].sum())):
+        return build_histogram(df_hist)
+
+
+def kpi_texts(agg, stat='mean'):
+    """
+    Textes des KPIs : prix (moyen ou quantile), volume, commune la plus chère et son prix,
+    surface, libellé du KPI de prix.
+    """
+    kpis = agg['kpis']
+    if stat == 'mean':
+        price, city, city_price = kpis['avg_price'], kpis['top_city'], kpis['top_city_price']
     else:
-        fig_bar = px.bar(title="Pas assez de données")
+        price = kpis['quantiles'][stat]
+        city, city_price = top_city(agg['city_stats'], stat)
+    kpi_price_str = f"{price:.0f}"
+    kpi_vol_str = f"{kpis['total_vol']:,}".replace(",", " ")
+    kpi_top_city_str = str(city)
+    kpi_top_price_str = f"{city_price:.0f} €/m²"
+    kpi_surf_str = f"{kpis['avg_surface']:.0f}"
+    return [kpi_price_str, kpi_vol_str, kpi_top_city_str, kpi_top_price_str, kpi_surf_str, PRICE_STATS[stat]]
+
+
+def empty_figure():
+    return px.scatter(title="Aucune donnée disponible pour ces filtres")
+
+
+def build_part(part, agg, filters, backend=None, stat='mean'):
+    """
+    Sorties d'une partie (voir PART_OUTPUTS) à partir des agrégats de dashboard_aggregates
+    (None : aucune vente pour ces filtres). L'histogramme n'utilise que les filtres.
+    """
+    if part == 'hist':
+        return [hist_figure(filters, backend)]
+    if agg is None:
+        return ["-", "0", "-", "-", "-", PRICE_STATS[stat]] if part == 'kpis' else [empty_figure()]
+    if stat != 'mean' and part in STAT_PARTS:
+        agg = with_quantiles(agg, filters, backend)
+    if part == 'map':
+        return [map_figure(agg, filters[0], stat)]
+    if part == 'line':
+        return [line_figure(agg)]
+    if part == 'pie':
+        with span('fig_pie', rows=len(agg['result']['types'])):
+            return [build_pie(agg['result']['types'])]
+    if part == 'bar':
+        return [bar_figure(agg, stat)]
+    return kpi_texts(agg, stat)
+
+
+def price_quantiles(filters, backend=None):
+    """
+    Quantiles des prix/m² (p10, p50, p90) par commune et de l'ensemble, à partir des
+    esquisses du moteur de requête. Calculés seulement si une statistique autre que la
+    moyenne est demandée ; les résultats exacts sont partagés comme dashboard_state.
+    """
+    def compute():
+        selected_dept, selected_types, start_date, end_date, price_range, _, communes = filters
+        with span('sketches') as s:
+            sketches = (backend or dataset.get().backend).sketches(selected_dept, selected_types,
+                                                                   start_date, end_date, price_range, communes)
+            s['rows'] = len(sketches)
+        with span('quantiles', rows=len(sketches)):
+            return {'totals': frame_quantiles(sketches, []).iloc[0].to_dict(),
+                    'city': frame_quantiles(sketches, ['nom_commune']),
+                    'commune': frame_quantiles(sketches, ['code_commune'])}
+
+    if backend is not None:
+        return compute()
+    return state_cache.get_or_compute(filter_key(*filters) + "|quantiles", compute)
+
+
+def with_quantiles(agg, filters, backend=None):
+    """Agrégats complétés des quantiles : colonnes p10/p50/p90 dans city_stats et map, kpis['quantiles']."""
+    q = price_quantiles(filters, backend)
+    return dict(agg, city_stats=agg['city_stats'].join(q['city']),
+                map=agg['map'].join(q['commune'], on='code_commune'),
+                kpis=dict(agg['kpis'], quantiles=q['totals']))
+
+
+def stat_column(stat):
+    """Colonne de city_stats pour une statistique de PRICE_STATS."""
+    return 'prix_m2' if stat == 'mean' else stat
+
+
+def top_city(city_stats, column):
+    """Commune la plus chère (au moins 5 ventes) et son prix : ("-", 0) si aucune."""
+    valid_cities = city_stats[city_stats['valeur_fonciere'] >= 5]
+    if valid_cities.empty:
+        return "-", 0
+    return valid_cities[column].idxmax(), valid_cities[column].max()
+
+
+def top_ten(city_stats, column):
+    """Dix communes les plus chères (plus de 10 ventes), de la moins chère à la plus chère."""
+    return city_stats[city_stats['valeur_fonciere'] > 10].nlargest(10, column).sort_values(column, ascending=True).reset_index()
+
+
+def compute_dashboard(selected_dept, selected_types, start_date, end_date, price_range, min_sales, communes=None,
+                      backend=None, stat='mean'):
+    """
+    Figures et KPIs de toutes les parties ; communes : sélection sur la carte ; backend :
+    moteur de requête (par défaut celui du jeu de données) ; stat : statistique de prix.
+    """
+    filters = (selected_dept, selected_types, start_date, end_date, price_range, min_sales, communes)
+    agg = dashboard_aggregates(*filters, backend=backend)
+    outputs = []
+    for part in DASHBOARD_PARTS:
+        outputs += build_part(part, agg, filters, backend, stat)
+    return outputs
+
 
-    # 4. Hist
-    fig_hist = px.histogram(filtered_df, x="prix_m2", nbins=50)
-    fig_hist.update_layout(bargap=0.1, margin=dict(l=20, r=20, t=20, b=20), paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
+def wsgi():
+    """Point d'entrée WSGI, une application par worker : gunicorn "main:wsgi()"."""
+    return create_app().server
 
-    return fig_map, fig_line, fig_pie, fig_bar, fig_hist, kpi_price_str, kpi_vol_str, kpi_top_city_str, kpi_top_price_str, kpi_surf_str
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+# Couleurs communes aux graphiques par type de bien
+TYPE_COLORS = {'Maison': '#e74c3c', 'Appartement': '#3498db'}
+
+
+def nice_bin_size(v_min, v_max, nbins):
+    """
+    Pas d'histogramme « rond » (2, 5, 10 x 10^k), comme l'autobin de Plotly
+    avec nbins : on garde le même découpage que px.histogram.
+    """
+    rough = (v_max - v_min) / nbins
+    if rough <= 0:
+        return 1.0
+    base = 10 ** np.floor(np.log10(rough))
+    for step in (2, 5, 10):
+        if rough / base <= step:
+            return float(step * base)
+    return float(10 * base)
+
+
+def histogram_bins(values, nbins=50, weights=None):
+    """
+    Histogramme calculé côté serveur avec NumPy.
+    Retourne un DataFrame (centre de classe, effectif) et la largeur des classes.
+    weights : poids de chaque valeur (effectifs estimés à partir d'un échantillon).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return pd.DataFrame({'prix_m2': np.empty(0), 'count': np.empty(0, dtype=np.int64)}), 0.0
+    size = nice_bin_size(values.min(), values.max(), nbins)
+    start = np.floor(values.min() / size) * size
+    n = int(np.floor((values.max() - start) / size)) + 1
+    counts, edges = np.histogram(values, bins=start + size * np.arange(n + 1), weights=weights)
+    return pd.DataFrame({'prix_m2': edges[:-1] + size / 2, 'count': counts}), size
+
+
+def build_pie(df_types):
+    """Camembert de la valeur foncière par type (une ligne par type de bien)."""
+    fig = px.pie(df_types, names='type_local', values='sum_valeur', hole=0.4,
+                 color='type_local', color_discrete_map=TYPE_COLORS,
+                 labels={'sum_valeur': 'valeur_fonciere'})
+    fig.update_layout(margin=dict(l=20, r=20, t=20, b=20), paper_bgcolor='rgba(0,0,0,0)', showlegend=True)
+    return fig
+
+
+def build_histogram(df_hist):
+    """
+    Distribution des prix/m² à partir des classes déjà calculées par le moteur de requête
+    (histogram_bins) : seules les classes (au plus nbins barres) sont envoyées.
+    """
+    fig = px.bar(df_hist, x='prix_m2', y='count')
+    fig.update_traces(hovertemplate="prix_m2=%{x}<br>count=%{y}<extra></extra>")
+    fig.update_layout(bargap=0.1, margin=dict(l=20, r=20, t=20, b=20), paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
+    return fig
@@ -1,6 +1,12 @@
 from dash import dcc, html
 import dash_bootstrap_components as dbc
 
+# Parties du dashboard, chacune rendue par son propre callback (voir main.py)
+DASHBOARD_PARTS = ['map', 'line', 'pie', 'bar', 'hist', 'kpis']
+
+# Statistique de prix/m² de la carte, du top 10 et des KPIs (quantiles : voir sketch.py)
+PRICE_STATS = {'mean': "Prix Moyen", 'p50': "Prix Médian", 'p10': "Prix P10", 'p90': "Prix P90"}
+
 # Dictionnaire des noms de départements pour l'affichage 
 DEPARTEMENTS = {
     '01': 'Ain', '02': 'Aisne', '03': 'Allier', '04': 'Alpes-de-Haute-Provence', 
@@ -29,7 +35,7 @@ DEPARTEMENTS = {
     '974': 'La Réunion', '976': 'Mayotte'
 }
 
-def create_layout(dept_codes, types_biens, min_price, max_price):
+def create_layout(dept_codes, types_biens, min_price, max_price, years):
     sidebar = html.Div(
         [
             html.Div([
@@ -56,7 +62,7 @@ def create_layout(dept_codes, types_biens, min_price, max_price):
                 style={'color': '#ecf0f1'}
             ),
 
-            html.Label("Date Début (2023)", className="filter-label"),
+            html.Label("Date Début", className="filter-label"),
             dbc.Row([
                 dbc.Col(dcc.Dropdown(
                     id='start-day',
@@ -64,17 +70,24 @@ def create_layout(dept_codes, types_biens, min_price, max_price):
                     value=1,
                     clearable=False,
                     placeholder="Jour"
-                ), width=6),
+                ), width=4),
                 dbc.Col(dcc.Dropdown(
                     id='start-month',
                     options=[{'label': i, 'value': i} for i in range(1, 13)],
                     value=1,
                     clearable=False,
                     placeholder="Mois"
-                ), width=6),
+                ), width=4),
+                dbc.Col(dcc.Dropdown(
+                    id='start-year',
+                    options=[{'label': y, 'value': y} for y in years],
+                    value=years[0],
+                    clearable=False,
+                    placeholder="Année"
+                ), width=4),
             ], className="mb-2"),
 
-            html.Label("Date Fin (2023)", className="filter-label"),
+            html.Label("Date Fin", className="filter-label"),
             dbc.Row([
                 dbc.Col(dcc.Dropdown(
                     id='end-day',
@@ -82,14 +95,21 @@ def create_layout(dept_codes, types_biens, min_price, max_price):
                     value=31,
                     clearable=False,
                     placeholder="Jour"
-                ), width=6),
+                ), width=4),
                 dbc.Col(dcc.Dropdown(
                     id='end-month',
                     options=[{'label': i, 'value': i} for i in range(1, 13)],
                     value=12,
                     clearable=False,
                     placeholder="Mois"
-                ), width=6),
+                ), width=4),
+                dbc.Col(dcc.Dropdown(
+                    id='end-year',
+                    options=[{'label': y, 'value': y} for y in years],
+                    value=years[-1],
+                    clearable=False,
+                    placeholder="Année"
+                ), width=4),
             ], className="mb-2"),
 
             
@@ -103,6 +123,15 @@ def create_layout(dept_codes, types_biens, min_price, max_price):
                 className="mb-3"
             ),
 
+            html.Label("Statistique de prix", className="filter-label"),
+            dcc.Dropdown(
+                id='filter-stat',
+                options=[{'label': label, 'value': stat} for stat, label in PRICE_STATS.items()],
+                value='mean',
+                clearable=False,
+                className="mb-3"
+            ),
+
             html.Label("Nb Ventes Min (Commune)", className="filter-label"),
             dcc.Input(
                 id='filter-min-sales',
@@ -114,6 +143,18 @@ def create_layout(dept_codes, types_biens, min_price, max_price):
 
             html.Button("Actualiser", id='btn-update', className="btn-update"),
 
+            # Transactions des filtres appliqués (liens mis à jour à chaque actualisation)
+            html.Div([
+                html.A("Exporter CSV", id='export-csv', href="/api/v1/export?format=csv", className="btn-export"),
+                html.A("Parquet", id='export-parquet', href="/api/v1/export?format=parquet", className="btn-export"),
+            ], className="export-links"),
+
+            # Sélection sur la carte (clic ou lasso) : filtre les autres graphiques
+            html.Div([
+                html.Small(id='selection-info', className="text-muted"),
+                html.Button("Effacer la sélection", id='btn-clear-selection', className="btn-export"),
+            ], className="selection-bar"),
+
             html.Div([
                 html.Small("Modifiez les filtres puis cliquez sur Actualiser.", className="text-muted")
             ], style={'margin-top': '1rem'})
@@ -123,10 +164,16 @@ def create_layout(dept_codes, types_biens, min_price, max_price):
 
     content = html.Div(
         [
+            # Aperçu sur échantillon : signalé tant que le résultat exact n'est pas arrivé
+            html.Div(id='estimate-badge', className="estimate-badge"),
+            # Filtres appliqués (clé côté serveur) et clé rendue par chaque partie
+            dcc.Store(id='dashboard-state'),
+            *[dcc.Store(id={'type': 'part-done', 'part': part}) for part in DASHBOARD_PARTS],
+
             # KPIs Row
             dbc.Row([
                 dbc.Col(dbc.Card([
-                    dbc.CardHeader("Prix Moyen"),
+                    dbc.CardHeader("Prix Moyen", id='kpi-price-label'),
                     dbc.CardBody([
                         html.H2(id='kpi-price', className="kpi-value"),
                         html.Small("€ / m²", className="text-muted")
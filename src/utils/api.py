@@ -0,0 +1,236 @@
+# api.py
+"""
+API JSON en lecture seule, servie par le serveur Flask de Dash : les agrégats du
+dashboard (KPIs, carte des communes, évolution mensuelle, top 10) pour un jeu de
+filtres, sans construire de figure. Plusieurs départements par appel :
+
+    GET /api/v1/aggregates?dept=75,69,13&types=Appartement&start=2023-01-01&end=2023-06-30
+
+Les réponses sont compressées (gzip) et portent un ETag dérivé de la version des
+données : un client qui renvoie If-None-Match reçoit 304 tant qu'elles n'ont pas changé.
+Les transactions elles-mêmes s'exportent en flux par /api/v1/export (voir export.py).
+"""
+import gzip
+import hashlib
+import json
+import pandas as pd
+
+from src.utils.cache import filter_key
+from src.utils.export import EXPORT_FORMATS, export_chunks
+from src.utils.load_data import HAS_PYARROW
+from src.utils.metrics import instrument
+
+API_PREFIX = "/api/v1"
+# Parties disponibles dans la réponse de chaque département (toutes par défaut)
+PARTS = ('kpis', 'communes', 'monthly', 'top10')
+MAX_BATCH = 200
+DEFAULT_MIN_SALES = 2  # même défaut que le filtre du dashboard
+MAX_POLYGON_POINTS = 1000  # sommets au plus dans le paramètre polygon de l'export
+
+
+def _split(args, name):
+    """Valeurs d'un paramètre répété ou séparé par des virgules (dept=75&dept=69 ou dept=75,69)."""
+    values = []
+    for v in args.getlist(name):
+        values += [x.strip() for x in v.split(',') if x.strip()]
+    return list(dict.fromkeys(values))
+
+
+def format_polygon(points):
+    """Polygone de sélection -> paramètre polygon (lon,lat;lon,lat;...), bien plus court qu'une liste de codes."""
+    return ';'.join(f"{float(x)},{float(y)}" for x, y in points)
+
+
+def parse_polygon(value):
+    """Paramètre polygon -> [[lon, lat], ...] (au moins trois sommets). ValueError si invalide."""
+    points = [[float(c) for c in p.split(',')] for p in value.split(';') if p.strip()]
+    if len(points) < 3 or any(len(p) != 2 for p in points):
+        raise ValueError("polygon : au moins trois sommets lon,lat séparés par des ;")
+    if len(points) > MAX_POLYGON_POINTS:
+        raise ValueError(f"polygon : au plus {MAX_POLYGON_POINTS} sommets")
+    return points
+
+
+def parse_query(args, metadata):
+    """
+    Paramètres de la requête -> (départements, filtres communs, parties).
+    Les filtres absents prennent les valeurs par défaut du dashboard. ValueError si invalide.
+    """
+    depts = _split(args, 'dept') or ['all']
+    unknown = [d for d in depts if d != 'all' and d not in metadata['departements']]
+    if unknown:
+        raise ValueError(f"Département(s) inconnu(s) : {', '.join(unknown)}")
+    if len(depts) > MAX_BATCH:
+        raise ValueError(f"Au plus {MAX_BATCH} départements par appel")
+
+    # types absent : tous les types ; types présent mais vide (types=) : aucun
+    types = _split(args, 'types') if 'types' in args else list(metadata['types_biens'])
+    annees = metadata['annees']
+    start = pd.Timestamp(args.get('start', f"{annees[0]}-01-01"))
+    end = pd.Timestamp(args.get('end', f"{annees[-1]}-12-31"))
+    price_range = [float(args.get('price_min', metadata['min_price'])),
+                   float(args.get('price_max', metadata['max_price']))]
+    min_sales = int(args.get('min_sales', DEFAULT_MIN_SALES))
+
+    parts = _split(args, 'parts') or list(PARTS)
+    if any(p not in PARTS for p in parts):
+        raise ValueError(f"Parties disponibles : {', '.join(PARTS)}")
+    return depts, (types, start, end, price_range, min_sales), parts
+
+
+def _columns(df, columns, rounded=()):
+    """DataFrame -> JSON compact par colonnes ({colonne: [valeurs]})."""
+    df = df[columns].round({c: 2 for c in rounded})
+    return df.to_dict('list')
+
+
+def aggregates_json(agg, parts):
+    """Agrégats de dashboard_aggregates (ou None si aucune vente) -> dict sérialisable."""
+    if agg is None:
+        empty = {
+            'kpis': {'prix_moyen': None, 'nb_ventes': 0, 'surface_moyenne': None,
+                     'commune_top': None, 'prix_commune_top': None},
+            'communes': {c: [] for c in ('code_commune', 'nom_commune', 'code_departement', 'prix_moyen', 'nb_ventes')},
+            'monthly': {c: [] for c in ('mois', 'prix_moyen', 'nb_ventes')},
+            'top10': {c: [] for c in ('nom_commune', 'prix_moyen', 'nb_ventes')},
+        }
+        return {p: empty[p] for p in parts}
+
+    out = {}
+    if 'kpis' in parts:
+        kpis = agg['kpis']
+        out['kpis'] = {
+            'prix_moyen': round(float(kpis['avg_price']), 2),
+            'nb_ventes': int(kpis['total_vol']),
+            'surface_moyenne': round(float(kpis['avg_surface']), 2),
+            'commune_top': None if kpis['top_city'] == "-" else str(kpis['top_city']),
+            'prix_commune_top': round(float(kpis['top_city_price']), 2) if kpis['top_city'] != "-" else None,
+        }
+    if 'communes' in parts:
+        out['communes'] = _columns(agg['map'], ['code_commune', 'nom_commune', 'code_departement', 'prix_moyen', 'nb_ventes'],
+                                   rounded=['prix_moyen'])
+    if 'monthly' in parts:
+        monthly = agg['result']['monthly']
+        monthly = pd.DataFrame({'mois': monthly['month_date'].astype(str),
+                                'prix_moyen': monthly['sum_prix_m2'] / monthly['nb_ventes'],
+                                'nb_ventes': monthly['nb_ventes'].astype(int)})
+        out['monthly'] = _columns(monthly, ['mois', 'prix_moyen', 'nb_ventes'], rounded=['prix_moyen'])
+    if 'top10' in parts:
+        # Du plus cher au moins cher (le graphique du dashboard les affiche dans l'autre sens)
+        top = agg['top10'].iloc[::-1].rename(columns={'prix_m2': 'prix_moyen', 'valeur_fonciere': 'nb_ventes'})
+        top = top.astype({'nb_ventes': int})
+        out['top10'] = _columns(top, ['nom_commune', 'prix_moyen', 'nb_ventes'], rounded=['prix_moyen'])
+    return out
+
+
+def register_api_routes(server, aggregate, metadata, version, cache, is_ready, export_batches=None,
+                        polygon_communes=None):
+    """
+    Routes de l'API sur le serveur Flask.
+    aggregate(filters) : agrégats d'un jeu de filtres (dashboard_aggregates) ;
+    cache : ResultCache (réponses par département) ; is_ready() : données chargées ;
+    export_batches(filters) : lots de transactions filtrées (QueryBackend.export_batches) ;
+    polygon_communes(points) : codes des communes qui intersectent un polygone (index spatial).
+    """
+    from flask import Response, request
+
+    def etag_for(*parts):
+        return hashlib.sha1(json.dumps([version, *parts]).encode()).hexdigest()[:20]
+
+    def respond(body, etag, status=200):
+        response = Response(body, status=status, mimetype="application/json")
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = "public, no-cache"  # réutilisable après revalidation (ETag)
+        response.headers['Vary'] = "Accept-Encoding"
+        if status == 200 and request.accept_encodings['gzip']:
+            response.set_data(gzip.compress(body.encode('utf-8'), compresslevel=6))
+            response.headers['Content-Encoding'] = "gzip"
+        return response
+
+    def not_modified(etag):
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+        return None
+
+    def error(message, status):
+        return Response(json.dumps({'error': message}), status=status, mimetype="application/json")
+
+    @server.route(API_PREFIX + "/metadata")
+    def api_metadata():
+        etag = etag_for('metadata')
+        return not_modified(etag) or respond(json.dumps(dict(metadata, version=version), separators=(',', ':')), etag)
+
+    @server.route(API_PREFIX + "/aggregates")
+    @instrument('api_aggregates')
+    def api_aggregates():
+        try:
+            depts, (types, start, end, price_range, min_sales), parts = parse_query(request.args, metadata)
+        except (ValueError, TypeError) as e:
+            return error(str(e), 400)
+
+        # Même requête et même version des données -> même réponse : rien à recalculer
+        common = filter_key('', types, start, end, price_range, min_sales)
+        etag = etag_for(depts, common, parts)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        if not is_ready():
+            response = error("Données en cours de chargement", 503)
+            response.headers['Retry-After'] = "5"
+            return response
+
+        results = []
+        for dept in depts:
+            filters = (dept, types, start, end, price_range, min_sales)
+            key = f"api:{','.join(parts)}:" + filter_key(*filters)
+            payload = cache.get_payload(key)
+            if payload is None:
+                payload = json.dumps(aggregates_json(aggregate(filters), parts), separators=(',', ':'))
+                cache.set_payload(key, payload, decode=False)
+            results.append(json.dumps(dept) + ':' + payload)
+
+        header = {'version': version, 'types': sorted(types), 'start': str(start.date()), 'end': str(end.date()),
+                  'price_range': price_range, 'min_sales': min_sales}
+        body = json.dumps(header, separators=(',', ':'))[:-1] + ',"results":{' + ','.join(results) + '}}'
+        return respond(body, etag)
+
+    @server.route(API_PREFIX + "/export")
+    def api_export():
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS or export_batches is None:
+            return error(f"Formats disponibles : {', '.join(EXPORT_FORMATS)}", 400)
+        if fmt == 'parquet' and not HAS_PYARROW:
+            return error("L'export Parquet nécessite pyarrow sur le serveur", 400)
+        try:
+            depts, (types, start, end, price_range, min_sales), _ = parse_query(request.args, metadata)
+            # Sélection sur la carte, comme les agrégats du dashboard : codes commune, ou
+            # polygone du lasso résolu ici (un lasso peut couvrir des milliers de communes)
+            communes = tuple(_split(request.args, 'communes')) or None
+            polygon = parse_polygon(request.args['polygon']) if 'polygon' in request.args else None
+            if polygon is not None and communes is not None:
+                raise ValueError("communes et polygon sont exclusifs")
+            if polygon is not None and polygon_communes is None:
+                raise ValueError("polygon : sélection spatiale indisponible")
+        except (ValueError, TypeError) as e:
+            return error(str(e), 400)
+        if not is_ready():
+            response = error("Données en cours de chargement", 503)
+            response.headers['Retry-After'] = "5"
+            return response
+        if polygon is not None:
+            communes = tuple(polygon_communes(polygon))
+
+        def batches():
+            for dept in depts:
+                yield from export_batches((dept, types, start, end, price_range, communes))
+
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        filename = f"immoviz_{'-'.join(depts)}_{start.date()}_{end.date()}.{extension}"
+        # Réponse en flux : pas de Content-Length, chaque lot part dès qu'il est encodé
+        response = Response(export_chunks(batches(), fmt), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    return api_aggregates
@@ -0,0 +1,328 @@
+# backends.py
+"""
+Moteurs de requête du dashboard : filtres et agrégations de update_dashboard.
+
+Chaque moteur retourne les mêmes agrégats (voir DataCube.query) et l'histogramme des
+prix/m² ; le code des figures ne voit jamais les transactions elles-mêmes.
+- 'pandas' (défaut) : DataFrame en mémoire + cube d'agrégats précalculé ;
+- 'duckdb' : requêtes SQL sur le dataset Parquet, filtres et groupby exécutés par
+  DuckDB sur le disque. Rien n'est chargé en mémoire : adapté à l'historique complet
+  (plusieurs dizaines de millions de lignes) sur une machine modeste ;
+- SampleBackend : estimations sur un échantillon stratifié (département × type de bien)
+  tiré une fois au chargement, pour l'aperçu affiché avant le résultat exact.
+
+    IMMOVIZ_BACKEND=duckdb python main.py
+"""
+import importlib.util
+import os
+import numpy as np
+import pandas as pd
+
+from src.components.figures import histogram_bins, nice_bin_size
+from src.utils.cube import MEASURES, day_index, detail_mask
+from src.utils.load_data import DETAIL_COLUMNS, compact_detail, compute_metadata
+from src.utils.sketch import GAMMA, sketch_bin
+
+# duckdb est optionnel : seul le moteur pandas est disponible sans lui. Il n'est importé
+# que par DuckDBBackend (~30 Mo de RSS par processus avec le moteur pandas sinon)
+HAS_DUCKDB = importlib.util.find_spec("duckdb") is not None
+
+DEFAULT_BACKEND = "pandas"
+
+# Échantillon de l'aperçu : taille visée et minimum par strate (département × type).
+# La taille fixe le temps de l'aperçu (surtout la carte : une commune par ligne tirée au plus)
+SAMPLE_ROWS = int(os.environ.get("IMMOVIZ_SAMPLE_ROWS", "5000"))
+MIN_PER_STRATUM = 10
+STRATA = ['code_departement', 'type_local']
+
+# Export des transactions filtrées : colonnes de data_detail, lignes par lot
+EXPORT_COLUMNS = [c for c in DETAIL_COLUMNS if c != 'mois']
+EXPORT_BATCH_ROWS = int(os.environ.get("IMMOVIZ_EXPORT_BATCH_ROWS", "50000"))
+
+
+def sample_sizes(n, rows, total, minimum=MIN_PER_STRATUM):
+    """Lignes tirées par strate : proportionnel à sa taille, au moins minimum (ou toute la strate)."""
+    n = np.asarray(n, dtype=np.float64)
+    return np.minimum(n, np.maximum(minimum, np.ceil(n * rows / max(total, 1))))
+
+
+def stratified_sample(df, rows=SAMPLE_ROWS, minimum=MIN_PER_STRATUM, seed=0):
+    """
+    Échantillon stratifié (tirage sans remise dans chaque strate). La colonne 'weight'
+    (taille de la strate / lignes tirées) redresse les sommes : total estimé = somme pondérée.
+    """
+    n = df.groupby(STRATA, observed=True)['prix_m2'].transform('size').to_numpy()
+    k = sample_sizes(n, rows, len(df), minimum)
+    u = pd.Series(np.random.default_rng(seed).random(len(df)), index=df.index)
+    rank = u.groupby([df[c] for c in STRATA], observed=True).rank(method='first').to_numpy()
+    keep = rank <= k
+    return df[keep].assign(weight=(n / k)[keep].astype(np.float32)).reset_index(drop=True)
+
+
+def export_frame(rows):
+    """Lignes au schéma compact -> colonnes de data_detail (EXPORT_COLUMNS, date en clair)."""
+    out = rows.drop(columns=['day', 'month_date', 'weight'], errors='ignore')
+    out['date_mutation'] = np.datetime64('1970-01-01', 'D') + rows['day'].to_numpy().astype('timedelta64[D]')
+    return out[EXPORT_COLUMNS].reset_index(drop=True)
+
+
+class QueryBackend:
+    """
+    Interface commune des moteurs de requête.
+    communes : codes commune sélectionnés sur la carte (None : toutes les communes).
+    """
+
+    name = None
+    rows = 0  # nombre de transactions interrogeables
+
+    def aggregate(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None):
+        """
+        Agrégats pour un jeu de filtres : dict de DataFrames 'communes' (par commune),
+        'monthly' (par mois), 'types' (par type de bien) et 'totals' (Series des mesures).
+        """
+        raise NotImplementedError
+
+    def histogram(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None, nbins=50):
+        """Classes de l'histogramme des prix/m² filtrés (voir figures.histogram_bins)."""
+        raise NotImplementedError
+
+    def sketches(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None):
+        """
+        Esquisses de quantiles des prix/m² filtrés (voir sketch.py) : effectif par commune
+        et classe de prix (code_commune, nom_commune, code_departement, qbin, nb_ventes).
+        """
+        raise NotImplementedError
+
+    def metadata(self):
+        """Bornes des filtres (voir load_data.compute_metadata)."""
+        raise NotImplementedError
+
+    def export_batches(self, selected_dept, selected_types, start_date, end_date, price_range,
+                       communes=None, batch_rows=EXPORT_BATCH_ROWS):
+        """
+        Transactions filtrées, par DataFrames d'au plus batch_rows lignes (EXPORT_COLUMNS) :
+        la sélection complète n'est jamais en mémoire d'un bloc.
+        """
+        raise NotImplementedError
+
+    def sample(self, rows=SAMPLE_ROWS):
+        """Échantillon stratifié au schéma compact, avec sa colonne 'weight' (voir stratified_sample)."""
+        raise NotImplementedError
+
+
+class PandasBackend(QueryBackend):
+    """Transactions en mémoire (schéma compact) et cube d'agrégats."""
+
+    name = "pandas"
+
+    def __init__(self, df, cube):
+        self.df = df
+        self.cube = cube
+        self.rows = len(df)
+
+    def aggregate(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None):
+        return self.cube.query(selected_dept, selected_types, start_date, end_date, price_range, communes)
+
+    def histogram(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None, nbins=50):
+        mask = detail_mask(self.df, selected_dept, selected_types,
+                           day_index(start_date), day_index(end_date), price_range, communes)
+        return histogram_bins(self.df['prix_m2'].to_numpy()[mask], nbins)[0]
+
+    def sketches(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None):
+        return self.cube.query_sketches(selected_dept, selected_types, start_date, end_date, price_range, communes)
+
+    def metadata(self):
+        return compute_metadata(self.df)
+
+    def export_batches(self, selected_dept, selected_types, start_date, end_date, price_range,
+                       communes=None, batch_rows=EXPORT_BATCH_ROWS):
+        # Masque calculé tranche par tranche (vues sur les colonnes, sans copie du DataFrame)
+        d0, d1 = day_index(start_date), day_index(end_date)
+        for i in range(0, len(self.df), batch_rows):
+            chunk = self.df.iloc[i:i + batch_rows]
+            rows = chunk[detail_mask(chunk, selected_dept, selected_types, d0, d1, price_range, communes)]
+            if len(rows):
+                yield export_frame(rows)
+
+    def sample(self, rows=SAMPLE_ROWS):
+        return stratified_sample(self.df, rows)
+
+
+class DuckDBBackend(QueryBackend):
+    """Requêtes DuckDB sur le dataset Parquet partitionné par année (annee=<année>)."""
+
+    name = "duckdb"
+
+    def __init__(self, parquet_dir):
+        if not HAS_DUCKDB:
+            raise RuntimeError("Le moteur 'duckdb' nécessite le paquet duckdb (pip install duckdb)")
+        if not os.path.isdir(parquet_dir):
+            raise RuntimeError(f"Dataset Parquet introuvable : {parquet_dir} (lancer clean_data.py avec pyarrow)")
+        import duckdb
+        pattern = os.path.join(parquet_dir, "**", "*.parquet").replace("'", "''")
+        self.con = duckdb.connect()
+        self.con.execute(f"CREATE VIEW detail AS SELECT * FROM read_parquet('{pattern}', hive_partitioning = true)")
+        # Lu dans les pieds de page des fichiers Parquet, sans parcourir les données
+        self.rows = self.con.execute("SELECT count(*) FROM detail").fetchone()[0]
+
+    def _query(self, sql, params=()):
+        # Un curseur par requête : la connexion n'est pas partagée entre les threads du serveur
+        return self.con.cursor().execute(sql, list(params))
+
+    def _where(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None):
+        """Clause WHERE des filtres ; l'année élimine directement les partitions hors période."""
+        start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        clauses = ["annee BETWEEN ? AND ?", "date_mutation >= ?", "date_mutation <= ?",
+                   "prix_m2 >= ?", "prix_m2 <= ?"]
+        params = [start_date.year, end_date.year, start_date.to_pydatetime(), end_date.to_pydatetime(),
+                  float(price_range[0]), float(price_range[1])]
+        types = list(selected_types or [])
+        clauses.append(f"type_local IN ({', '.join('?' * len(types))})" if types else "FALSE")
+        params += types
+        if selected_dept != 'all':
+            clauses.append("code_departement = ?")
+            params.append(selected_dept)
+        if communes is not None:
+            clauses.append("list_contains(?, code_commune)")
+            params.append(list(communes))
+        return " AND ".join(clauses), params
+
+    def _group(self, keys, where, params):
+        cols = ", ".join(keys)
+        return self._query(f"""
+            SELECT {cols},
+                   count(*)::DOUBLE AS nb_ventes,
+                   sum(prix_m2) AS sum_prix_m2,
+                   sum(valeur_fonciere) AS sum_valeur,
+                   sum(surface_reelle_bati) AS sum_surface
+            FROM detail WHERE {where}
+            GROUP BY {cols} ORDER BY {cols}""", params).df()
+
+    def aggregate(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None):
+        where, params = self._where(selected_dept, selected_types, start_date, end_date, price_range, communes)
+        df_com = self._group(['code_commune', 'nom_commune', 'code_departement'], where, params)
+        df_types = self._group(['type_local'], where, params)
+        df_month = self._group(['mois'], where, params).rename(columns={'mois': 'month_date'})
+        return {
+            'communes': df_com,
+            'monthly': df_month,
+            'types': df_types,
+            'totals': df_types[MEASURES].sum(),
+        }
+
+    def histogram(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None, nbins=50):
+        where, params = self._where(selected_dept, selected_types, start_date, end_date, price_range, communes)
+        v_min, v_max = self._query(f"SELECT min(prix_m2), max(prix_m2) FROM detail WHERE {where}", params).fetchone()
+        if v_min is None:
+            return pd.DataFrame({'prix_m2': [], 'count': []})
+
+        # Mêmes classes que histogram_bins ; la classe est recalée sur les bornes exactes
+        # (start + size * k), comme le fait np.histogram
+        size = nice_bin_size(v_min, v_max, nbins)
+        start = float(np.floor(v_min / size) * size)
+        n = int(np.floor((v_max - start) / size)) + 1
+        bins = self._query(f"""
+            SELECT k - (prix_m2 < ? + ? * k)::BIGINT + (prix_m2 >= ? + ? * (k + 1))::BIGINT AS bin,
+                   count(*) AS n
+            FROM (SELECT prix_m2, floor((prix_m2 - ?) / ?)::BIGINT AS k FROM detail WHERE {where})
+            GROUP BY bin""", [start, size] * 3 + params).df()
+        counts = np.zeros(n, dtype=np.int64)
+        np.add.at(counts, bins['bin'].clip(0, n - 1).to_numpy(), bins['n'].to_numpy())
+        return pd.DataFrame({'prix_m2': start + size * np.arange(n) + size / 2, 'count': counts})
+
+    def sketches(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None):
+        # Mêmes classes que sketch_bin, calculées par DuckDB : seules les esquisses sont transférées
+        where, params = self._where(selected_dept, selected_types, start_date, end_date, price_range, communes)
+        return self._query(f"""
+            SELECT code_commune, nom_commune, code_departement,
+                   ceil(ln(greatest(prix_m2, 1)) / ln(?))::SMALLINT AS qbin, count(*)::DOUBLE AS nb_ventes
+            FROM detail WHERE {where}
+            GROUP BY ALL""", [GAMMA] + params).df()
+
+    def export_batches(self, selected_dept, selected_types, start_date, end_date, price_range,
+                       communes=None, batch_rows=EXPORT_BATCH_ROWS):
+        # Lecture en flux (lots Arrow) : DuckDB ne matérialise pas le résultat complet
+        where, params = self._where(selected_dept, selected_types, start_date, end_date, price_range, communes)
+        # Date sans heure, comme export_frame (moteur pandas)
+        columns = ['CAST(date_mutation AS DATE) AS date_mutation' if c == 'date_mutation' else c
+                   for c in EXPORT_COLUMNS]
+        reader = self._query(f"SELECT {', '.join(columns)} FROM detail WHERE {where}",
+                             params).fetch_record_batch(batch_rows)
+        for batch in reader:
+            if batch.num_rows:
+                yield batch.to_pandas()
+
+    def metadata(self):
+        min_price, max_price, min_date, max_date = self._query(
+            "SELECT min(prix_m2), max(prix_m2), min(mois), max(mois) FROM detail").fetchone()
+        return {
+            'departements': [d for (d,) in self._query("SELECT DISTINCT code_departement FROM detail ORDER BY 1").fetchall()],
+            'types_biens': [t for (t,) in self._query("SELECT DISTINCT type_local FROM detail ORDER BY 1").fetchall()],
+            'min_price': int(min_price),
+            'max_price': int(max_price),
+            'min_date': min_date,
+            'max_date': max_date,
+            'annees': list(range(int(min_date[:4]), int(max_date[:4]) + 1)),
+        }
+
+    def sample(self, rows=SAMPLE_ROWS):
+        # Même règle que stratified_sample ; l'ordre dans la strate est fixé par un hash des lignes
+        strata = ", ".join(STRATA)
+        df = self._query(f"""
+            SELECT {', '.join(DETAIL_COLUMNS)}, n_strate FROM (
+                SELECT *, count(*) OVER strate AS n_strate,
+                       row_number() OVER (strate ORDER BY hash(date_mutation, code_commune, valeur_fonciere,
+                                                              surface_reelle_bati)) AS rang
+                FROM detail WINDOW strate AS (PARTITION BY {strata}))
+            WHERE rang <= least(n_strate, greatest(?, ceil(n_strate * ?)))""",
+                         [MIN_PER_STRATUM, rows / max(self.rows, 1)]).df()
+        n = df.pop('n_strate').to_numpy()
+        df = compact_detail(df)
+        df['weight'] = (n / sample_sizes(n, rows, self.rows)).astype(np.float32)
+        return df
+
+
+class SampleBackend(QueryBackend):
+    """Estimations pondérées sur un échantillon stratifié (aperçu rapide, approché)."""
+
+    name = "sample"
+
+    def __init__(self, sample):
+        self.df = sample
+        self.rows = len(sample)
+
+    def _filtered(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None):
+        sub = self.df[detail_mask(self.df, selected_dept, selected_types,
+                                  day_index(start_date), day_index(end_date), price_range, communes)]
+        w = sub['weight'].to_numpy(np.float64)
+        return sub.assign(nb_ventes=w, sum_prix_m2=sub['prix_m2'].to_numpy() * w,
+                          sum_valeur=sub['valeur_fonciere'].to_numpy(np.float64) * w,
+                          sum_surface=sub['surface_reelle_bati'].to_numpy(np.float64) * w)
+
+    @staticmethod
+    def _group(sub, keys):
+        out = sub.groupby(keys, observed=True)[MEASURES].sum().reset_index()
+        return out.astype({c: str for c in keys})
+
+    def aggregate(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None):
+        sub = self._filtered(selected_dept, selected_types, start_date, end_date, price_range, communes)
+        df_types = self._group(sub, ['type_local'])
+        return {
+            'communes': self._group(sub, ['code_commune', 'nom_commune', 'code_departement']),
+            'monthly': self._group(sub, ['month_date']),
+            'types': df_types,
+            'totals': df_types[MEASURES].sum(),
+        }
+
+    def histogram(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None, nbins=50):
+        sub = self._filtered(selected_dept, selected_types, start_date, end_date, price_range, communes)
+        return histogram_bins(sub['prix_m2'].to_numpy(), nbins, weights=sub['nb_ventes'].to_numpy())[0]
+
+    def sketches(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None):
+        # Effectifs pondérés : quantiles estimés sur l'échantillon
+        sub = self._filtered(selected_dept, selected_types, start_date, end_date, price_range, communes)
+        keys = ['code_commune', 'nom_commune', 'code_departement']
+        return sub[keys].astype(str).assign(qbin=sketch_bin(sub['prix_m2']), nb_ventes=sub['nb_ventes'].to_numpy())
+
+
+BACKENDS = {'pandas': PandasBackend, 'duckdb': DuckDBBackend}
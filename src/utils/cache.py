@@ -0,0 +1,225 @@
+# cache.py
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou de fichier entre processus
+    fcntl = None
+
+from plotly.utils import PlotlyJSONEncoder
+
+
+def dataset_version(paths):
+    """
+    Empreinte des données nettoyées (chemin, taille, date de modification des fichiers).
+    Elle change dès que clean_data.py régénère un fichier : le cache est alors invalidé.
+    """
+    h = hashlib.sha1()
+    for root in paths:
+        if os.path.isfile(root):
+            files = [root]
+        else:
+            files = sorted(os.path.join(d, f) for d, _, names in os.walk(root) for f in names)
+        for path in files:
+            st = os.stat(path)
+            h.update(f"{os.path.relpath(path, os.path.dirname(root))}|{st.st_size}|{st.st_mtime_ns}".encode())
+    return h.hexdigest()[:16]
+
+
+def data_version(data_dir):
+    """Version des données nettoyées lues par le dashboard (détail et cube)."""
+    cleaned = os.path.join(data_dir, "cleaned")
+    return dataset_version([os.path.join(cleaned, "data_detail"),
+                            os.path.join(cleaned, "data_detail.csv"),
+                            os.path.join(cleaned, "cube")])
+
+
+def filter_key(selected_dept, selected_types, start_date, end_date, price_range, min_sales, communes=None):
+    """
+    Clé normalisée d'un jeu de filtres (l'ordre des types ne compte pas).
+    Une sélection de communes sur la carte ajoute l'empreinte de ses codes triés.
+    """
+    key = [
+        selected_dept,
+        sorted(selected_types or []),
+        str(start_date.date()),
+        str(end_date.date()),
+        [float(price_range[0]), float(price_range[1])],
+        int(min_sales) if min_sales is not None else 0,
+    ]
+    if communes is not None:
+        key.append(hashlib.sha1(",".join(sorted(communes)).encode('utf-8')).hexdigest())
+    return json.dumps(key)
+
+
+class ResultCache:
+    """
+    Cache des sorties sérialisées de update_dashboard.
+    - mémoire : LRU bornée en octets (propre à chaque processus)
+    - disque (optionnel) : un fichier par clé, partagé entre les processus du serveur
+    Les entrées sont rangées par version des données : une nouvelle version les invalide.
+    """
+
+    def __init__(self, version, max_bytes=64 * 1024 * 1024, disk_dir=None):
+        self.version = version
+        self.max_bytes = max_bytes
+        self.disk_dir = os.path.join(disk_dir, version) if disk_dir else None
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _hash(self, key):
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def _remember(self, h, payload):
+        """Ajout en mémoire puis éviction des entrées les moins récemment utilisées."""
+        if len(payload) > self.max_bytes:
+            return
+        if h in self._entries:
+            self._size -= len(self._entries.pop(h))
+        self._entries[h] = payload
+        self._size += len(payload)
+        while self._size > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self._size -= len(old)
+
+    def get(self, key):
+        """Sorties désérialisées, ou None si la clé n'est pas en cache."""
+        payload = self.get_payload(key)
+        return json.loads(payload) if payload is not None else None
+
+    def get_payload(self, key):
+        """JSON tel qu'il a été enregistré, ou None si la clé n'est pas en cache."""
+        h = self._hash(key)
+        with self._lock:
+            payload = self._entries.get(h)
+            if payload is not None:
+                self._entries.move_to_end(h)
+                self.hits += 1
+                return payload
+
+        if self.disk_dir:
+            try:
+                with open(os.path.join(self.disk_dir, h + ".json"), 'r', encoding='utf-8') as f:
+                    payload = f.read()
+            except OSError:
+                payload = None
+            if payload is not None:
+                with self._lock:
+                    self._remember(h, payload)
+                    self.disk_hits += 1
+                return payload
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def contains(self, key):
+        """Clé en cache (mémoire ou disque), sans compter de hit ni changer l'ordre LRU."""
+        h = self._hash(key)
+        with self._lock:
+            if h in self._entries:
+                return True
+        return bool(self.disk_dir) and os.path.exists(os.path.join(self.disk_dir, h + ".json"))
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Verrou exclusif sur une clé, partagé entre les processus (fichier .lock du cache
+        disque) : un seul worker calcule, les autres attendent puis lisent son résultat.
+        Sans cache disque, ne verrouille rien (SharedResults suffit dans un processus).
+        """
+        if not self.disk_dir or fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.disk_dir, self._hash(key) + ".lock"), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def set(self, key, outputs):
+        return self.set_payload(key, json.dumps(outputs, cls=PlotlyJSONEncoder))
+
+    def set_payload(self, key, payload, decode=True):
+        """Comme set, pour des sorties déjà sérialisées en JSON (decode=False : rien n'est retourné)."""
+        h = self._hash(key)
+        with self._lock:
+            self._remember(h, payload)
+
+        if self.disk_dir:
+            # Écriture atomique : un autre processus ne lit jamais un fichier partiel
+            fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp, os.path.join(self.disk_dir, h + ".json"))
+        return json.loads(payload) if decode else None
+
+    def stats(self):
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            'version': self.version,
+            'entries': len(self._entries),
+            'bytes': self._size,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / total if total else 0.0,
+        }
+
+
+class SharedResults:
+    """
+    Résultats intermédiaires (objets Python, non sérialisés) partagés entre les callbacks
+    d'un même processus, par clé de filtres. Calcul unique : les callbacks qui demandent
+    la même clé pendant le calcul attendent son résultat au lieu de le refaire.
+    Entre processus, c'est le verrou de ResultCache qui évite les calculs en double.
+    """
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._pending = {}  # clé -> verrou du calcul en cours
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            pending = self._pending.setdefault(key, threading.Lock())
+
+        with pending:
+            with self._lock:
+                if key in self._entries:
+                    # Calculé par un autre callback pendant l'attente
+                    self.hits += 1
+                    return self._entries[key]
+            try:
+                value = compute()
+                with self._lock:
+                    self.misses += 1
+                    self._entries[key] = value
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            finally:
+                # Même en cas d'échec : les callbacks en attente sont libérés et recalculent
+                with self._lock:
+                    if self._pending.get(key) is pending:
+                        del self._pending[key]
+        return value
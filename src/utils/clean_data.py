@@ -1,83 +1,593 @@
 # clean_data.py
+import numpy as np
 import pandas as pd
+import argparse
+import glob
+import gzip
+import hashlib
+import io
+import json
 import os
+import re
+import shutil
+import time
+from collections import deque
+
+import requests
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from src.utils.download import StreamingDownload, not_found, probe
+from src.utils.get_data import DATA_URL, FIRST_YEAR, LAST_YEAR, output_path
+from src.utils.cube import (DataCube, CUBE_DIR, COMMUNE_KEYS, DEPT_KEYS, SKETCH_KEYS, SKETCH_MEASURES,
+                            cell_sums, combine_cells, day_index, price_bucket, sketch_cells, save_frame, load_frame)
+from src.utils.sketch import sketch_bin
+from src.utils.cache import data_version
+from src.utils.load_data import write_metadata
+
+# pyarrow est optionnel : sans lui on se rabat sur pandas et le CSV
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pcsv
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
 
 # Configuration
-RAW_PATH = os.path.join("data", "raw", "dvf_2023.csv.gz")
+DATA_DIR = "data"
+RAW_DIR = os.path.join("data", "raw")
+RAW_PATTERN = "dvf_*.csv.gz"  # un fichier par année : dvf_2014.csv.gz ... dvf_2025.csv.gz
 
 CSV_DETAIL_PATH = os.path.join("data", "cleaned", "data_detail.csv")
+# Dataset Parquet partitionné par année (data_detail/annee=2023/part-0.parquet)
+PARQUET_DETAIL_DIR = os.path.join("data", "cleaned", "data_detail")
+
+# Fichiers bruts déjà traités (taille, date, empreinte) pour le mode incrémental
+MANIFEST_PATH = os.path.join("data", "cleaned", "manifest.json")
+# Cellules du cube par année : seules celles des années retraitées sont recalculées
+CELLS_DIR = os.path.join(CUBE_DIR, "cells")
+
+# Colonnes strictement nécessaires
+COLS = ['date_mutation', 'nature_mutation', 'valeur_fonciere',
+        'code_departement', 'code_commune', 'nom_commune',
+        'type_local', 'surface_reelle_bati']
 
-# On traite par paquet de 100 000 lignes pour ne pas saturer la RAM
+# Colonnes numériques (les autres sont du texte, lu en dictionnaire par Arrow)
+NUMERIC_COLS = ['valeur_fonciere', 'surface_reelle_bati']
+
+# Lignes par groupe de lignes Parquet
 CHUNK_SIZE = 100000 
 
-# --- FONCTION DE CORRECTION PLM ---
-def fix_plm_codes(code):
-    """
-    Garde les codes des arrondissements pour afficher chaque arrondissement individuellement.
-    Les codes PLM pour les arrondissements sont déjà valides dans GeoJSON.
-    """
-    code = str(code)
-    # On ne modifie rien, on garde les codes originaux (y compris les arrondissements)
-    return code
-
-def process():
-    print("Démarrage du traitement France Entière (CSV)...")
-    
-
-
-    # Colonnes strictement nécessaires
-    cols = ['date_mutation', 'nature_mutation', 'valeur_fonciere', 
-            'code_departement', 'code_commune', 'nom_commune', 
-            'type_local', 'surface_reelle_bati']
-
-    # Listes pour stocker les résultats temporaires
-    chunks_kept = []
-
-    # Lecture du fichier compressé par morceaux
-    reader = pd.read_csv(RAW_PATH, compression='gzip', usecols=cols, 
-                         dtype={'code_commune': str, 'code_departement': str}, 
-                         chunksize=CHUNK_SIZE)
-
-    total_rows = 0
-    
-    for i, chunk in enumerate(reader):
-        # 1. Filtrage initial (rapide)
-        chunk = chunk[chunk['nature_mutation'] == "Vente"]
-        chunk = chunk[chunk['type_local'].isin(['Maison', 'Appartement'])]
-        chunk = chunk.dropna(subset=['valeur_fonciere', 'surface_reelle_bati', 'code_commune'])
-        chunk = chunk[chunk['surface_reelle_bati'] > 9]
-        chunk = chunk[chunk['valeur_fonciere'] > 1000]
-
-        # 2. Correction des codes communes PLM
-        chunk['code_commune'] = chunk['code_commune'].apply(fix_plm_codes)
-
-        # 3. Calculs
-        chunk['prix_m2'] = chunk['valeur_fonciere'] / chunk['surface_reelle_bati']
-        # Filtre des prix aberrants
-        chunk = chunk[(chunk['prix_m2'] > 500) & (chunk['prix_m2'] < 25000)]
-        
-        # Ajout à la liste
-        chunks_kept.append(chunk)
-        
-        total_rows += len(chunk)
-        print(f"   Traitement lot {i}... ({total_rows} ventes conservées)")
-
-    print("Fusion des données...")
-    df = pd.concat(chunks_kept)
-    
-
-
-    # --- FICHIER 2 : DONNÉES DÉTAILLÉES (Pour les graphs) ---
-    # Pour que le CSV ne fasse pas 2 Go, on ne garde que l'essentiel pour les stats
+# Taille des blocs de CSV décompressé lus en une fois (~100 000 lignes DVF)
+BLOCK_BYTES = 32 * 1024 * 1024
+
+# Nombre de blocs en cours de traitement par worker (file bornée)
+QUEUE_PER_WORKER = 2
+
+# Session HTTP partagée par le mode --stream
+requests_session = requests.Session()
+
+# --- RÈGLES DE NETTOYAGE ---
+# Déclaratives : exécutées en noyaux Arrow sur les lots du lecteur CSV (arrow_clean),
+# ou avec pandas quand pyarrow est absent (clean_chunk). Une ligne est gardée si elle
+# respecte toutes les règles ; prix_m2 = valeur_fonciere / surface_reelle_bati.
+CLEANING_RULES = {
+    # Valeurs admises
+    'allow': {'nature_mutation': ['Vente'], 'type_local': ['Maison', 'Appartement']},
+    # Valeurs obligatoires
+    'required': ['valeur_fonciere', 'surface_reelle_bati', 'code_commune'],
+    # Bornes exclusives (min, max), None : pas de borne ; prix_m2 écarte les prix aberrants
+    'bounds': {'surface_reelle_bati': (9, None), 'valeur_fonciere': (1000, None), 'prix_m2': (500, 25000)},
+    # Codes en texte complétés à gauche par des zéros (largeur) ; les codes des
+    # arrondissements PLM sont gardés tels quels, ils sont déjà valides dans le GeoJSON
+    'codes': {'code_commune': 5, 'code_departement': 2},
+}
+
+def clean_chunk(chunk, rules=CLEANING_RULES):
+    """Règles de nettoyage sur un morceau pandas (sans pyarrow), puis colonne du mois."""
+    chunk = chunk.assign(prix_m2=chunk['valeur_fonciere'] / chunk['surface_reelle_bati'])
+    mask = chunk[rules['required']].notna().all(axis=1)
+    for col, values in rules['allow'].items():
+        mask &= chunk[col].isin(values)
+    for col, (low, high) in rules['bounds'].items():
+        if low is not None:
+            mask &= chunk[col] > low
+        if high is not None:
+            mask &= chunk[col] < high
+    chunk = chunk[mask].copy()
+    for col, width in rules['codes'].items():
+        chunk[col] = chunk[col].str.zfill(width)
+
     # On ajoute le mois pour l'évolution temporelle
-    print("Création du fichier DÉTAIL...")
-    df['date_mutation'] = pd.to_datetime(df['date_mutation'])
-    df['mois'] = df['date_mutation'].dt.to_period('M').astype(str)
-    
-    # On sauvegarde tout (Attention, le fichier sera gros)
-    df.to_csv(CSV_DETAIL_PATH, index=False)
-    print(f"{CSV_DETAIL_PATH} généré.")
+    chunk['date_mutation'] = pd.to_datetime(chunk['date_mutation'])
+    chunk['mois'] = chunk['date_mutation'].dt.to_period('M').astype(str)
+    return chunk
+
+def pad_codes(codes, width):
+    """Codes (dictionnaire Arrow) complétés par des zéros : seules les valeurs distinctes sont traitées."""
+    padded = pc.utf8_lpad(codes.dictionary, width=width, padding='0')
+    if padded.equals(codes.dictionary):
+        return codes
+    return pc.dictionary_encode(pc.take(padded, codes.indices))
+
+def month_labels(dates):
+    """Mois 'AAAA-MM' de chaque date, en dictionnaire (quelques valeurs distinctes par lot)."""
+    months = np.asarray(dates, dtype='datetime64[M]')
+    values, indices = np.unique(months, return_inverse=True)
+    return pa.DictionaryArray.from_arrays(pa.array(indices.astype(np.int32)), pa.array(values.astype(str)))
+
+def arrow_clean(batch, rules=CLEANING_RULES):
+    """
+    Règles de nettoyage sur un lot Arrow : un seul masque, un seul filtrage, sans
+    passer par pandas. Retourne une table au schéma de DetailWriter (prix_m2, mois compris).
+    """
+    batch = batch.append_column('prix_m2', pc.divide(batch['valeur_fonciere'], batch['surface_reelle_bati']))
+    conditions = [pc.is_valid(batch[col]) for col in rules['required']]
+    conditions += [pc.is_in(batch[col], value_set=pa.array(values)) for col, values in rules['allow'].items()]
+    for col, (low, high) in rules['bounds'].items():
+        if low is not None:
+            conditions.append(pc.greater(batch[col], low))
+        if high is not None:
+            conditions.append(pc.less(batch[col], high))
+    mask = conditions[0]
+    for condition in conditions[1:]:
+        mask = pc.and_(mask, condition)
+    table = pa.Table.from_batches([batch.filter(pc.fill_null(mask, False))]).combine_chunks()
+
+    for col, width in rules['codes'].items():
+        i = table.schema.get_field_index(col)
+        table = table.set_column(i, col, pad_codes(table[col].chunk(0), width) if table.num_rows else table[col])
+    # On ajoute le mois pour l'évolution temporelle
+    return table.append_column('mois', month_labels(table['date_mutation'].to_numpy()))
+
+# Mesures des cellules groupées par Arrow : (colonne, agrégat, nom dans le cube)
+CELL_AGGREGATES = [('prix_m2', 'count', 'nb_ventes'), ('prix_m2', 'sum', 'sum_prix_m2'),
+                   ('valeur_fonciere', 'sum', 'sum_valeur'), ('surface_reelle_bati', 'sum', 'sum_surface')]
+SKETCH_AGGREGATES = [('prix_m2', 'count', 'nb_ventes')]
+
+def arrow_cells(table, group_cols, aggregates=CELL_AGGREGATES):
+    """
+    Cellules d'un lot groupé par Arrow : mêmes colonnes que cell_sums / sketch_cells du cube.
+    Comme avec le groupby pandas, les lignes dont une dimension est vide sont ignorées.
+    """
+    keys = group_cols + ['bucket', 'day']
+    work = table.select(keys + list(dict.fromkeys(col for col, _, _ in aggregates))).drop_null()
+    cells = work.group_by(keys, use_threads=False).aggregate([(col, func) for col, func, _ in aggregates])
+    names = {f"{col}_{func}": name for col, func, name in aggregates}
+    cells = cells.rename_columns([names.get(col, col) for col in cells.column_names])
+    return cells.select(keys + [name for _, _, name in aggregates]).to_pandas()
+
+def process_batch(batch):
+    """
+    Travail d'un thread : règles de nettoyage sur un lot du lecteur Arrow, puis cellules
+    partielles du cube et des esquisses de quantiles, sans repasser par pandas.
+    Retourne (lignes lues, table gardée, cellules communes, départements, esquisses).
+    """
+    table = arrow_clean(batch)
+    prix = table['prix_m2'].to_numpy()
+    work = table.select(COMMUNE_KEYS + ['prix_m2'] + NUMERIC_COLS)
+    work = work.append_column('bucket', pa.array(price_bucket(prix)))
+    work = work.append_column('day', pa.array(day_index(table['date_mutation'].to_numpy())))
+    sketches = work.append_column('qbin', pa.array(sketch_bin(prix)))
+    return (batch.num_rows, table, arrow_cells(work, COMMUNE_KEYS), arrow_cells(work, DEPT_KEYS),
+            arrow_cells(sketches, SKETCH_KEYS, SKETCH_AGGREGATES))
+
+def arrow_batches(source, block_bytes=BLOCK_BYTES):
+    """
+    Lots du lecteur CSV Arrow, en flux : décompression, découpage et conversion en
+    parallèle (threads Arrow). Seules les colonnes COLS sont converties, le texte en dictionnaire.
+    source : chemin d'un .csv.gz ou flux binaire compressé (ex. téléchargement en cours).
+    """
+    text = pa.dictionary(pa.int32(), pa.string())
+    types = {col: pa.float64() if col in NUMERIC_COLS else text for col in COLS}
+    types['date_mutation'] = pa.timestamp('ms')
+    raw = source if isinstance(source, str) else pa.PythonFile(source, mode='r')
+    with pa.input_stream(raw, compression='gzip') as stream:
+        yield from pcsv.open_csv(stream,
+                                 read_options=pcsv.ReadOptions(block_size=block_bytes, use_threads=True),
+                                 convert_options=pcsv.ConvertOptions(include_columns=COLS, column_types=types,
+                                                                     strings_can_be_null=True))
+
+def process_block(header, block):
+    """
+    Travail d'un worker sans pyarrow : parsing d'un bloc de lignes CSV, nettoyage,
+    puis cellules partielles du cube et des esquisses de quantiles.
+    Retourne (lignes lues, lignes gardées, cellules communes, départements, esquisses).
+    """
+    raw = pd.read_csv(io.BytesIO(header + block), usecols=COLS,
+                      dtype={'code_commune': str, 'code_departement': str})
+    chunk = clean_chunk(raw)
+    return len(raw), chunk, cell_sums(chunk, COMMUNE_KEYS), cell_sums(chunk, DEPT_KEYS), sketch_cells(chunk)
+
+def iter_blocks(source, block_bytes=BLOCK_BYTES):
+    """
+    Décompresse le CSV en flux et le découpe en blocs de lignes complètes.
+    source : chemin d'un .csv.gz ou flux binaire compressé (ex. téléchargement en cours).
+    Retourne l'en-tête puis les blocs (les champs DVF ne contiennent pas de retour à la ligne).
+    """
+    with gzip.open(source, 'rb') as f:
+        header = f.readline()
+        yield header
+        rest = b""
+        while True:
+            data = f.read(block_bytes)
+            if not data:
+                break
+            data = rest + data
+            cut = data.rfind(b"\n") + 1
+            if cut == 0:
+                rest = data
+                continue
+            rest = data[cut:]
+            yield data[:cut]
+        if rest.strip():
+            yield rest + b"\n"
+
+class DetailWriter:
+    """
+    Écriture en flux des données détaillées, dans l'ordre des lots.
+    Parquet : un fichier par année, écrit dans un dossier temporaire puis mis en place
+    à la fin (une partition n'est jamais à moitié écrite). Sans pyarrow : CSV.
+    """
+
+    def __init__(self, root=PARQUET_DETAIL_DIR, csv_path=CSV_DETAIL_PATH):
+        self.root = root
+        self.csv_path = csv_path
+        self.tmp_root = root + ".tmp"
+        self.writers = {}
+        self.csv_header = True
+        # Taille du CSV avant le premier lot de chaque année (pour discard)
+        self.csv_starts = {}
+        if HAS_PYARROW:
+            if os.path.exists(self.tmp_root):
+                shutil.rmtree(self.tmp_root)
+            dict_str = pa.dictionary(pa.int32(), pa.string())
+            self.schema = pa.schema([
+                ('date_mutation', pa.timestamp('ms')),
+                ('nature_mutation', dict_str),
+                ('valeur_fonciere', pa.float64()),
+                ('code_departement', dict_str),
+                ('code_commune', dict_str),
+                ('nom_commune', dict_str),
+                ('type_local', dict_str),
+                ('surface_reelle_bati', pa.float64()),
+                ('prix_m2', pa.float64()),
+                ('mois', dict_str),
+            ])
+        elif os.path.exists(csv_path):
+            os.remove(csv_path)
+
+    def write(self, chunk, annee):
+        """
+        Ajoute un lot à la partition de l'année du fichier source.
+        chunk : table Arrow (arrow_clean) ou, sans pyarrow, DataFrame (clean_chunk).
+        """
+        if len(chunk) == 0:
+            return
+        if not HAS_PYARROW:
+            # Sans pyarrow : ancien format CSV (Attention, le fichier sera gros)
+            if annee not in self.csv_starts:
+                self.csv_starts[annee] = os.path.getsize(self.csv_path) if os.path.exists(self.csv_path) else 0
+            chunk.to_csv(self.csv_path, index=False, mode='a', header=self.csv_header)
+            self.csv_header = False
+            return
+
+        if annee not in self.writers:
+            part_dir = os.path.join(self.tmp_root, f"annee={annee}")
+            os.makedirs(part_dir)
+            self.writers[annee] = pq.ParquetWriter(os.path.join(part_dir, "part-0.parquet"), self.schema)
+        # Colonnes dans l'ordre du schéma, quel que soit celui du fichier source
+        table = chunk.select(self.schema.names).cast(self.schema)
+        self.writers[annee].write_table(table, row_group_size=CHUNK_SIZE)
+
+    def discard(self, annee):
+        """
+        Abandonne les lots déjà écrits pour une année (échec en cours de traitement) :
+        la partition précédente de l'année reste en place à la fermeture.
+        """
+        if annee in self.writers:
+            self.writers.pop(annee).close()
+            shutil.rmtree(os.path.join(self.tmp_root, f"annee={annee}"), ignore_errors=True)
+        start = self.csv_starts.pop(annee, None)
+        if start is not None:
+            # CSV : on coupe le fichier là où l'année commençait
+            with open(self.csv_path, 'r+b') as f:
+                f.truncate(start)
+            self.csv_header = start == 0
+
+    def close(self):
+        if not HAS_PYARROW:
+            print(f"{self.csv_path} généré.")
+            return
+        if not self.writers:
+            shutil.rmtree(self.tmp_root, ignore_errors=True)
+            return
+        for writer in self.writers.values():
+            writer.close()
+        # On remplace chaque partition entière pour ne pas dupliquer les lignes
+        os.makedirs(self.root, exist_ok=True)
+        for annee in self.writers:
+            name = f"annee={annee}"
+            if os.path.exists(os.path.join(self.root, name)):
+                shutil.rmtree(os.path.join(self.root, name))
+            os.replace(os.path.join(self.tmp_root, name), os.path.join(self.root, name))
+        shutil.rmtree(self.tmp_root, ignore_errors=True)
+        print(f"{self.root} généré ({len(self.writers)} partition(s)).")
+
+def raw_files(raw_dir=RAW_DIR):
+    """Fichiers DVF bruts disponibles, par année : {année: chemin}."""
+    files = {}
+    for path in glob.glob(os.path.join(raw_dir, RAW_PATTERN)):
+        match = re.search(r"dvf_(\d{4})\.csv\.gz$", path)
+        if match:
+            files[int(match.group(1))] = path
+    return dict(sorted(files.items()))
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+def needs_cleaning(path, entry):
+    """
+    Un fichier est à retraiter si sa taille ou sa date ont changé ET que son
+    contenu (sha256) est différent de celui du dernier traitement.
+    """
+    if entry is None:
+        return True, None
+    st = os.stat(path)
+    if st.st_size == entry['size'] and st.st_mtime_ns == entry.get('mtime_ns'):
+        return False, entry['sha256']
+    digest = file_hash(path)
+    return digest != entry['sha256'], digest
+
+def clean_file(source, annee, writer, workers):
+    """
+    Nettoyage en flux d'un fichier (chemin ou flux compressé) : lots lus par le lecteur
+    CSV Arrow et nettoyés dans des threads (sans pyarrow : blocs parsés par pandas dans
+    des processus), les résultats sont écrits dans l'ordre dès qu'ils arrivent.
+    Seules les cellules du cube (bien plus petites que les lignes) sont gardées en mémoire.
+    Retourne (lignes lues, lignes gardées, cellules de l'année) : les cellules ne sont
+    enregistrées (save_cells) qu'une fois le fichier lu en entier.
+    """
+    commune_cells, dept_cells, sketches = [], [], []
+    rows_read = rows_kept = 0
+    start = time.perf_counter()
+
+    def collect(i, result):
+        nonlocal rows_read, rows_kept
+        n_raw, chunk, c_cells, d_cells, s_cells = result
+        writer.write(chunk, annee)
+        commune_cells.append(c_cells)
+        dept_cells.append(d_cells)
+        sketches.append(s_cells)
+        # On recombine régulièrement les cellules partielles pour borner la mémoire
+        if len(commune_cells) >= 16:
+            commune_cells[:] = [combine_cells(commune_cells, COMMUNE_KEYS)]
+            dept_cells[:] = [combine_cells(dept_cells, DEPT_KEYS)]
+            sketches[:] = [combine_cells(sketches, SKETCH_KEYS, SKETCH_MEASURES)]
+        rows_read += n_raw
+        rows_kept += len(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"   [{annee}] Traitement lot {i}... ({rows_kept} ventes conservées, "
+              f"{rows_read / elapsed:,.0f} lignes/s)")
+
+    if HAS_PYARROW:
+        # Les noyaux Arrow relâchent le GIL : des threads suffisent, sans copier les lots entre processus
+        tasks = ((process_batch, batch) for batch in arrow_batches(source))
+        executor = ThreadPoolExecutor
+    else:
+        blocks = iter_blocks(source)
+        header = next(blocks)
+        tasks = ((process_block, header, block) for block in blocks)
+        executor = ProcessPoolExecutor
+    with executor(max_workers=workers) as pool:
+        pending = deque()
+        for i, (task, *task_args) in enumerate(tasks):
+            pending.append((i, pool.submit(task, *task_args)))
+            # File bornée : on attend le plus ancien lot avant d'en lire d'autres
+            if len(pending) >= workers * QUEUE_PER_WORKER:
+                j, future = pending.popleft()
+                collect(j, future.result())
+        while pending:
+            j, future = pending.popleft()
+            collect(j, future.result())
+
+    elapsed = time.perf_counter() - start
+    print(f"   [{annee}] {rows_read} lignes lues en {elapsed:.1f} s "
+          f"({rows_read / max(elapsed, 1e-9):,.0f} lignes/s), {rows_kept} ventes conservées.")
+    cells = {
+        'communes': combine_cells(commune_cells, COMMUNE_KEYS),
+        'departements': combine_cells(dept_cells, DEPT_KEYS),
+        'sketches': combine_cells(sketches, SKETCH_KEYS, SKETCH_MEASURES),
+    }
+    return rows_read, rows_kept, cells
+
+def save_cells(annee, cells):
+    """Cellules du cube d'une année nettoyée (remplacent celles du traitement précédent)."""
+    os.makedirs(CELLS_DIR, exist_ok=True)
+    for name, frame in cells.items():
+        save_frame(frame, os.path.join(CELLS_DIR, f"{name}_{annee}.npz"))
+
+def rebuild_cube(annees):
+    """Cube global à partir des cellules de chaque année (pas de relecture des lignes)."""
+    print("Construction du cube d'agrégats...")
+    commune_cells = [load_frame(os.path.join(CELLS_DIR, f"communes_{a}.npz")) for a in annees]
+    dept_cells = [load_frame(os.path.join(CELLS_DIR, f"departements_{a}.npz")) for a in annees]
+    sketch_paths = [os.path.join(CELLS_DIR, f"sketches_{a}.npz") for a in annees]
+    sketches = None
+    if all(os.path.exists(p) for p in sketch_paths):
+        sketches = combine_cells([load_frame(p) for p in sketch_paths], SKETCH_KEYS, SKETCH_MEASURES)
+    else:
+        # Années nettoyées par une version précédente : le dashboard construira les esquisses au chargement
+        print("Esquisses de quantiles incomplètes (années à retraiter), non générées.")
+    DataCube.save_cells(combine_cells(commune_cells, COMMUNE_KEYS),
+                        combine_cells(dept_cells, DEPT_KEYS), sketches, CUBE_DIR)
+    print(f"{CUBE_DIR} généré.")
+
+def process(workers=None, incremental=False):
+    """
+    Nettoie toutes les années présentes dans data/raw.
+    En mode incrémental (Parquet uniquement), seules les années dont le fichier brut a
+    changé depuis le dernier passage sont retraitées : leur partition et leurs cellules
+    du cube sont remplacées, les autres années sont conservées telles quelles.
+    """
+    workers = workers or os.cpu_count() or 1
+    files = raw_files()
+    if not files:
+        print(f"Aucun fichier {RAW_PATTERN} dans {RAW_DIR}.")
+        return
+
+    if incremental and not HAS_PYARROW:
+        # Le CSV est un fichier unique : il faut tout réécrire
+        print("Mode incrémental indisponible sans pyarrow : traitement complet.")
+        incremental = False
+
+    manifest = load_manifest() if incremental else {}
+    todo = {}
+    for annee, path in files.items():
+        name = os.path.basename(path)
+        changed, digest = needs_cleaning(path, manifest.get(name))
+        if changed:
+            todo[annee] = (path, digest)
+        elif manifest[name].get('mtime_ns') != os.stat(path).st_mtime_ns:
+            # Même contenu, fichier simplement touché : on retient la nouvelle date
+            manifest[name]['mtime_ns'] = os.stat(path).st_mtime_ns
+
+    if not todo:
+        save_manifest(manifest)
+        print("Aucun fichier modifié depuis le dernier traitement.")
+        return
+
+    print(f"Démarrage du traitement France Entière ({'Arrow' if HAS_PYARROW else 'pandas'}, {workers} workers) : "
+          f"{', '.join(str(a) for a in todo)}")
+    writer = DetailWriter()
+    for annee, (path, digest) in todo.items():
+        rows_read, rows_kept, cells = clean_file(path, annee, writer, workers)
+        save_cells(annee, cells)
+        st = os.stat(path)
+        manifest[os.path.basename(path)] = {
+            'annee': annee,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'sha256': digest or file_hash(path),
+            'rows_read': rows_read,
+            'rows_kept': rows_kept,
+            'cleaned_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+    finish(writer, manifest)
+
+def finish(writer, manifest):
+    """Mise en place des partitions, du cube et du manifeste."""
+    writer.close()
+
+    # --- CUBE D'AGRÉGATS (Pour update_dashboard) ---
+    # Toutes les années déjà nettoyées, y compris celles qui n'ont pas été retraitées
+    annees = sorted(int(re.search(r"(\d{4})", os.path.basename(p)).group(1))
+                    for p in glob.glob(os.path.join(CELLS_DIR, "communes_*.npz")))
+    rebuild_cube(annees)
+
+    # Bornes des filtres : le dashboard affiche son layout sans charger les données
+    write_metadata(DATA_DIR, data_version(DATA_DIR))
+    save_manifest(manifest)
     print("Terminé.")
 
+def process_stream(years, workers=None, keep_raw=False, incremental=False):
+    """
+    Téléchargement, décompression et nettoyage enchaînés en flux : les blocs sont
+    nettoyés pendant que le fichier arrive, sans attendre la fin du téléchargement.
+    Le fichier brut n'est conservé (data/raw/dvf_<année>.csv.gz) qu'avec keep_raw.
+    En mode incrémental, une année dont l'ETag / Last-Modified n'a pas changé est sautée.
+    """
+    workers = workers or os.cpu_count() or 1
+    if incremental and not HAS_PYARROW:
+        print("Mode incrémental indisponible sans pyarrow : traitement complet.")
+        incremental = False
+    manifest = load_manifest() if incremental else {}
+    if keep_raw:
+        os.makedirs(RAW_DIR, exist_ok=True)
+
+    print(f"Démarrage du traitement en flux ({workers} workers) : {', '.join(str(y) for y in years)}")
+    writer = DetailWriter()
+    cleaned = 0
+    for annee in years:
+        url = DATA_URL.format(year=annee)
+        name = os.path.basename(output_path(annee))
+        entry = manifest.get(name)
+        try:
+            if entry and incremental:
+                remote = probe(url, requests_session)
+                if (remote['etag'] and remote['etag'] == entry.get('etag')) or \
+                        (not remote['etag'] and remote['last_modified'] and remote['last_modified'] == entry.get('last_modified')):
+                    print(f"   [{annee}] inchangé sur le serveur, ignoré.")
+                    continue
+
+            keep_path = output_path(annee) if keep_raw else None
+            with StreamingDownload(url, keep_path, requests_session) as stream:
+                rows_read, rows_kept, cells = clean_file(stream, annee, writer, workers)
+        except Exception as e:
+            # Année abandonnée : sa partition et ses cellules précédentes restent en place
+            writer.discard(annee)
+            if not_found(e):
+                print(f"   [{annee}] absente du serveur (année non publiée), ignorée.")
+            else:
+                print(f"   [{annee}] [ERROR] {e}")
+            continue
+        save_cells(annee, cells)
+
+        manifest[name] = {
+            'annee': annee,
+            'source': url,
+            'size': stream.size,
+            'sha256': stream.sha256,
+            'etag': stream.etag,
+            'last_modified': stream.last_modified,
+            'rows_read': rows_read,
+            'rows_kept': rows_kept,
+            'cleaned_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        if keep_raw:
+            manifest[name]['mtime_ns'] = os.stat(keep_path).st_mtime_ns
+        cleaned += 1
+
+    if not cleaned:
+        writer.close()
+        save_manifest(manifest)
+        print("Aucune année nettoyée.")
+        return
+    finish(writer, manifest)
+
 if __name__ == "__main__":
-    process()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Nettoyage des données DVF")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Threads de nettoyage, processus sans pyarrow (défaut : nombre de cœurs)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Ne retraiter que les années dont le fichier brut a changé")
+    parser.add_argument("--stream", action="store_true",
+                        help="Télécharger et nettoyer en flux, sans fichier brut intermédiaire")
+    parser.add_argument("--years", type=int, nargs="+",
+                        default=list(range(FIRST_YEAR, LAST_YEAR + 1)),
+                        help="Années à traiter en mode --stream")
+    parser.add_argument("--keep-raw", action="store_true",
+                        help="En mode --stream, conserver aussi le fichier brut dans data/raw")
+    args = parser.parse_args()
+    if args.stream:
+        process_stream(args.years, workers=args.workers, keep_raw=args.keep_raw,
+                       incremental=args.incremental)
+    else:
+        process(workers=args.workers, incremental=args.incremental)
@@ -0,0 +1,348 @@
+# cube.py
+import os
+import numpy as np
+import pandas as pd
+
+from src.utils.sketch import sketch_bin
+
+# Largeur des tranches de prix/m² du cube (en €)
+BUCKET_WIDTH = 500
+
+CUBE_DIR = os.path.join("data", "cleaned", "cube")
+
+# Mesures additives stockées dans chaque cellule
+MEASURES = ['nb_ventes', 'sum_prix_m2', 'sum_valeur', 'sum_surface']
+
+# Dimensions des deux niveaux du cube (en plus de la tranche de prix)
+COMMUNE_KEYS = ['code_commune', 'nom_commune', 'code_departement', 'type_local']
+DEPT_KEYS = ['code_departement', 'type_local']
+# Esquisses de quantiles (voir sketch.py) : effectif par commune, type et classe de prix
+SKETCH_KEYS = COMMUNE_KEYS + ['qbin']
+SKETCH_MEASURES = ['nb_ventes']
+
+
+def day_index(dates):
+    """Numéro de jour depuis le 01/01/1970 (dates pandas ou Timestamp)."""
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+def codes_isin(s, values):
+    """s.isin(values) calculé sur les codes entiers d'une colonne catégorielle."""
+    codes = s.cat.categories.get_indexer(list(values))
+    return np.isin(s.cat.codes.to_numpy(), codes[codes >= 0])
+
+
+def detail_mask(df, selected_dept, selected_types, d0, d1, price_range, communes=None):
+    """
+    Masque des filtres du dashboard sur les lignes au schéma compact (load_data.compact_detail) :
+    jours entiers, codes des catégories, aucune comparaison de chaînes ni de dates.
+    communes : codes commune sélectionnés sur la carte (None : pas de sélection).
+    """
+    day = df['day'].to_numpy()
+    prix = df['prix_m2'].to_numpy()
+    # Bornes ramenées dans la plage int16 (pas de conversion de la colonne)
+    d0, d1 = np.clip([d0, d1], np.iinfo(day.dtype).min, np.iinfo(day.dtype).max).astype(day.dtype)
+    mask = (day >= d0) & (day <= d1) & (prix >= price_range[0]) & (prix <= price_range[1])
+    mask &= codes_isin(df['type_local'], selected_types)
+    if selected_dept != 'all':
+        mask &= codes_isin(df['code_departement'], [selected_dept])
+    if communes is not None:
+        mask &= codes_isin(df['code_commune'], communes)
+    return mask
+
+
+def price_bucket(prix):
+    """Tranche de prix/m² : [k * BUCKET_WIDTH, (k + 1) * BUCKET_WIDTH[."""
+    return np.floor(np.asarray(prix, dtype=np.float64) / BUCKET_WIDTH).astype(np.int64)
+
+
+def cell_sums(df, group_cols, day=None, bucket=None):
+    """Mesures sommées par cellule (dimensions, tranche de prix, jour)."""
+    work = df[group_cols].copy()
+    work['bucket'] = price_bucket(df['prix_m2']) if bucket is None else bucket
+    work['day'] = day_index(df['date_mutation']) if day is None else day
+    work['prix_m2'] = df['prix_m2'].to_numpy()
+    work['valeur_fonciere'] = df['valeur_fonciere'].to_numpy()
+    work['surface_reelle_bati'] = df['surface_reelle_bati'].to_numpy()
+
+    return work.groupby(group_cols + ['bucket', 'day'], observed=True).agg(
+        nb_ventes=('prix_m2', 'size'),
+        sum_prix_m2=('prix_m2', 'sum'),
+        sum_valeur=('valeur_fonciere', 'sum'),
+        sum_surface=('surface_reelle_bati', 'sum'),
+    ).reset_index()
+
+
+def sketch_cells(df, day=None, bucket=None):
+    """Esquisses par cellule : nombre de ventes par (commune, type, tranche, classe de prix, jour)."""
+    work = df[COMMUNE_KEYS].copy()
+    work['bucket'] = price_bucket(df['prix_m2']) if bucket is None else bucket
+    work['day'] = day_index(df['date_mutation']) if day is None else day
+    work['qbin'] = sketch_bin(df['prix_m2'])
+    return work.groupby(SKETCH_KEYS + ['bucket', 'day'], observed=True).size().rename('nb_ventes').reset_index()
+
+
+def combine_cells(parts, group_cols, measures=MEASURES):
+    """Fusionne des cellules partielles (calculées par morceaux de données)."""
+    cells = pd.concat(parts, ignore_index=True)
+    for col in group_cols:
+        if not pd.api.types.is_numeric_dtype(cells[col]):
+            cells[col] = cells[col].astype(str)
+    return cells.groupby(group_cols + ['bucket', 'day'])[measures].sum().reset_index()
+
+
+def save_frame(df, path):
+    """Sauvegarde d'un DataFrame de cellules en npz (colonnes texte ou numériques)."""
+    arrays = {}
+    for col in df.columns:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            arrays[col] = df[col].to_numpy()
+        else:
+            arrays[col] = df[col].astype(str).to_numpy(dtype=str)
+    np.savez(path, __columns__=np.array(list(df.columns)), **arrays)
+
+
+def load_frame(path):
+    with np.load(path) as z:
+        return pd.DataFrame({c: z[c] for c in z['__columns__']})
+
+
+class RangeCube:
+    """
+    Sommes cumulées le long des jours pour chaque groupe (dimensions + tranche de prix).
+    Les cellules sont triées par (groupe, jour) et repérées par une clé unique
+    groupe * span + jour : la somme d'un groupe sur [début, fin] vaut cum[hi] - cum[lo],
+    avec lo/hi obtenus par recherche dichotomique, quelle que soit la longueur de la période.
+    """
+
+    def __init__(self, groups, keys, cum, day0, span):
+        self.groups = groups  # une ligne par groupe (dimensions + bucket)
+        self.keys = keys      # clés triées des cellules non vides
+        self.cum = cum        # (n_cellules + 1, len(MEASURES)), première ligne à 0
+        self.day0 = int(day0)
+        self.span = int(span)
+
+    @classmethod
+    def from_cells(cls, cells, group_cols, measures=MEASURES):
+        """Construit le cube à partir des cellules (dimensions, bucket, day, mesures)."""
+        gid = cells.groupby(group_cols + ['bucket'], observed=True).ngroup().to_numpy(np.int64)
+        first = ~pd.Series(gid).duplicated().to_numpy()
+        groups = cells.loc[first, group_cols + ['bucket']]
+        groups = groups.iloc[np.argsort(gid[first])].reset_index(drop=True)
+
+        day = cells['day'].to_numpy(np.int64)
+        day0 = int(day.min()) if len(day) else 0
+        span = int(day.max()) - day0 + 1 if len(day) else 1
+        keys = gid * span + (day - day0)
+        order = np.argsort(keys, kind='stable')
+
+        values = cells[measures].to_numpy(np.float64)[order]
+        cum = np.vstack([np.zeros((1, len(measures))), np.cumsum(values, axis=0)])
+        return cls(groups, keys[order], cum, day0, span)
+
+    @classmethod
+    def build(cls, df, group_cols, day, bucket):
+        return cls.from_cells(cell_sums(df, group_cols, day, bucket), group_cols)
+
+    def range_sums(self, gid, start_day, end_day):
+        """Sommes des mesures sur [start_day, end_day] pour chaque groupe de gid."""
+        start_day = max(int(start_day), self.day0)
+        end_day = min(int(end_day), self.day0 + self.span - 1)
+        if end_day < start_day or len(gid) == 0:
+            return np.zeros((len(gid), self.cum.shape[1]))
+
+        base = np.asarray(gid, dtype=np.int64) * self.span
+        lo = self.keys.searchsorted(base + (start_day - self.day0), side='left')
+        hi = self.keys.searchsorted(base + (end_day - self.day0), side='right')
+        return self.cum[hi] - self.cum[lo]
+
+    def save(self, path):
+        # Dimensions texte (g_) ou numériques (n_, ex. classe de prix des esquisses)
+        cols = {}
+        for c in self.groups.columns:
+            if c == 'bucket':
+                continue
+            if pd.api.types.is_numeric_dtype(self.groups[c]):
+                cols[f"n_{c}"] = self.groups[c].to_numpy()
+            else:
+                cols[f"g_{c}"] = self.groups[c].astype(str).to_numpy(dtype=str)
+        np.savez(path, keys=self.keys, cum=self.cum, day0=self.day0, span=self.span,
+                 bucket=self.groups['bucket'].to_numpy(np.int64), **cols)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            groups = pd.DataFrame({k[2:]: pd.Categorical(z[k]) if k.startswith('g_') else z[k]
+                                   for k in z.files if k.startswith(('g_', 'n_'))})
+            groups['bucket'] = z['bucket']
+            return cls(groups, z['keys'], z['cum'], z['day0'], z['span'])
+
+
+class DataCube:
+    """
+    Agrégats du dashboard : un cube par commune (carte, top 10, KPI ville) et un cube
+    par département (KPIs globaux, évolution mensuelle), plus les esquisses de quantiles
+    par commune (médiane, P10, P90). Seules les tranches de prix coupées par le slider
+    sont recalculées à partir des lignes brutes.
+    """
+
+    def __init__(self, df, communes, departements, row_order=None, bucket_sorted=None, sketches=None):
+        self.df = df
+        self.communes = communes
+        self.departements = departements
+        self.sketches = sketches
+
+        # Index des lignes brutes par tranche de prix (pour les tranches coupées),
+        # fourni tel quel par le store partagé
+        if row_order is None:
+            bucket = price_bucket(df['prix_m2'])
+            row_order = np.argsort(bucket, kind='stable')
+            bucket_sorted = bucket[row_order]
+        self._row_order = row_order
+        self._bucket_sorted = bucket_sorted
+
+    @classmethod
+    def build(cls, df):
+        day = df['day'].to_numpy(np.int64)
+        bucket = price_bucket(df['prix_m2'])
+        communes = RangeCube.build(df, COMMUNE_KEYS, day, bucket)
+        departements = RangeCube.build(df, DEPT_KEYS, day, bucket)
+        sketches = RangeCube.from_cells(sketch_cells(df, day, bucket), SKETCH_KEYS, SKETCH_MEASURES)
+        return cls(df, communes, departements, sketches=sketches)
+
+    def save(self, cube_dir=CUBE_DIR):
+        os.makedirs(cube_dir, exist_ok=True)
+        self.communes.save(os.path.join(cube_dir, "communes.npz"))
+        self.departements.save(os.path.join(cube_dir, "departements.npz"))
+        self.sketches.save(os.path.join(cube_dir, "sketches.npz"))
+
+    @staticmethod
+    def save_cells(commune_cells, dept_cells, sketches, cube_dir=CUBE_DIR):
+        """
+        Écrit le cube à partir de cellules déjà agrégées (sans les lignes brutes).
+        sketches None : pas d'esquisses (construites au chargement du dashboard).
+        """
+        os.makedirs(cube_dir, exist_ok=True)
+        RangeCube.from_cells(commune_cells, COMMUNE_KEYS).save(os.path.join(cube_dir, "communes.npz"))
+        RangeCube.from_cells(dept_cells, DEPT_KEYS).save(os.path.join(cube_dir, "departements.npz"))
+        sketches_path = os.path.join(cube_dir, "sketches.npz")
+        if sketches is not None:
+            RangeCube.from_cells(sketches, SKETCH_KEYS, SKETCH_MEASURES).save(sketches_path)
+        elif os.path.exists(sketches_path):
+            os.remove(sketches_path)  # esquisses d'une version précédente des données
+
+    @classmethod
+    def load(cls, df, cube_dir=CUBE_DIR):
+        """Charge le cube précalculé, ou le reconstruit s'il est absent."""
+        communes_path = os.path.join(cube_dir, "communes.npz")
+        dept_path = os.path.join(cube_dir, "departements.npz")
+        sketches_path = os.path.join(cube_dir, "sketches.npz")
+        if not (os.path.exists(communes_path) and os.path.exists(dept_path)):
+            print("Cube absent, construction à partir des données...")
+            return cls.build(df)
+        if os.path.exists(sketches_path):
+            sketches = RangeCube.load(sketches_path)
+        else:
+            # Cube écrit par une version précédente de clean_data.py
+            print("Esquisses de quantiles absentes, construction à partir des données...")
+            sketches = RangeCube.from_cells(sketch_cells(df, df['day'].to_numpy(np.int64)),
+                                            SKETCH_KEYS, SKETCH_MEASURES)
+        return cls(df, RangeCube.load(communes_path), RangeCube.load(dept_path), sketches=sketches)
+
+    # --- REQUÊTES ---
+
+    def _select(self, cube, selected_dept, selected_types, buckets, communes=None):
+        groups = cube.groups
+        mask = groups['type_local'].isin(selected_types) & groups['bucket'].isin(buckets)
+        if selected_dept != 'all':
+            mask &= groups['code_departement'] == selected_dept
+        if communes is not None:
+            mask &= groups['code_commune'].isin(communes)
+        return np.flatnonzero(mask.to_numpy())
+
+    def _raw_rows(self, selected_dept, selected_types, d0, d1, price_range, buckets, communes=None):
+        """Lignes brutes des tranches coupées par le slider, filtrées comme avant."""
+        lo = self._bucket_sorted.searchsorted(buckets, side='left')
+        hi = self._bucket_sorted.searchsorted(buckets, side='right')
+        idx = np.concatenate([self._row_order[a:b] for a, b in zip(lo, hi)] or [np.array([], dtype=np.int64)])
+        sub = self.df.iloc[np.sort(idx)]
+        sub = sub[detail_mask(sub, selected_dept, selected_types, d0, d1, price_range, communes)]
+        return sub.assign(nb_ventes=1, sum_prix_m2=sub['prix_m2'], sum_valeur=sub['valeur_fonciere'],
+                          sum_surface=sub['surface_reelle_bati'])
+
+    def _split_buckets(self, price_range):
+        """Tranches entièrement dans le slider (-> cube) et tranches coupées (-> lignes brutes)."""
+        p_min, p_max = price_range
+        all_buckets = np.unique(self._bucket_sorted)
+        left = all_buckets * BUCKET_WIDTH
+        right = (all_buckets + 1) * BUCKET_WIDTH
+        full = all_buckets[(left >= p_min) & (right <= p_max)]
+        partial = all_buckets[(right > p_min) & (left <= p_max) & ~np.isin(all_buckets, full)]
+        return full, partial
+
+    def query(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None):
+        """
+        Agrégats pour un jeu de filtres.
+        Retourne un dict de DataFrames : 'communes' (par commune), 'monthly' (par mois),
+        'types' (par type de bien) et 'totals' (Series des mesures globales).
+        Avec une sélection de communes, types et mois viennent aussi du cube par commune.
+        """
+        d0, d1 = int(day_index(start_date)), int(day_index(end_date))
+        full, partial = self._split_buckets(price_range)
+
+        raw = self._raw_rows(selected_dept, selected_types, d0, d1, price_range, partial, communes)
+
+        # 1. Communes (carte, top 10, commune top prix)
+        gid = self._select(self.communes, selected_dept, selected_types, full, communes)
+        df_com = self.communes.groups.iloc[gid][['code_commune', 'nom_commune', 'code_departement']].copy()
+        df_com[MEASURES] = self.communes.range_sums(gid, d0, d1)
+        df_com = pd.concat([df_com, raw[['code_commune', 'nom_commune', 'code_departement'] + MEASURES]])
+        df_com = df_com.astype({c: str for c in ['code_commune', 'nom_commune', 'code_departement']})
+        df_com = df_com.groupby(['code_commune', 'nom_commune', 'code_departement'])[MEASURES].sum()
+        df_com = df_com[df_com['nb_ventes'] > 0].reset_index()
+
+        # 2. Types de bien et totaux (cube départemental, ou par commune pour une sélection)
+        level = self.departements if communes is None else self.communes
+        gid = self._select(level, selected_dept, selected_types, full, communes)
+        dept_groups = level.groups.iloc[gid]
+        df_types = pd.DataFrame(level.range_sums(gid, d0, d1), columns=MEASURES)
+        df_types['type_local'] = dept_groups['type_local'].astype(str).to_numpy()
+        df_types = pd.concat([df_types, raw[['type_local'] + MEASURES].astype({'type_local': str})])
+        df_types = df_types.groupby('type_local')[MEASURES].sum()
+        df_types = df_types[df_types['nb_ventes'] > 0].reset_index()
+
+        # 3. Évolution mensuelle : une somme par mois de la période
+        rows = []
+        for period in pd.period_range(start_date, end_date, freq='M'):
+            m0 = max(d0, int(day_index(period.start_time)))
+            m1 = min(d1, int(day_index(period.end_time)))
+            sums = level.range_sums(gid, m0, m1).sum(axis=0)
+            rows.append([str(period)] + list(sums))
+        df_month = pd.DataFrame(rows, columns=['month_date'] + MEASURES)
+        raw_month = raw.assign(month_date=raw['month_date'].astype(str))
+        df_month = pd.concat([df_month, raw_month[['month_date'] + MEASURES]])
+        df_month = df_month.groupby('month_date')[MEASURES].sum()
+        df_month = df_month[df_month['nb_ventes'] > 0].reset_index()
+
+        return {
+            'communes': df_com,
+            'monthly': df_month,
+            'types': df_types,
+            'totals': df_types[MEASURES].sum(),
+        }
+
+    def query_sketches(self, selected_dept, selected_types, start_date, end_date, price_range, communes=None):
+        """
+        Esquisses de quantiles des prix/m² filtrés (voir sketch.py) : une ligne par commune
+        et classe de prix, colonnes code_commune, nom_commune, code_departement, qbin, nb_ventes.
+        """
+        d0, d1 = int(day_index(start_date)), int(day_index(end_date))
+        full, partial = self._split_buckets(price_range)
+        keys = ['code_commune', 'nom_commune', 'code_departement']
+
+        gid = self._select(self.sketches, selected_dept, selected_types, full, communes)
+        cells = self.sketches.groups.iloc[gid][keys + ['qbin']].reset_index(drop=True)
+        cells['nb_ventes'] = self.sketches.range_sums(gid, d0, d1)[:, 0]
+        raw = self._raw_rows(selected_dept, selected_types, d0, d1, price_range, partial, communes)
+        raw = raw[keys].assign(qbin=sketch_bin(raw['prix_m2']), nb_ventes=1.0)
+        return pd.concat([cells[cells['nb_ventes'] > 0], raw], ignore_index=True)
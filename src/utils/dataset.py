@@ -0,0 +1,126 @@
+# dataset.py
+import os
+import threading
+import time
+
+from src.utils.backends import BACKENDS, DEFAULT_BACKEND, SAMPLE_ROWS, PandasBackend, SampleBackend
+from src.utils.cube import DataCube
+from src.utils.geo_store import GeoStore, load_geo_index
+from src.utils.load_data import load_detail
+from src.utils.shared_store import SharedDataset
+from src.utils.spatial import SpatialIndex
+
+
+class Dataset:
+    """
+    Données du dashboard (détail, cube, contours, centres des départements, index spatial).
+    Le chargement se fait en arrière-plan (start) ou à la première requête (get) :
+    l'application répond avant que les données soient prêtes.
+    Les filtres et agrégations passent par self.backend (voir backends.py) ; avec un
+    moteur autre que pandas, les transactions ne sont pas chargées en mémoire.
+    """
+
+    def __init__(self, data_dir, version, shared_dir=None, backend=DEFAULT_BACKEND):
+        if backend not in BACKENDS:
+            raise ValueError(f"Moteur de requête inconnu : {backend} (choix : {', '.join(BACKENDS)})")
+        self.data_dir = data_dir
+        self.version = version
+        self.shared_dir = shared_dir
+        self.backend_name = backend
+        self.backend = None
+        self.preview = None  # SampleBackend : échantillon stratifié de l'aperçu
+        self.df = None
+        self.cube = None
+        self.geo_store = None
+        self.dept_centers = None
+        self.spatial = None
+        self.error = None
+        self.load_seconds = None
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Lance le chargement dans un thread (sans bloquer le démarrage)."""
+        if self._thread is None and not self.ready.is_set():
+            self._thread = threading.Thread(target=self._load_in_background, name="immoviz-load", daemon=True)
+            self._thread.start()
+
+    def _load_in_background(self):
+        try:
+            self.load()
+        except Exception as e:
+            print(f"[ERROR] Chargement des données : {e}")
+
+    def get(self):
+        """Données prêtes à l'emploi (attend ou déclenche le chargement si besoin)."""
+        if not self.ready.is_set():
+            self.load()
+        return self
+
+    def status(self):
+        """'ready', 'loading', 'error' (dernier chargement en échec) ou 'idle' (pas commencé)."""
+        if self.ready.is_set():
+            return 'ready'
+        if self._lock.locked() or (self._thread is not None and self._thread.is_alive()):
+            return 'loading'
+        return 'error' if self.error is not None else 'idle'
+
+    def load(self):
+        with self._lock:
+            if self.ready.is_set():
+                return
+            t0 = time.perf_counter()
+            try:
+                self._load()
+                # Échantillon de l'aperçu, tiré une fois pour toutes
+                self.preview = SampleBackend(self.backend.sample(SAMPLE_ROWS))
+            except Exception as e:
+                self.error = e
+                raise
+            self.error = None
+            self.load_seconds = time.perf_counter() - t0
+            self.ready.set()
+            print(f"Données prêtes en {self.load_seconds:.1f} s ({self.backend.rows:,} transactions, moteur {self.backend.name}, "
+                  f"échantillon de {self.preview.rows:,} lignes).")
+
+    def _load(self):
+        geo_path = os.path.join(self.data_dir, "raw", "etalab_communes.geojson")
+        geo_dir = os.path.join(self.data_dir, "cleaned", "geo")
+        # Index spatial des communes (sélection sur la carte), ouvert en mmap
+        self.spatial = SpatialIndex.load(geo_dir, geo_path=geo_path)
+        if self.backend_name != 'pandas':
+            # Requêtes exécutées sur le disque : seuls les contours et les centres sont chargés
+            print(f"Moteur de requête : {self.backend_name}")
+            self.backend = BACKENDS[self.backend_name](os.path.join(self.data_dir, "cleaned", "data_detail"))
+            self.geo_store = GeoStore.load(geo_dir, geo_path=geo_path)
+            self.dept_centers = load_geo_index(geo_path, geo_dir)['departements']
+            return
+
+        # Serveur multi-workers : données ouvertes en mémoire partagée (voir shared_store.py)
+        shared = SharedDataset.attach(self.shared_dir, self.version) if self.shared_dir else None
+        if self.shared_dir and shared is None:
+            print(f"Store partagé absent ou périmé ({self.shared_dir}), chargement local.")
+        if shared is not None:
+            self.df, self.cube = shared.df, shared.cube
+            self.geo_store, self.dept_centers = shared.geo_store, shared.dept_centers
+            self.backend = PandasBackend(self.df, self.cube)
+            return
+
+        print("Chargement des données...")
+        # Lecture des données principales (Parquet typé, CSV en secours)
+        df = load_detail(self.data_dir)
+
+        # Cube d'agrégats précalculé par clean_data.py (reconstruit s'il manque)
+        cube = DataCube.load(df, os.path.join(self.data_dir, "cleaned", "cube"))
+
+        # Géométries simplifiées par niveau de zoom (précalculées par geo_store.py) ;
+        # le GeoJSON complet n'est parsé que si le store ou les centroïdes sont à refaire
+        geo_store = GeoStore.load(geo_dir, geo_path=geo_path)
+
+        # Centroïdes et emprises des départements (centre et zoom de la carte)
+        dept_centers = load_geo_index(geo_path, geo_dir)['departements']
+        print(f"Centraux chargés pour {len(dept_centers)} départements.")
+
+        self.df, self.cube, self.geo_store, self.dept_centers = df, cube, geo_store, dept_centers
+        self.backend = PandasBackend(df, cube)
@@ -0,0 +1,314 @@
+# download.py
+import email.utils
+import hashlib
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Nombre de connexions simultanées quand le serveur accepte les requêtes Range
+CONNECTIONS = 4
+# Taille des blocs lus sur le réseau
+CHUNK_SIZE = 1024 * 1024
+# Fréquence de sauvegarde de l'état (en octets reçus) pour pouvoir reprendre
+STATE_EVERY = 8 * 1024 * 1024
+TIMEOUT = 60
+
+
+def _paths(dest_path):
+    """Fichier partiel, état de reprise et métadonnées du fichier terminé."""
+    return dest_path + ".part", dest_path + ".state.json", dest_path + ".meta.json"
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def not_found(error):
+    """L'erreur est-elle un 404 (fichier absent du serveur, ex. année non publiée) ?"""
+    return isinstance(error, requests.HTTPError) and error.response is not None \
+        and error.response.status_code == 404
+
+
+def probe(url, session):
+    """Taille, support des Range, ETag et Last-Modified annoncés par le serveur."""
+    r = session.head(url, allow_redirects=True, timeout=TIMEOUT)
+    if r.status_code == 405:
+        # HEAD refusé : on lit seulement les en-têtes d'un GET
+        r = session.get(url, stream=True, timeout=TIMEOUT)
+        r.close()
+    r.raise_for_status()
+    length = r.headers.get('Content-Length')
+    return {
+        'url': r.url,
+        'size': int(length) if length is not None else None,
+        'ranges': r.headers.get('Accept-Ranges', '').lower() == 'bytes',
+        'etag': r.headers.get('ETag'),
+        'last_modified': r.headers.get('Last-Modified'),
+    }
+
+
+def is_up_to_date(dest_path, remote):
+    """Le fichier local correspond-il encore à la version du serveur ?"""
+    if not os.path.exists(dest_path):
+        return False
+    meta = _read_json(_paths(dest_path)[2])
+    if meta is None:
+        # Fichier téléchargé par une ancienne version : on compare les dates
+        if not remote['last_modified']:
+            return True
+        remote_time = email.utils.parsedate_to_datetime(remote['last_modified']).timestamp()
+        return os.path.getmtime(dest_path) >= remote_time
+    if remote['etag']:
+        return remote['etag'] == meta.get('etag')
+    if remote['last_modified']:
+        return remote['last_modified'] == meta.get('last_modified')
+    return remote['size'] == meta.get('size')
+
+
+class _Progress:
+    """Affichage de la progression, partagé entre les connexions."""
+
+    def __init__(self, total, done=0):
+        self.total = total
+        self.done = done
+        self.lock = threading.Lock()
+
+    def add(self, n):
+        with self.lock:
+            self.done += n
+            mb_downloaded = self.done / (1024 * 1024)
+            if self.total:
+                total_mb = self.total / (1024 * 1024)
+                percent = int(self.done / self.total * 100)
+                sys.stdout.write(f"\r📥 Téléchargé : {mb_downloaded:.1f} Mo / {total_mb:.1f} Mo ({percent}%)")
+            else:
+                sys.stdout.write(f"\r📥 Téléchargé : {mb_downloaded:.1f} Mo")
+            sys.stdout.flush()
+
+
+def _split(size, connections):
+    """Découpe [0, size[ en segments [début, fin] (bornes incluses, comme Range)."""
+    step = -(-size // connections)
+    return [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)]
+
+
+def _if_range(state):
+    """Validateur If-Range : un ETag faible (W/"...") est interdit (RFC 9110), on prend alors Last-Modified."""
+    etag = state.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return state.get('last_modified')
+
+
+def _fetch_segment(url, session, part_path, segment, state, state_path, lock, progress):
+    """Télécharge la fin d'un segment [début + déjà reçu, fin] dans le fichier partiel."""
+    start, end, done = segment
+    if start + done > end:
+        return
+    headers = {'Range': f"bytes={start + done}-{end}"}
+    if _if_range(state):
+        headers['If-Range'] = _if_range(state)
+    with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise IOError("Le serveur a ignoré la requête Range (fichier modifié ?)")
+        unsaved = 0
+        # Sans tampon : un octet compté dans l'état est déjà transmis au système
+        with open(part_path, 'r+b', buffering=0) as f:
+            f.seek(start + done)
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                if not chunk:
+                    continue
+                f.write(chunk)
+                with lock:
+                    segment[2] += len(chunk)
+                    unsaved += len(chunk)
+                    if unsaved >= STATE_EVERY:
+                        _write_json(state_path, state)
+                        unsaved = 0
+                progress.add(len(chunk))
+    with lock:
+        _write_json(state_path, state)
+
+
+def _fetch_stream(url, session, part_path, state, state_path, progress):
+    """Un seul flux, repris à la fin du fichier partiel si le serveur le permet."""
+    offset = os.path.getsize(part_path) if state['ranges'] and os.path.exists(part_path) else 0
+    headers = {'Range': f"bytes={offset}-"} if offset else {}
+    with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+        r.raise_for_status()
+        if offset and r.status_code != 206:
+            offset = 0
+        progress.done = offset
+        with open(part_path, 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+                    progress.add(len(chunk))
+
+
+def download(url, dest_path, connections=CONNECTIONS, expected_sha256=None, session=None):
+    """
+    Téléchargement reprenable de url vers dest_path.
+    - saute le téléchargement si ETag / Last-Modified n'ont pas changé ;
+    - plusieurs requêtes Range en parallèle si le serveur les accepte, sinon un seul flux ;
+    - reprend un fichier partiel (dest.part) grâce à l'état sauvegardé (dest.state.json) ;
+    - vérifie la taille annoncée et, si fourni, l'empreinte sha256.
+    Retourne True si un fichier a été téléchargé, False s'il était déjà à jour.
+    """
+    session = session or requests.Session()
+    part_path, state_path, meta_path = _paths(dest_path)
+    try:
+        remote = probe(url, session)
+    except requests.RequestException:
+        # Serveur injoignable : on garde le fichier local s'il existe
+        if os.path.exists(dest_path):
+            print(f"[OK] Serveur injoignable, fichier existant conservé : {dest_path}")
+            return False
+        raise
+
+    if is_up_to_date(dest_path, remote):
+        print(f"[OK] Le fichier est à jour : {dest_path}")
+        return False
+
+    # Reprise possible seulement si la version distante n'a pas changé
+    state = _read_json(state_path)
+    same_version = (state is not None and os.path.exists(part_path)
+                    and state.get('url') == url and state.get('size') == remote['size']
+                    and state.get('etag') == remote['etag']
+                    and state.get('last_modified') == remote['last_modified'])
+    parallel = remote['ranges'] and remote['size'] and connections > 1
+    if not same_version:
+        state = dict(remote, url=url)
+        if parallel:
+            state['segments'] = _split(remote['size'], connections)
+            with open(part_path, 'wb') as f:
+                f.truncate(remote['size'])
+        elif os.path.exists(part_path):
+            os.remove(part_path)
+        _write_json(state_path, state)
+    elif parallel and 'segments' not in state:
+        parallel = False
+
+    print(f"[DOWNLOAD] Démarrage du téléchargement depuis : {url}")
+    if parallel:
+        done = sum(s[2] for s in state['segments'])
+        if done:
+            print(f"[RESUME] Reprise à {done / (1024 * 1024):.1f} Mo")
+        progress = _Progress(remote['size'], done)
+        lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=len(state['segments'])) as pool:
+            futures = [pool.submit(_fetch_segment, url, session, part_path, seg, state, state_path, lock, progress)
+                       for seg in state['segments']]
+            for future in futures:
+                future.result()
+    else:
+        _fetch_stream(url, session, part_path, state, state_path, _Progress(remote['size']))
+
+    # Vérifications avant de remplacer le fichier final
+    size = os.path.getsize(part_path)
+    if remote['size'] is not None and size != remote['size']:
+        raise IOError(f"Taille incorrecte : {size} octets reçus, {remote['size']} attendus")
+    digest = _sha256(part_path)
+    if expected_sha256 and digest != expected_sha256:
+        os.remove(part_path)
+        os.remove(state_path)
+        raise IOError("Empreinte sha256 incorrecte, fichier supprimé")
+
+    os.replace(part_path, dest_path)
+    os.remove(state_path)
+    _write_json(meta_path, {'url': url, 'size': size, 'sha256': digest,
+                            'etag': remote['etag'], 'last_modified': remote['last_modified']})
+    print(f"\n[OK] Téléchargement terminé : {dest_path}")
+    return True
+
+
+class StreamingDownload:
+    """
+    Flux HTTP lisible comme un fichier pendant le téléchargement (read()).
+    Les octets reçus sont hachés au passage et, si keep_path est donné, recopiés
+    sur disque : le fichier n'est mis en place que si le flux est arrivé complet.
+    """
+
+    def __init__(self, url, keep_path=None, session=None):
+        self.url = url
+        self.keep_path = keep_path
+        self.session = session or requests.Session()
+        self.size = 0
+        self._sha = hashlib.sha256()
+        self._keep = None
+        # Lu comme un fichier par pyarrow (PythonFile), qui consulte closed et appelle close()
+        self.closed = False
+
+    def __enter__(self):
+        self.response = self.session.get(self.url, stream=True, timeout=TIMEOUT)
+        self.response.raise_for_status()
+        # On veut les octets du .gz tels quels (pas de décodage HTTP)
+        self.response.raw.decode_content = False
+        length = self.response.headers.get('Content-Length')
+        self.expected_size = int(length) if length is not None else None
+        self.etag = self.response.headers.get('ETag')
+        self.last_modified = self.response.headers.get('Last-Modified')
+        if self.keep_path:
+            self._keep = open(_paths(self.keep_path)[0], 'wb')
+        return self
+
+    def read(self, n=-1):
+        data = self.response.raw.read(None if n is None or n < 0 else n)
+        if data:
+            self.size += len(data)
+            self._sha.update(data)
+            if self._keep:
+                self._keep.write(data)
+        return data
+
+    @property
+    def sha256(self):
+        return self._sha.hexdigest()
+
+    def close(self):
+        # Appelé par pyarrow en fin de lecture : la mise en place du fichier reste dans __exit__
+        self.response.close()
+        self.closed = True
+
+    def __exit__(self, exc_type, exc, tb):
+        self.response.close()
+        self.closed = True
+        complete = exc_type is None and (self.expected_size is None or self.size == self.expected_size)
+        if self._keep:
+            self._keep.close()
+            part_path, _, meta_path = _paths(self.keep_path)
+            if complete:
+                os.replace(part_path, self.keep_path)
+                _write_json(meta_path, {'url': self.url, 'size': self.size, 'sha256': self.sha256,
+                                        'etag': self.etag, 'last_modified': self.last_modified})
+            else:
+                os.remove(part_path)
+        # Flux tronqué, fichier conservé ou non : l'appelant ne doit pas garder ce qu'il en a lu
+        if exc_type is None and not complete:
+            raise IOError(f"Flux incomplet : {self.size} octets reçus, {self.expected_size} attendus")
+        return False
@@ -0,0 +1,87 @@
+# export.py
+"""
+Export des transactions filtrées en CSV ou Parquet, envoyé au client au fil de l'eau :
+chaque lot de lignes (QueryBackend.export_batches) est encodé puis transmis avant de
+lire le suivant. La mémoire d'un export reste bornée par la taille d'un lot, même
+pour la France entière.
+
+    GET /api/v1/export?format=csv&dept=75&types=Appartement&start=2023-01-01
+"""
+import io
+
+from src.utils.backends import EXPORT_COLUMNS
+from src.utils.load_data import HAS_PYARROW
+
+if HAS_PYARROW:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Schéma du fichier Parquet exporté, identique quel que soit le moteur de requête
+    # (catégories du moteur pandas, flottants 32 bits, timestamps de DuckDB...)
+    EXPORT_TYPES = {'date_mutation': pa.date32(), 'valeur_fonciere': pa.float64(),
+                    'surface_reelle_bati': pa.float64(), 'prix_m2': pa.float64()}
+    EXPORT_SCHEMA = pa.schema([(c, EXPORT_TYPES.get(c, pa.string())) for c in EXPORT_COLUMNS])
+
+EXPORT_FORMATS = {
+    'csv': ("text/csv; charset=utf-8", "csv"),
+    'parquet': ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def csv_chunks(batches):
+    """Lots de lignes -> morceaux de texte CSV (en-tête une seule fois)."""
+    header = True
+    for batch in batches:
+        yield batch.to_csv(index=False, header=header, date_format='%Y-%m-%d')
+        header = False
+    if header:
+        # Aucune ligne : fichier avec l'en-tête seul
+        yield ",".join(EXPORT_COLUMNS) + "\n"
+
+
+class _ChunkSink(io.RawIOBase):
+    """Fichier en écriture qui garde les octets jusqu'au prochain drain() (position continue)."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(batches):
+    """Lots de lignes -> morceaux d'un fichier Parquet (un row group par lot)."""
+    if not HAS_PYARROW:
+        raise RuntimeError("L'export Parquet nécessite pyarrow (pip install pyarrow)")
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, EXPORT_SCHEMA)
+    try:
+        for batch in batches:
+            table = pa.Table.from_pandas(batch[EXPORT_COLUMNS], preserve_index=False)
+            writer.write_table(table.cast(EXPORT_SCHEMA))
+            yield sink.drain()
+    finally:
+        # Aucune ligne : fichier valide, sans row group
+        writer.close()
+    yield sink.drain()
+
+
+def export_chunks(batches, fmt):
+    """Morceaux du fichier exporté au format fmt ('csv' ou 'parquet')."""
+    if fmt == 'csv':
+        return (chunk.encode('utf-8') for chunk in csv_chunks(batches))
+    return parquet_chunks(batches)
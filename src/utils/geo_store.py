@@ -0,0 +1,295 @@
+# geo_store.py
+import hashlib
+import json
+import os
+import numpy as np
+
+GEO_PATH = os.path.join("data", "raw", "etalab_communes.geojson")
+GEO_STORE_DIR = os.path.join("data", "cleaned", "geo")
+# Centroïdes et emprises des communes et départements (indexés par l'empreinte du GeoJSON)
+GEO_INDEX_FILE = "centroids.json"
+
+# Taille approximative de la carte (px) et bornes du zoom calculé à partir d'une emprise
+MAP_WIDTH_PX = 900
+MAP_HEIGHT_PX = 500
+MIN_ZOOM = 3
+MAX_ZOOM = 13
+
+# Niveaux de simplification : tolérance Douglas-Peucker (degrés) et précision des coordonnées
+LEVELS = {
+    'national': {'tolerance': 0.01, 'decimals': 3},       # ~1 km, vue France entière
+    'departement': {'tolerance': 0.002, 'decimals': 4},   # ~200 m, vue département
+    'ville': {'tolerance': 0.0005, 'decimals': 5},        # ~50 m, vue Paris
+}
+
+
+def level_for_zoom(zoom):
+    """Niveau de géométrie adapté au zoom choisi par update_dashboard."""
+    if zoom < 6:
+        return 'national'
+    if zoom < 10:
+        return 'departement'
+    return 'ville'
+
+
+def simplify_ring(ring, tolerance):
+    """Douglas-Peucker (itératif, NumPy) sur un anneau fermé."""
+    pts = np.asarray(ring, dtype=np.float64)
+    if len(pts) <= 4:
+        return pts
+
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = pts[start], pts[end]
+        seg = pts[start + 1:end]
+        d = b - a
+        norm = np.hypot(d[0], d[1])
+        if norm == 0:
+            dist = np.hypot(seg[:, 0] - a[0], seg[:, 1] - a[1])
+        else:
+            dist = np.abs(d[0] * (seg[:, 1] - a[1]) - d[1] * (seg[:, 0] - a[0])) / norm
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return pts[keep]
+
+
+def simplify_polygon(rings, tolerance, decimals):
+    """Simplifie un polygone ; un trou qui disparaît est supprimé, l'extérieur est conservé."""
+    out = []
+    for k, ring in enumerate(rings):
+        simple = simplify_ring(ring, tolerance)
+        if len(simple) < 4:
+            if k > 0:
+                continue
+            # Petite commune : on garde un triangle pour qu'elle reste visible
+            pts = np.asarray(ring, dtype=np.float64)
+            simple = pts[[0, len(pts) // 3, 2 * len(pts) // 3, 0]]
+        out.append(np.round(simple, decimals).tolist())
+    return out
+
+
+def simplify_geometry(geom, tolerance, decimals):
+    if geom['type'] == 'Polygon':
+        return {'type': 'Polygon', 'coordinates': simplify_polygon(geom['coordinates'], tolerance, decimals)}
+    if geom['type'] == 'MultiPolygon':
+        return {'type': 'MultiPolygon',
+                'coordinates': [simplify_polygon(p, tolerance, decimals) for p in geom['coordinates']]}
+    return geom
+
+
+def dept_code(code_commune):
+    """Département d'une commune (3 caractères pour l'outre-mer)."""
+    return code_commune[:3] if code_commune.startswith('97') else code_commune[:2]
+
+
+def feature_stats(geojson):
+    """
+    Centroïde et emprise de chaque commune, en NumPy sur tous les sommets à la fois.
+    Le centroïde est pondéré par l'aire sur tous les polygones (MultiPolygon compris),
+    trous déduits. Retourne (codes, aires, centroïdes (lon, lat), emprises).
+    """
+    codes, rings, signs, owners = [], [], [], []
+    for feature in geojson['features']:
+        code = feature['properties'].get('code')
+        geom = feature.get('geometry') or {}
+        if geom.get('type') == 'Polygon':
+            polygons = [geom['coordinates']]
+        elif geom.get('type') == 'MultiPolygon':
+            polygons = geom['coordinates']
+        else:
+            continue
+        parts = [(np.asarray(ring, dtype=np.float64)[:, :2], -1.0 if k else 1.0)
+                 for polygon in polygons for k, ring in enumerate(polygon) if len(ring) >= 3]
+        if not code or not parts:
+            continue
+        for ring, sign in parts:
+            rings.append(ring)
+            signs.append(sign)
+            owners.append(len(codes))
+        codes.append(code)
+
+    n_rings, n_features = len(rings), len(codes)
+    if not n_rings:
+        return [], np.zeros(0), np.zeros((0, 2)), np.zeros((0, 4))
+    lengths = np.array([len(r) for r in rings])
+    pts = np.concatenate(rings)
+    x, y = pts[:, 0], pts[:, 1]
+    ring_of = np.repeat(np.arange(n_rings), lengths)
+    owner_of = np.repeat(np.asarray(owners), lengths)
+
+    # Arête i -> suivant dans le même anneau (le dernier sommet rejoint le premier)
+    starts = np.cumsum(lengths) - lengths
+    nxt = np.arange(len(pts)) + 1
+    nxt[starts + lengths - 1] = starts
+    cross = x * y[nxt] - x[nxt] * y
+
+    # Formule du lacet par anneau, puis aires signées : extérieur +, trou -
+    area = 0.5 * np.bincount(ring_of, cross, n_rings)
+    mx = np.bincount(ring_of, (x + x[nxt]) * cross, n_rings) / 6
+    my = np.bincount(ring_of, (y + y[nxt]) * cross, n_rings) / 6
+    orient = np.where(area < 0, -1.0, 1.0) * np.asarray(signs)
+    f_area = np.bincount(owners, np.abs(area) * np.asarray(signs), n_features)
+    f_mx = np.bincount(owners, mx * orient, n_features)
+    f_my = np.bincount(owners, my * orient, n_features)
+
+    # Géométrie dégénérée (aire nulle) : moyenne des sommets
+    count = np.bincount(owner_of, minlength=n_features)
+    mean_x = np.bincount(owner_of, x, n_features) / count
+    mean_y = np.bincount(owner_of, y, n_features) / count
+    ok = np.abs(f_area) > 1e-12
+    safe = np.where(ok, f_area, 1.0)
+    centroids = np.column_stack([np.where(ok, f_mx / safe, mean_x), np.where(ok, f_my / safe, mean_y)])
+
+    first = np.searchsorted(owner_of, np.arange(n_features))
+    bboxes = np.column_stack([np.minimum.reduceat(x, first), np.minimum.reduceat(y, first),
+                              np.maximum.reduceat(x, first), np.maximum.reduceat(y, first)])
+    return codes, np.maximum(f_area, 0.0), centroids, bboxes
+
+
+def compute_geo_index(geojson):
+    """Centroïde et emprise par commune et par département (centroïdes pondérés par l'aire)."""
+    codes, areas, centroids, bboxes = feature_stats(geojson)
+    communes = {code: {'lon': c[0], 'lat': c[1], 'bbox': b}
+                for code, c, b in zip(codes, np.round(centroids, 6).tolist(), np.round(bboxes, 6).tolist())}
+
+    depts = np.array([dept_code(c) for c in codes])
+    departements = {}
+    for dept in np.unique(depts):
+        sel = depts == dept
+        w = areas[sel] if areas[sel].sum() > 0 else np.ones(sel.sum())
+        c = (centroids[sel] * w[:, None]).sum(axis=0) / w.sum()
+        b = bboxes[sel]
+        departements[str(dept)] = {
+            'lon': round(float(c[0]), 6), 'lat': round(float(c[1]), 6),
+            'bbox': [round(float(b[:, 0].min()), 6), round(float(b[:, 1].min()), 6),
+                     round(float(b[:, 2].max()), 6), round(float(b[:, 3].max()), 6)],
+        }
+    return {'communes': communes, 'departements': departements}
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_geo_index(geo_path=GEO_PATH, store_dir=GEO_STORE_DIR):
+    """
+    Centroïdes et emprises, lus dans store_dir/centroids.json. Le fichier est indexé
+    par l'empreinte du GeoJSON : il n'est recalculé (parsing complet) que si le GeoJSON
+    a changé. Taille et date identiques : l'empreinte n'est même pas recalculée.
+    """
+    path = os.path.join(store_dir, GEO_INDEX_FILE)
+    st = os.stat(geo_path)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        source = index['source']
+    except (OSError, ValueError, KeyError):
+        index, source = None, {}
+
+    if index is not None and source.get('size') == st.st_size and source.get('mtime_ns') == st.st_mtime_ns:
+        return index
+    digest = _file_sha256(geo_path)
+    if index is None or source.get('sha256') != digest:
+        print("Calcul des centroïdes et emprises...")
+        with open(geo_path, 'r', encoding='utf-8') as f:
+            index = compute_geo_index(json.load(f))
+    index['source'] = {'sha256': digest, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    os.makedirs(store_dir, exist_ok=True)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)
+    return index
+
+
+def map_view(bbox, width=MAP_WIDTH_PX, height=MAP_HEIGHT_PX, padding=0.1):
+    """
+    Centre et zoom (tuiles de 512 px, comme mapbox) pour que l'emprise
+    [lon_min, lat_min, lon_max, lat_max] tienne dans la carte, avec une marge.
+    """
+    lon_min, lat_min, lon_max, lat_max = bbox
+    merc = lambda lat: np.log(np.tan(np.pi / 4 + np.radians(np.clip(lat, -85, 85)) / 2))
+    dx = max(lon_max - lon_min, 1e-6) * (1 + padding)
+    dy = max(merc(lat_max) - merc(lat_min), 1e-8) * (1 + padding)
+    zoom = min(np.log2(width * 360 / (512 * dx)), np.log2(height * 2 * np.pi / (512 * dy)))
+    lat_center = np.degrees(2 * np.arctan(np.exp((merc(lat_min) + merc(lat_max)) / 2)) - np.pi / 2)
+    center = {'lat': float(lat_center), 'lon': float((lon_min + lon_max) / 2)}
+    return center, float(np.clip(round(zoom, 2), MIN_ZOOM, MAX_ZOOM))
+
+
+def build_geo_store(geojson, store_dir=GEO_STORE_DIR):
+    """
+    Précalcule un fichier par niveau : {code commune: Feature sérialisée}.
+    Les features restent sérialisées pour n'avoir à parser que celles affichées.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    for level, params in LEVELS.items():
+        features = {}
+        for feature in geojson['features']:
+            code = feature['properties'].get('code')
+            if not code or not feature.get('geometry'):
+                continue
+            features[code] = json.dumps({
+                'type': 'Feature',
+                'properties': {'code': code},
+                'geometry': simplify_geometry(feature['geometry'], params['tolerance'], params['decimals']),
+            }, separators=(',', ':'))
+        path = os.path.join(store_dir, f"communes_{level}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(features, f)
+        size_mb = sum(len(v) for v in features.values()) / (1024 * 1024)
+        print(f"   Niveau {level} : {len(features)} communes, {size_mb:.1f} Mo")
+
+
+class GeoStore:
+    """Géométries simplifiées par niveau, servies uniquement pour les communes affichées."""
+
+    def __init__(self, levels):
+        self.levels = levels  # {niveau: {code: feature JSON}}
+
+    @classmethod
+    def load(cls, store_dir=GEO_STORE_DIR, geojson=None, geo_path=GEO_PATH):
+        """Charge le store précalculé ; à défaut, le construit à partir du GeoJSON complet."""
+        paths = {level: os.path.join(store_dir, f"communes_{level}.json") for level in LEVELS}
+        if not all(os.path.exists(p) for p in paths.values()):
+            if geojson is None:
+                with open(geo_path, 'r', encoding='utf-8') as f:
+                    geojson = json.load(f)
+            print("Store géographique absent, construction...")
+            build_geo_store(geojson, store_dir)
+
+        levels = {}
+        for level, path in paths.items():
+            with open(path, 'r', encoding='utf-8') as f:
+                levels[level] = json.load(f)
+        return cls(levels)
+
+    def subset(self, codes, level):
+        """GeoJSON ne contenant que les communes demandées, au niveau de détail voulu."""
+        features = self.levels[level]
+        parts = [features[c] for c in dict.fromkeys(codes) if c in features]
+        return json.loads('{"type":"FeatureCollection","features":[' + ','.join(parts) + ']}')
+
+
+if __name__ == "__main__":
+    from src.utils.spatial import SpatialIndex
+
+    print("Construction du store géographique...")
+    with open(GEO_PATH, 'r', encoding='utf-8') as f:
+        geojson = json.load(f)
+    build_geo_store(geojson)
+    SpatialIndex.build(geojson).save()
+    load_geo_index()
+    print(f"{GEO_STORE_DIR} généré.")
@@ -1,57 +1,44 @@
+import argparse
+import datetime
 import os
-import requests
-import sys
+
+from src.utils.download import download, not_found
 
 # Configuration
-DATA_URL = "https://files.data.gouv.fr/geo-dvf/latest/csv/2023/full.csv.gz"
+DATA_URL = "https://files.data.gouv.fr/geo-dvf/latest/csv/{year}/full.csv.gz"
 OUTPUT_DIR = os.path.join("data", "raw")
-OUTPUT_FILENAME = "dvf_2023.csv.gz"
-OUTPUT_PATH = os.path.join(OUTPUT_DIR, OUTPUT_FILENAME)
+OUTPUT_FILENAME = "dvf_{year}.csv.gz"
+
+# Années à télécharger par défaut : geo-dvf ne publie que les cinq dernières années,
+# de 2020 à l'année en cours (une année absente du serveur est simplement ignorée)
+FIRST_YEAR = 2020
+LAST_YEAR = datetime.date.today().year
 
-def download_file(url, dest_path):
-    if os.path.exists(dest_path):
-        print(f"[OK] Le fichier existe déjà : {dest_path}")
-        return
 
-    print(f"[DOWNLOAD] Démarrage du téléchargement depuis : {url}")
-    print("[WAIT] Cela peut prendre quelques minutes selon votre connexion...")
-    
+def output_path(year):
+    return os.path.join(OUTPUT_DIR, OUTPUT_FILENAME.format(year=year))
+
+def download_file(url, dest_path):
+    """
+    Télécharge un fichier DVF (reprenable, en parallèle si le serveur le permet).
+    En cas d'erreur, le fichier partiel est conservé pour reprendre au prochain lancement.
+    """
     try:
-        with requests.get(url, stream=True) as response:
-            response.raise_for_status()
-            
-            total_length = response.headers.get('content-length')
-            
-            with open(dest_path, 'wb') as f:
-                dl = 0
-                # On force le téléchargement par morceaux, même sans taille totale connue
-                for chunk in response.iter_content(chunk_size=8192): 
-                    if chunk:
-                        dl += len(chunk)
-                        f.write(chunk)
-                        
-                        # Conversion en Mo pour l'affichage
-                        mb_downloaded = dl / (1024 * 1024)
-                        
-                        if total_length:
-                            total_mb = int(total_length) / (1024 * 1024)
-                            percent = int(dl / int(total_length) * 100)
-                            sys.stdout.write(f"\r📥 Téléchargé : {mb_downloaded:.1f} Mo / {total_mb:.1f} Mo ({percent}%)")
-                        else:
-                            # Si pas de taille totale, on affiche juste ce qu'on a reçu
-                            sys.stdout.write(f"\r📥 Téléchargé : {mb_downloaded:.1f} Mo")
-                        
-                        sys.stdout.flush()
-                            
-        print(f"\n[OK] Téléchargement terminé : {dest_path}")
-        
+        download(url, dest_path)
     except Exception as e:
+        if not_found(e):
+            print(f"[SKIP] Fichier absent du serveur (année non publiée) : {url}")
+            return
         print(f"\n[ERROR] Erreur : {e}")
-        # En cas d'erreur, on supprime le fichier corrompu pour ne pas fausser la prochaine tentative
-        if os.path.exists(dest_path):
-            os.remove(dest_path)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Téléchargement des fichiers DVF")
+    parser.add_argument("--years", type=int, nargs="+",
+                        default=list(range(FIRST_YEAR, LAST_YEAR + 1)),
+                        help=f"Années à télécharger (défaut : {FIRST_YEAR} à {LAST_YEAR})")
+    args = parser.parse_args()
+
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
-    download_file(DATA_URL, OUTPUT_PATH)
\ No newline at end of file
+    for year in args.years:
+        download_file(DATA_URL.format(year=year), output_path(year))
\ No newline at end of file
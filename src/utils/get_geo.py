@@ -1,7 +1,8 @@
 # get_geo.py
-import requests
 import os
 
+from src.utils.download import download
+
 # Fichier GeoJSON des communes de France (Etalab - avec arrondissements PLM)
 GEO_URL = "https://etalab-datasets.geo.data.gouv.fr/contours-administratifs/2024/geojson/communes-100m.geojson"
 OUTPUT_DIR = os.path.join("data", "raw")
@@ -13,11 +14,8 @@ def get_geojson():
 
     print("Téléchargement de la carte de France...")
     try:
-        r = requests.get(GEO_URL, stream=True)
-        with open(OUTPUT_PATH, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024*1024):
-                if chunk: f.write(chunk)
-        print("GeoJSON France téléchargé.")
+        if download(GEO_URL, OUTPUT_PATH):
+            print("GeoJSON France téléchargé.")
     except Exception as e:
         print(f"Erreur : {e}")
 
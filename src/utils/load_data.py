@@ -0,0 +1,105 @@
+# load_data.py
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from src.utils.cube import day_index
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Colonnes réellement utilisées par le dashboard (projection à la lecture)
+DETAIL_COLUMNS = ['date_mutation', 'code_departement', 'code_commune', 'nom_commune',
+                  'type_local', 'valeur_fonciere', 'surface_reelle_bati', 'prix_m2', 'mois']
+
+# Schéma compact en mémoire : texte en catégories (codes entiers + table des valeurs),
+# surfaces et valeurs en float32, date en numéro de jour depuis 1970 (int16, jusqu'en 2059).
+# prix_m2 reste en float64 : il est comparé aux bornes des tranches du cube, calculées
+# en float64 au nettoyage (une ligne ne doit pas changer de tranche au chargement).
+CATEGORY_COLUMNS = ['code_departement', 'code_commune', 'nom_commune', 'type_local', 'month_date']
+FLOAT32_COLUMNS = ['valeur_fonciere', 'surface_reelle_bati']
+
+
+def compact_detail(df):
+    """
+    Convertit les colonnes lues au schéma compact : 'date_mutation' devient 'day'
+    et 'mois' devient 'month_date' (catégorie YYYY-MM).
+    """
+    if 'date_mutation' in df:
+        df['day'] = day_index(df['date_mutation']).astype(np.int16)
+        df = df.drop(columns='date_mutation')
+    if 'mois' in df:
+        df = df.rename(columns={'mois': 'month_date'})
+    for col in CATEGORY_COLUMNS:
+        if col in df and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str).astype('category')
+    for col in FLOAT32_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype(np.float32)
+    return df
+
+
+def load_detail(data_dir, columns=DETAIL_COLUMNS):
+    """
+    Charge les données nettoyées au schéma compact (voir compact_detail).
+    Lit en priorité le dataset Parquet (typé, colonnes texte déjà en dictionnaire)
+    et se rabat sur data_detail.csv s'il n'existe pas ou si pyarrow n'est pas installé.
+    """
+    parquet_dir = os.path.join(data_dir, "cleaned", "data_detail")
+    csv_path = os.path.join(data_dir, "cleaned", "data_detail.csv")
+
+    if HAS_PYARROW and os.path.isdir(parquet_dir):
+        return compact_detail(pd.read_parquet(parquet_dir, columns=columns))
+
+    # Fallback CSV : parsing complet des dates
+    df = pd.read_csv(csv_path, usecols=columns,
+                     dtype={'code_commune': str, 'code_departement': str, 'mois': str})
+    df['date_mutation'] = pd.to_datetime(df['date_mutation'])
+    return compact_detail(df)
+
+
+# --- MÉTADONNÉES DES FILTRES ---
+# Bornes des filtres, écrites par clean_data.py : le layout est servi sans charger les données
+METADATA_FILE = os.path.join("cleaned", "metadata.json")
+METADATA_COLUMNS = ['date_mutation', 'code_departement', 'type_local', 'prix_m2', 'mois']
+
+
+def compute_metadata(df):
+    """Départements, types, prix min/max et période couverte par les données."""
+    mes_mois = sorted(str(m) for m in df['month_date'].unique())
+    return {
+        'departements': sorted(str(d) for d in df['code_departement'].unique()),
+        'types_biens': sorted(str(t) for t in df['type_local'].unique()),
+        'min_price': int(df['prix_m2'].min()),
+        'max_price': int(df['prix_m2'].max()),
+        'min_date': mes_mois[0],
+        'max_date': mes_mois[-1],
+        'annees': list(range(int(mes_mois[0][:4]), int(mes_mois[-1][:4]) + 1)),
+    }
+
+
+def write_metadata(data_dir, version, metadata=None):
+    """Enregistre les métadonnées (calculées en ne lisant que les colonnes utiles)."""
+    if metadata is None:
+        metadata = compute_metadata(load_detail(data_dir, columns=METADATA_COLUMNS))
+    path = os.path.join(data_dir, METADATA_FILE)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(dict(metadata, version=version), f)
+    os.replace(path + ".tmp", path)
+    return metadata
+
+
+def load_metadata(data_dir, version):
+    """Métadonnées enregistrées, ou None si absentes ou d'une autre version des données."""
+    try:
+        with open(os.path.join(data_dir, METADATA_FILE), 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if metadata.pop('version', None) != version:
+        return None
+    return metadata
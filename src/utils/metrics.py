@@ -0,0 +1,247 @@
+# metrics.py
+"""
+Instrumentation des callbacks Dash :
+- span(stage) : durée (et lignes traitées) de chaque étape d'un callback ;
+- instrument(name) : latence totale par callback, trace détaillée des requêtes lentes,
+  profil (cProfile ou pyinstrument) des N requêtes les plus lentes si activé ;
+- register_metrics_route(server) : route /metrics au format texte Prometheus.
+"""
+import contextvars
+import cProfile
+import functools
+import heapq
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# pyinstrument est optionnel : cProfile est utilisé par défaut
+try:
+    import pyinstrument
+    HAS_PYINSTRUMENT = True
+except ImportError:
+    HAS_PYINSTRUMENT = False
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROWS_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# Au-delà de cette durée, la trace détaillée de la requête est affichée
+SLOW_MS = float(os.environ.get("IMMOVIZ_SLOW_MS", "1000"))
+# Profilage des N requêtes les plus lentes (0 : désactivé)
+PROFILE_SLOWEST = int(os.environ.get("IMMOVIZ_PROFILE_SLOWEST", "0"))
+PROFILE_DIR = os.environ.get("IMMOVIZ_PROFILE_DIR", "profiles")
+PROFILER = os.environ.get("IMMOVIZ_PROFILER", "cprofile")  # cprofile ou pyinstrument
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    """Histogramme Prometheus (compteurs cumulés par borne, somme et nombre)."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series = {}  # labels -> [compteurs par borne, somme, nombre]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {n}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {n}")
+        return lines
+
+
+class Registry:
+    """Histogrammes du processus et collecteurs de valeurs instantanées (jauges)."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.collectors = []
+
+    def histogram(self, name, help_text, buckets=SECONDS_BUCKETS):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, help_text, buckets)
+        return self.histograms[name]
+
+    def add_collector(self, collector):
+        """collector() retourne une liste (nom, aide, valeur) de jauges."""
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for histogram in self.histograms.values():
+            lines.extend(histogram.render())
+        for collector in self.collectors:
+            for name, help_text, value in collector():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CALLBACK_SECONDS = REGISTRY.histogram("immoviz_callback_seconds", "Durée des callbacks Dash")
+STAGE_SECONDS = REGISTRY.histogram("immoviz_stage_seconds", "Durée des étapes de update_dashboard")
+STAGE_ROWS = REGISTRY.histogram("immoviz_stage_rows", "Lignes traitées par étape", ROWS_BUCKETS)
+PAYLOAD_BYTES = REGISTRY.histogram("immoviz_payload_bytes", "Taille JSON de chaque sortie", BYTES_BUCKETS)
+
+# Trace de la requête en cours (liste d'étapes), propre à chaque thread du serveur
+_trace = contextvars.ContextVar("immoviz_trace", default=None)
+
+# Callbacks en cours d'exécution (le préchauffage du cache leur laisse la priorité)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+def in_flight():
+    """Nombre de callbacks instrumentés en cours dans le processus."""
+    return _in_flight
+
+
+REGISTRY.add_collector(lambda: [("immoviz_requests_in_flight", "Callbacks en cours d'exécution", _in_flight)])
+
+
+@contextmanager
+def span(stage, rows=None):
+    """
+    Mesure une étape. Le dictionnaire retourné peut recevoir 'rows' (lignes traitées)
+    une fois le résultat connu.
+    """
+    record = {'stage': stage, 'rows': rows}
+    t0 = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['ms'] = round((time.perf_counter() - t0) * 1000, 2)
+        STAGE_SECONDS.observe(record['ms'] / 1000, stage=stage)
+        if record['rows'] is not None:
+            STAGE_ROWS.observe(record['rows'], stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append(record)
+
+
+def record_payload(output, nbytes):
+    """Taille sérialisée d'une sortie du callback (figure ou KPI)."""
+    PAYLOAD_BYTES.observe(nbytes, output=output)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append({'stage': 'payload', 'output': output, 'bytes': nbytes})
+
+
+class SlowestProfiles:
+    """
+    Conserve sur disque le profil des N requêtes les plus lentes.
+    Un seul profil à la fois (cProfile ne supporte pas deux profilers actifs) :
+    une requête concurrente n'est simplement pas profilée.
+    """
+
+    def __init__(self, keep, directory=PROFILE_DIR, profiler=PROFILER):
+        self.keep = keep
+        self.directory = directory
+        self.use_pyinstrument = profiler == "pyinstrument" and HAS_PYINSTRUMENT
+        self._slowest = []  # tas (durée, chemin)
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if not self._busy.acquire(blocking=False):
+            return None
+        if self.use_pyinstrument:
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def stop(self, profiler, name, seconds):
+        try:
+            if self.use_pyinstrument:
+                profiler.stop()
+            else:
+                profiler.disable()
+        finally:
+            self._busy.release()
+        with self._lock:
+            if len(self._slowest) >= self.keep and seconds <= self._slowest[0][0]:
+                return
+            ext = "html" if self.use_pyinstrument else "prof"
+            path = os.path.join(self.directory, f"{name}-{seconds * 1000:.0f}ms-{time.time_ns()}.{ext}")
+            if self.use_pyinstrument:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(profiler.output_html())
+            else:
+                profiler.dump_stats(path)
+            heapq.heappush(self._slowest, (seconds, path))
+            if len(self._slowest) > self.keep:
+                _, old = heapq.heappop(self._slowest)
+                if os.path.exists(old):
+                    os.remove(old)
+
+
+profiles = SlowestProfiles(PROFILE_SLOWEST) if PROFILE_SLOWEST > 0 else None
+
+
+def instrument(name):
+    """Décorateur de callback : latence, trace des étapes et profil des plus lents."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            global _in_flight
+            trace = []
+            token = _trace.set(trace)
+            profiler = profiles.start() if profiles else None
+            with _in_flight_lock:
+                _in_flight += 1
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - t0
+                with _in_flight_lock:
+                    _in_flight -= 1
+                _trace.reset(token)
+                CALLBACK_SECONDS.observe(seconds, callback=name)
+                if profiler is not None:
+                    profiles.stop(profiler, name, seconds)
+                if seconds * 1000 >= SLOW_MS:
+                    steps = ", ".join(
+                        f"{s['output']}={s['bytes']}o" if s['stage'] == 'payload'
+                        else f"{s['stage']}={s['ms']}ms" + (f" ({s['rows']} lignes)" if s['rows'] is not None else "")
+                        for s in trace)
+                    print(f"[SLOW] {name} {seconds * 1000:.0f} ms : {steps}")
+        return wrapper
+    return decorator
+
+
+def register_metrics_route(server, path="/metrics"):
+    """Expose le registre sur le serveur Flask sous-jacent de Dash."""
+    from flask import Response
+
+    @server.route(path)
+    def metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+    return metrics
@@ -0,0 +1,184 @@
+# shared_store.py
+"""
+Jeu de données partagé entre les workers du serveur (gunicorn -w N).
+
+Un processus de chargement écrit une fois les colonnes du DataFrame, les tableaux du
+cube, les contours simplifiés et les centroïdes dans des fichiers .npy ; chaque worker
+les ouvre ensuite en mémoire partagée (mmap, lecture seule, sans copie). Les pages
+sont communes à tous les processus : la mémoire propre à chaque worker reste à peu
+près constante quand on en ajoute. Placé dans /dev/shm, le store ne touche pas le disque.
+
+    python -m src.utils.shared_store --out /dev/shm/immoviz
+    IMMOVIZ_SHARED_DIR=/dev/shm/immoviz gunicorn -w 8 "main:wsgi()"
+"""
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from src.utils.cube import DataCube, RangeCube
+from src.utils.geo_store import GeoStore, LEVELS
+
+SHARED_DIR = os.path.join("data", "cleaned", "shared")
+META_FILE = "meta.json"
+# À incrémenter quand le contenu du store change (un store plus ancien est ignoré)
+FORMAT = 4
+
+
+def _path(store_dir, name):
+    return os.path.join(store_dir, name + ".npy")
+
+
+def _save_frame(frame, store_dir, prefix):
+    """Une colonne par fichier ; le texte est stocké en codes + catégories."""
+    spec = []
+    for col in frame.columns:
+        s = frame[col]
+        name = f"{prefix}.{col}"
+        if isinstance(s.dtype, pd.CategoricalDtype) or not (
+                pd.api.types.is_numeric_dtype(s) or pd.api.types.is_datetime64_dtype(s)):
+            s = s.astype('category')
+            np.save(_path(store_dir, name), s.cat.codes.to_numpy())
+            spec.append({'name': col, 'kind': 'category', 'categories': [str(c) for c in s.cat.categories]})
+        elif pd.api.types.is_datetime64_dtype(s):
+            np.save(_path(store_dir, name), s.to_numpy().view(np.int64))
+            spec.append({'name': col, 'kind': 'datetime', 'dtype': str(s.dtype)})
+        else:
+            np.save(_path(store_dir, name), s.to_numpy())
+            spec.append({'name': col, 'kind': 'numeric'})
+    return spec
+
+
+def _attach_frame(store_dir, prefix, spec):
+    """DataFrame dont chaque colonne pointe sur le fichier partagé (aucune copie)."""
+    columns = {}
+    for col in spec:
+        arr = np.load(_path(store_dir, f"{prefix}.{col['name']}"), mmap_mode='r')
+        if col['kind'] == 'category':
+            values = pd.Categorical.from_codes(arr, categories=col['categories'], validate=False)
+        elif col['kind'] == 'datetime':
+            values = arr.view(col['dtype'])
+        else:
+            values = arr
+        columns[col['name']] = pd.Series(values, copy=False)
+    return pd.DataFrame(columns, copy=False)
+
+
+class SharedFeatures:
+    """{code: Feature JSON} lu à la demande dans un bloc d'octets partagé."""
+
+    def __init__(self, codes, offsets, blob):
+        self.index = {code: i for i, code in enumerate(codes)}
+        self.offsets = offsets
+        self.blob = blob
+
+    def __contains__(self, code):
+        return code in self.index
+
+    def __getitem__(self, code):
+        i = self.index[code]
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def __len__(self):
+        return len(self.index)
+
+
+def export_shared(df, cube, geo_store, dept_centers, version, store_dir=SHARED_DIR):
+    """Écrit le store dans un dossier temporaire puis le met en place d'un bloc."""
+    tmp_dir = store_dir.rstrip(os.sep) + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    meta = {'format': FORMAT, 'version': version, 'dept_centers': dept_centers, 'frames': {}, 'cubes': {}, 'geo': {}}
+    meta['frames']['df'] = _save_frame(df, tmp_dir, 'df')
+    np.save(_path(tmp_dir, 'row_order'), cube._row_order)
+    np.save(_path(tmp_dir, 'bucket_sorted'), cube._bucket_sorted)
+
+    for name in ('communes', 'departements', 'sketches'):
+        rc = getattr(cube, name)
+        meta['frames'][name] = _save_frame(rc.groups, tmp_dir, name)
+        np.save(_path(tmp_dir, f"{name}.keys"), rc.keys)
+        np.save(_path(tmp_dir, f"{name}.cum"), rc.cum)
+        meta['cubes'][name] = {'day0': rc.day0, 'span': rc.span}
+
+    for level, features in geo_store.levels.items():
+        codes = list(features.keys())
+        parts = [features[c].encode('utf-8') for c in codes]
+        np.save(_path(tmp_dir, f"geo.{level}.offsets"), np.cumsum([0] + [len(p) for p in parts], dtype=np.int64))
+        np.save(_path(tmp_dir, f"geo.{level}.blob"), np.frombuffer(b"".join(parts), dtype=np.uint8))
+        meta['geo'][level] = codes
+
+    with open(os.path.join(tmp_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.replace(tmp_dir, store_dir)
+
+
+class SharedDataset:
+    """Vue en lecture seule sur un store écrit par export_shared."""
+
+    def __init__(self, df, cube, geo_store, dept_centers, version):
+        self.df = df
+        self.cube = cube
+        self.geo_store = geo_store
+        self.dept_centers = dept_centers
+        self.version = version
+
+    @classmethod
+    def attach(cls, store_dir=SHARED_DIR, version=None):
+        """
+        Ouvre le store. Retourne None s'il est absent ou s'il a été construit à partir
+        d'une autre version des données nettoyées (il faut alors le régénérer).
+        """
+        try:
+            with open(os.path.join(store_dir, META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except OSError:
+            return None
+        if meta.get('format') != FORMAT or (version is not None and meta['version'] != version):
+            return None
+
+        df = _attach_frame(store_dir, 'df', meta['frames']['df'])
+        cubes = {}
+        for name, params in meta['cubes'].items():
+            cubes[name] = RangeCube(_attach_frame(store_dir, name, meta['frames'][name]),
+                                    np.load(_path(store_dir, f"{name}.keys"), mmap_mode='r'),
+                                    np.load(_path(store_dir, f"{name}.cum"), mmap_mode='r'),
+                                    params['day0'], params['span'])
+        cube = DataCube(df, cubes['communes'], cubes['departements'],
+                        row_order=np.load(_path(store_dir, 'row_order'), mmap_mode='r'),
+                        bucket_sorted=np.load(_path(store_dir, 'bucket_sorted'), mmap_mode='r'),
+                        sketches=cubes['sketches'])
+        geo_store = GeoStore({
+            level: SharedFeatures(codes,
+                                  np.load(_path(store_dir, f"geo.{level}.offsets"), mmap_mode='r'),
+                                  np.load(_path(store_dir, f"geo.{level}.blob"), mmap_mode='r'))
+            for level, codes in meta['geo'].items()
+        })
+        return cls(df, cube, geo_store, meta['dept_centers'], meta['version'])
+
+
+if __name__ == "__main__":
+    from src.utils.cache import data_version
+    from src.utils.geo_store import load_geo_index
+    from src.utils.load_data import load_detail
+
+    parser = argparse.ArgumentParser(description="Construit le store partagé entre les workers")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--out", default=None, help=f"Dossier du store (défaut : {SHARED_DIR}, ou /dev/shm/...)")
+    args = parser.parse_args()
+    out = args.out or os.path.join(args.data_dir, "cleaned", "shared")
+
+    print("Chargement des données...")
+    df = load_detail(args.data_dir)
+    cube = DataCube.load(df, os.path.join(args.data_dir, "cleaned", "cube"))
+    geo_path = os.path.join(args.data_dir, "raw", "etalab_communes.geojson")
+    geo_dir = os.path.join(args.data_dir, "cleaned", "geo")
+    geo_store = GeoStore.load(geo_dir, geo_path=geo_path)
+    version = data_version(args.data_dir)
+    export_shared(df, cube, geo_store, load_geo_index(geo_path, geo_dir)['departements'], version, out)
+    print(f"Store partagé prêt : {out} (version {version}, {len(df):,} lignes, niveaux {', '.join(LEVELS)})")
@@ -0,0 +1,301 @@
+# spatial.py
+"""
+Index spatial des communes : une sélection sur la carte (clic, lasso, rectangle) est
+résolue en codes commune sans tester tous les contours du pays.
+
+R-tree compacté par la méthode STR (Sort-Tile-Recursive) sur les emprises des communes :
+à chaque niveau, les emprises sont triées par x, découpées en tranches verticales, triées
+par y dans chaque tranche puis regroupées par NODE_CAPACITY. Le tout est stocké en
+tableaux NumPy (emprises et premier enfant de chaque nœud, par niveau) dans geo/spatial/,
+avec les sommets des contours du niveau 'ville' (ceux de la carte zoomée).
+
+Une requête descend l'arbre niveau par niveau (chevauchement des emprises, en NumPy,
+pour toutes les emprises cherchées à la fois). Pour un lasso, un sommet par commune
+candidate suffit à classer celles qui ne touchent pas son contour ; le test exact
+(point dans polygone, intersection de contours) ne porte que sur les autres.
+Les fichiers .npy sont ouverts en mmap : pages communes aux workers.
+
+    python -m src.utils.geo_store   # construit aussi l'index
+"""
+import json
+import os
+import shutil
+import numpy as np
+
+from src.utils.geo_store import GEO_PATH, GEO_STORE_DIR, LEVELS, simplify_geometry
+
+SPATIAL_DIR = "spatial"
+# Enfants par nœud de l'arbre
+NODE_CAPACITY = 16
+# Contours utilisés pour le test exact (ceux affichés au zoom le plus fort)
+SPATIAL_LEVEL = 'ville'
+
+
+def str_order(bboxes, capacity=NODE_CAPACITY):
+    """Ordre STR des emprises [x_min, y_min, x_max, y_max] : tranches verticales, puis y."""
+    n = len(bboxes)
+    cx = (bboxes[:, 0] + bboxes[:, 2]) / 2
+    cy = (bboxes[:, 1] + bboxes[:, 3]) / 2
+    n_slices = int(np.ceil(np.sqrt(np.ceil(n / capacity))))
+    slice_of = np.empty(n, dtype=np.int64)
+    slice_of[np.argsort(cx, kind='stable')] = np.arange(n) // (n_slices * capacity)
+    return np.lexsort((cy, slice_of))
+
+
+def _expand(starts, ends):
+    """Concaténation des plages [starts[i], ends[i]) (indices des enfants, des sommets...)."""
+    lengths = ends - starts
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+def _union(bboxes, starts):
+    """Emprise de chaque groupe d'emprises consécutives commençant en starts."""
+    return np.column_stack([np.minimum.reduceat(bboxes[:, 0], starts), np.minimum.reduceat(bboxes[:, 1], starts),
+                            np.maximum.reduceat(bboxes[:, 2], starts), np.maximum.reduceat(bboxes[:, 3], starts)])
+
+
+def _overlaps(bboxes, boxes):
+    """Chevauchement ligne à ligne de deux tableaux d'emprises (n, 4)."""
+    return ((bboxes[:, 0] <= boxes[:, 2]) & (bboxes[:, 2] >= boxes[:, 0]) &
+            (bboxes[:, 1] <= boxes[:, 3]) & (bboxes[:, 3] >= boxes[:, 1]))
+
+
+def points_in_polygon(px, py, edges):
+    """
+    Règle pair-impair pour de nombreux points et un polygone (edges : x1, y1, x2, y2).
+    Les points sont triés par y : chaque arête ne teste que ceux de sa bande horizontale.
+    """
+    order = np.argsort(py, kind='stable')
+    xs, ys = px[order], py[order]
+    inside = np.zeros(len(xs), dtype=bool)
+    x1, y1, x2, y2 = edges
+    lo = np.searchsorted(ys, np.minimum(y1, y2), side='left')
+    hi = np.searchsorted(ys, np.maximum(y1, y2), side='left')
+    for k in np.flatnonzero(hi > lo):
+        a, b = lo[k], hi[k]
+        x_cross = x1[k] + (ys[a:b] - y1[k]) * (x2[k] - x1[k]) / (y2[k] - y1[k])
+        inside[a:b] ^= xs[a:b] < x_cross
+    out = np.empty_like(inside)
+    out[order] = inside
+    return out
+
+
+def segments_cross(edges, other):
+    """Pour chaque arête de edges : coupe-t-elle une arête de other (extrémités comprises) ?"""
+    x1, y1, x2, y2 = edges
+    hit = np.zeros(len(x1), dtype=bool)
+    bx0, bx1 = np.minimum(x1, x2), np.maximum(x1, x2)
+    by0, by1 = np.minimum(y1, y2), np.maximum(y1, y2)
+    for ax, ay, cx, cy in zip(*other):
+        # Emprises disjointes : pas d'intersection possible (écarte aussi les colinéaires séparées)
+        sel = np.flatnonzero(~hit & (bx0 <= max(ax, cx)) & (bx1 >= min(ax, cx)) &
+                             (by0 <= max(ay, cy)) & (by1 >= min(ay, cy)))
+        if not len(sel):
+            continue
+        d1 = (cx - ax) * (y1[sel] - ay) - (cy - ay) * (x1[sel] - ax)
+        d2 = (cx - ax) * (y2[sel] - ay) - (cy - ay) * (x2[sel] - ax)
+        d3 = (x2[sel] - x1[sel]) * (ay - y1[sel]) - (y2[sel] - y1[sel]) * (ax - x1[sel])
+        d4 = (x2[sel] - x1[sel]) * (cy - y1[sel]) - (y2[sel] - y1[sel]) * (cx - x1[sel])
+        hit[sel[(d1 * d2 <= 0) & (d3 * d4 <= 0)]] = True
+    return hit
+
+
+def _ring_edges(ring):
+    """Arêtes (x1, y1, x2, y2) d'un anneau fermé ou non."""
+    ring = np.asarray(ring, dtype=np.float64)[:, :2]
+    if len(ring) and not np.array_equal(ring[0], ring[-1]):
+        ring = np.vstack([ring, ring[:1]])
+    return ring[:-1, 0], ring[:-1, 1], ring[1:, 0], ring[1:, 1]
+
+
+class SpatialIndex:
+    """R-tree STR des communes et contours pour le test exact (voir le docstring du module)."""
+
+    def __init__(self, arrays, n_levels):
+        self.codes = arrays['codes']
+        self.leaf_feature = arrays['leaf_feature']  # commune de chaque feuille (ordre de l'arbre)
+        self.bbox = [arrays[f'bbox_{k}'] for k in range(n_levels)]  # niveau 0 : feuilles
+        self.child = [None] + [arrays[f'child_{k}'] for k in range(1, n_levels)]
+        self.x, self.y = arrays['x'], arrays['y']
+        self.ring_start = arrays['ring_start']
+        self.feature_ring = arrays['feature_ring']
+
+    @classmethod
+    def build(cls, geojson, level=SPATIAL_LEVEL, capacity=NODE_CAPACITY):
+        """Index des communes du GeoJSON, contours simplifiés comme au niveau 'level'."""
+        params = LEVELS[level]
+        codes, xs, ys, ring_start, feature_ring = [], [], [], [0], [0]
+        for feature in geojson['features']:
+            code = feature['properties'].get('code')
+            geom = feature.get('geometry') or {}
+            if not code or geom.get('type') not in ('Polygon', 'MultiPolygon'):
+                continue
+            geom = simplify_geometry(geom, params['tolerance'], params['decimals'])
+            polygons = [geom['coordinates']] if geom['type'] == 'Polygon' else geom['coordinates']
+            rings = [np.asarray(r, dtype=np.float64)[:, :2] for p in polygons for r in p if len(r) >= 3]
+            if not rings:
+                continue
+            for ring in rings:
+                xs.append(ring[:, 0])
+                ys.append(ring[:, 1])
+                ring_start.append(ring_start[-1] + len(ring))
+            feature_ring.append(feature_ring[-1] + len(rings))
+            codes.append(code)
+
+        x, y = np.concatenate(xs), np.concatenate(ys)
+        ring_start, feature_ring = np.asarray(ring_start), np.asarray(feature_ring)
+        # Emprise de chaque commune : min / max de ses sommets
+        first_vertex = ring_start[feature_ring[:-1]]
+        leaves = np.column_stack([np.minimum.reduceat(x, first_vertex), np.minimum.reduceat(y, first_vertex),
+                                  np.maximum.reduceat(x, first_vertex), np.maximum.reduceat(y, first_vertex)])
+
+        # Construction de bas en haut : groupes de nœuds (ordre STR) à chaque niveau
+        boxes, groups = [leaves], []
+        while True:
+            order = str_order(boxes[-1], capacity)
+            groups.append([order[i:i + capacity] for i in range(0, len(order), capacity)])
+            if len(groups[-1]) == 1:
+                break
+            starts = np.arange(0, len(order), capacity)
+            boxes.append(_union(boxes[-1][order], starts))
+
+        # Disposition de haut en bas : les enfants d'un nœud sont consécutifs au niveau inférieur
+        n_levels = len(boxes)
+        arrays = {'codes': np.asarray(codes, dtype=str), 'x': x, 'y': y,
+                  'ring_start': ring_start, 'feature_ring': feature_ring}
+        layout = groups[-1][0]
+        for k in range(n_levels - 1, -1, -1):
+            arrays[f'bbox_{k}'] = boxes[k][layout]
+            if k == 0:
+                arrays['leaf_feature'] = layout
+                break
+            children = [groups[k - 1][node] for node in layout]
+            arrays[f'child_{k}'] = np.cumsum([0] + [len(c) for c in children])
+            layout = np.concatenate(children)
+        return cls(arrays, n_levels)
+
+    def save(self, store_dir=GEO_STORE_DIR):
+        """Un fichier .npy par tableau (ouverts en mmap par load), mis en place d'un bloc."""
+        path = os.path.join(store_dir, SPATIAL_DIR)
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        arrays = {'codes': self.codes, 'leaf_feature': self.leaf_feature, 'x': self.x, 'y': self.y,
+                  'ring_start': self.ring_start, 'feature_ring': self.feature_ring}
+        for k, bbox in enumerate(self.bbox):
+            arrays[f'bbox_{k}'] = bbox
+            if k:
+                arrays[f'child_{k}'] = self.child[k]
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp, name + ".npy"), np.asarray(arr))
+        with open(os.path.join(tmp, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump({'levels': len(self.bbox), 'communes': len(self.codes)}, f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+        print(f"   Index spatial : {len(self.codes)} communes, {len(self.bbox)} niveaux, {len(self.x)} sommets")
+
+    @classmethod
+    def load(cls, store_dir=GEO_STORE_DIR, geojson=None, geo_path=GEO_PATH):
+        """Ouvre l'index précalculé (mmap) ; à défaut, le construit à partir du GeoJSON complet."""
+        path = os.path.join(store_dir, SPATIAL_DIR)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            if geojson is None:
+                with open(geo_path, 'r', encoding='utf-8') as f:
+                    geojson = json.load(f)
+            print("Index spatial absent, construction...")
+            cls.build(geojson).save(store_dir)
+        with open(os.path.join(path, "meta.json"), 'r', encoding='utf-8') as f:
+            n_levels = json.load(f)['levels']
+        names = ['codes', 'leaf_feature', 'x', 'y', 'ring_start', 'feature_ring']
+        names += [f'bbox_{k}' for k in range(n_levels)] + [f'child_{k}' for k in range(1, n_levels)]
+        return cls({name: np.load(os.path.join(path, name + ".npy"), mmap_mode='r') for name in names}, n_levels)
+
+    # --- REQUÊTES ---
+
+    def candidates(self, boxes):
+        """
+        Communes dont l'emprise chevauche l'une des emprises [x_min, y_min, x_max, y_max]
+        de boxes : descente de l'arbre avec une paire (nœud, emprise cherchée) par chevauchement.
+        """
+        boxes = np.atleast_2d(np.asarray(boxes, dtype=np.float64))
+        top = len(self.bbox) - 1
+        nodes = np.repeat(np.arange(len(self.bbox[top])), len(boxes))
+        which = np.tile(np.arange(len(boxes)), len(self.bbox[top]))
+        for k in range(top, 0, -1):
+            keep = _overlaps(self.bbox[k][nodes], boxes[which])
+            nodes, which = nodes[keep], which[keep]
+            starts, ends = self.child[k][nodes], self.child[k][nodes + 1]
+            which = np.repeat(which, ends - starts)
+            nodes = _expand(starts, ends)
+        keep = _overlaps(self.bbox[0][nodes], boxes[which])
+        return np.unique(np.asarray(self.leaf_feature[nodes[keep]]))
+
+    def _edges(self, features):
+        """Arêtes des contours des communes données, et la commune de chaque arête."""
+        rings = _expand(self.feature_ring[features], self.feature_ring[features + 1])
+        owner = np.repeat(features, self.feature_ring[features + 1] - self.feature_ring[features])
+        # Anneaux fermés (dernier sommet = premier) : une arête par sommet sauf le dernier
+        starts, ends = self.ring_start[rings], self.ring_start[rings + 1] - 1
+        i = _expand(starts, ends)
+        owner = np.repeat(owner, ends - starts)
+        return (self.x[i], self.y[i], self.x[i + 1], self.y[i + 1]), owner
+
+    def _containing(self, lon, lat, features):
+        """Communes (parmi features) qui contiennent le point (règle pair-impair)."""
+        if not len(features):
+            return features
+        (x1, y1, x2, y2), owner = self._edges(features)
+        cross = (y1 > lat) != (y2 > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cross &= lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+        odd = np.bincount(np.searchsorted(features, owner), weights=cross, minlength=len(features)) % 2 == 1
+        return features[odd]
+
+    def point(self, lon, lat):
+        """Codes des communes qui contiennent le point (lon, lat)."""
+        features = self._containing(lon, lat, self.candidates([lon, lat, lon, lat]))
+        return [str(c) for c in self.codes[features]]
+
+    def polygon(self, points):
+        """
+        Codes des communes qui intersectent le polygone [(lon, lat), ...] (lasso, rectangle).
+        Une commune est retenue si l'un de ses sommets est dans le polygone, si elle contient
+        le polygone, ou si leurs contours se coupent.
+        """
+        poly = _ring_edges(points)
+        if len(poly[0]) < 2:
+            return []
+        box = (min(poly[0].min(), poly[2].min()), min(poly[1].min(), poly[3].min()),
+               max(poly[0].max(), poly[2].max()), max(poly[1].max(), poly[3].max()))
+        features = self.candidates(box)
+        if not len(features):
+            return []
+        hit = np.zeros(len(self.codes), dtype=bool)
+        # 1. Premier sommet de chaque commune dans le polygone : commune retenue
+        first = self.ring_start[self.feature_ring[features]]
+        inside = points_in_polygon(self.x[first], self.y[first], poly)
+        hit[features[inside]] = True
+        # Les autres ne peuvent intersecter le polygone que si son contour passe dans leur emprise
+        edge_boxes = np.column_stack([np.minimum(poly[0], poly[2]), np.minimum(poly[1], poly[3]),
+                                      np.maximum(poly[0], poly[2]), np.maximum(poly[1], poly[3])])
+        near = np.intersect1d(features[~inside], self.candidates(edge_boxes))
+        if not len(near):
+            return [str(c) for c in self.codes[hit]]
+        edges, owner = self._edges(near)
+        # 2. Autres sommets dans le polygone
+        hit[owner[points_in_polygon(edges[0], edges[1], poly)]] = True
+        # 3. Polygone contenu dans une commune : son premier sommet y est
+        hit[self._containing(poly[0][0], poly[1][0], near[~hit[near]])] = True
+        # 4. Contours qui se coupent, sans sommet de l'un dans l'autre
+        rest = ~hit[owner]
+        hit[owner[rest][segments_cross(tuple(e[rest] for e in edges), poly)]] = True
+        return [str(c) for c in self.codes[hit]]
+
+    def rectangle(self, lon_min, lat_min, lon_max, lat_max):
+        """Codes des communes qui intersectent le rectangle (sélection par boîte)."""
+        return self.polygon([(lon_min, lat_min), (lon_max, lat_min), (lon_max, lat_max), (lon_min, lat_max)])
@@ -0,0 +1,179 @@
+# warmup.py
+"""
+Préchauffage du cache des résultats : les combinaisons de filtres les plus demandées
+(France entière, Paris, Lyon, Marseille, puis chaque département avec les filtres par
+défaut) sont calculées en arrière-plan après le démarrage, par ordre de priorité.
+
+Les requêtes des visiteurs passent avant : un worker attend qu'aucun callback ne soit
+en cours avant chaque combinaison, et se met en pause après chacune pour ne pas
+dépasser son budget CPU (fraction d'un cœur pour l'ensemble des workers).
+
+Après un rafraîchissement des données, avec un cache disque partagé :
+
+    IMMOVIZ_CACHE_DIR=/var/cache/immoviz python -m src.utils.warmup
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.metrics import in_flight
+
+WARMUP_ENABLED = os.environ.get("IMMOVIZ_WARMUP", "1") != "0"
+WARMUP_WORKERS = int(os.environ.get("IMMOVIZ_WARMUP_WORKERS", "1"))
+WARMUP_CPU = float(os.environ.get("IMMOVIZ_WARMUP_CPU", "0.5"))
+
+# Départements des grandes villes (Paris, Lyon, Marseille), préchauffés en premier
+POPULAR_DEPARTEMENTS = ['75', '69', '13']
+
+# Attente entre deux vérifications de l'activité du serveur (s)
+IDLE_POLL = 0.05
+
+
+class WarmupScheduler:
+    """
+    Exécute run(filters) pour chaque tâche (libellé, filtres) absente du cache
+    (is_cached(filters)), dans un pool de threads, avec un budget CPU.
+    """
+
+    def __init__(self, tasks, run, is_cached, workers=WARMUP_WORKERS, cpu_budget=WARMUP_CPU, busy=in_flight):
+        self.tasks = list(tasks)
+        self.run = run
+        self.is_cached = is_cached
+        self.workers = max(1, workers)
+        self.cpu_budget = min(max(cpu_budget, 0.01), 1.0)
+        self.busy = busy
+        self.state = 'idle'  # idle, waiting (données), running, done, stopped
+        self.done = 0        # combinaisons calculées
+        self.skipped = 0     # déjà en cache
+        self.failed = 0
+        self.covered = 0     # préchauffées et encore en cache (tenu à jour par le préchauffage)
+        self.seconds = 0.0
+        self._warmed = []    # filtres calculés ou trouvés en cache
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._finished = threading.Event()
+        self._thread = None
+
+    def start(self, wait_for=None):
+        """Lance le préchauffage dans un thread ; wait_for() est appelé avant (chargement des données)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._main, args=(wait_for,), name="immoviz-warmup", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def _main(self, wait_for):
+        try:
+            if wait_for is not None:
+                self.state = 'waiting'
+                wait_for()
+            self.state = 'running'
+            t0 = time.perf_counter()
+            print(f"[WARMUP] {len(self.tasks)} combinaisons à préchauffer "
+                  f"({self.workers} worker(s), budget CPU {self.cpu_budget:.0%})")
+            with ThreadPoolExecutor(self.workers, thread_name_prefix="immoviz-warmup") as pool:
+                for future in [pool.submit(self._worker) for _ in range(self.workers)]:
+                    future.result()
+            self.seconds = time.perf_counter() - t0
+            self.state = 'stopped' if self._stop.is_set() else 'done'
+            status = self.status()
+            print(f"[WARMUP] Terminé en {self.seconds:.1f} s : {status['done']} calculées, "
+                  f"{status['skipped']} déjà en cache, {status['failed']} en échec, couverture {status['coverage']:.0%}")
+        except Exception as e:
+            self.state = 'stopped'
+            print(f"[WARMUP] Interrompu : {e}")
+        finally:
+            self._finished.set()
+
+    def _take(self):
+        with self._lock:
+            if self._stop.is_set() or self._next >= len(self.tasks):
+                return None
+            self._next += 1
+            return self._next - 1
+
+    def _worker(self):
+        # Budget réparti entre les workers : pause = temps CPU consommé × (1 / budget - 1)
+        budget = self.cpu_budget / self.workers
+        while (i := self._take()) is not None:
+            label, filters = self.tasks[i]
+            if self.is_cached(filters):
+                with self._lock:
+                    self.skipped += 1
+                    self.covered += 1
+                    self._warmed.append(filters)
+                continue
+
+            # Les visiteurs d'abord : on attend qu'aucun callback ne soit en cours
+            while self.busy() and not self._stop.is_set():
+                time.sleep(IDLE_POLL)
+
+            cpu0 = time.thread_time()
+            try:
+                self.run(filters)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                print(f"[WARMUP] Échec pour {label} : {e}")
+                continue
+            cpu = time.thread_time() - cpu0
+            if not self.is_cached(filters):
+                # Résultat plus gros que le cache mémoire entier : il n'a pas été conservé
+                with self._lock:
+                    self.failed += 1
+                print(f"[WARMUP] {label} : résultat trop volumineux pour le cache")
+                self._stop.wait(cpu * (1 / budget - 1))
+                continue
+            with self._lock:
+                self.done += 1
+                self.covered += 1
+                self._warmed.append(filters)
+                warmed = list(self._warmed)
+                n = self.done + self.skipped + self.failed
+            print(f"[WARMUP] {n}/{len(self.tasks)} {label} ({cpu * 1000:.0f} ms CPU)")
+
+            # Une entrée préchauffée a été évincée : le cache mémoire est plein, inutile de continuer
+            still_cached = sum(1 for f in warmed if self.is_cached(f))
+            if still_cached < len(warmed):
+                with self._lock:
+                    self.covered -= len(warmed) - still_cached
+                print("[WARMUP] Cache plein (entrées préchauffées évincées), arrêt")
+                self._stop.set()
+            self._stop.wait(cpu * (1 / budget - 1))
+
+    def status(self):
+        """
+        Avancement et couverture (part des combinaisons préchauffées encore en cache, comptée
+        par le préchauffage) : lu à chaque collecte de /metrics, sans interroger le cache.
+        """
+        covered = self.covered
+        return {
+            'state': self.state,
+            'total': len(self.tasks),
+            'done': self.done,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'covered': covered,
+            'coverage': covered / len(self.tasks) if self.tasks else 1.0,
+            'seconds': round(self.seconds, 1),
+        }
+
+
+if __name__ == "__main__":
+    # create_app charge les données et lance le préchauffage
+    import main
+
+    main.create_app()
+    if main.warmup is None:
+        print("Préchauffage désactivé (IMMOVIZ_WARMUP=0)")
+    else:
+        if not main.CACHE_DIR:
+            print("Attention : sans IMMOVIZ_CACHE_DIR, le cache préchauffé disparaît avec ce processus")
+        main.warmup.join()
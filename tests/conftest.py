@@ -0,0 +1,87 @@
+# conftest.py
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class _FileHandler(BaseHTTPRequestHandler):
+    """
+    Sert server.payload (404 si None), avec Range / If-Range si server.ranges.
+    Content-Length annonce toute la réponse, seuls server.sent octets partent (coupure).
+    """
+
+    def _if_range_matches(self):
+        validator = self.headers.get('If-Range')
+        if validator is None:
+            return True
+        # Comparaison forte (RFC 9110) : un ETag faible ne correspond jamais
+        if validator.startswith('W/'):
+            return False
+        return validator in (self.server.etag, LAST_MODIFIED)
+
+    def _headers(self):
+        size = len(self.server.payload)
+        start, end, status = 0, size - 1, 200
+        byte_range = self.headers.get('Range')
+        if byte_range and self.server.ranges and self._if_range_matches():
+            first, last = byte_range.split('=')[1].split('-')
+            start, end, status = int(first), int(last) if last else size - 1, 206
+        self.server.log.append((self.command, byte_range, self.headers.get('If-Range'), status))
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if self.server.etag:
+            self.send_header('ETag', self.server.etag)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.end_headers()
+        return self.server.payload[start:end + 1]
+
+    def do_HEAD(self):
+        if self.server.payload is None:
+            return self.send_error(404)
+        self._headers()
+
+    def do_GET(self):
+        if self.server.payload is None:
+            return self.send_error(404)
+        body = self._headers()
+        self.wfile.write(body if self.server.sent is None else body[:self.server.sent])
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    """Serveur HTTP local : payload, etag, ranges et sent se règlent sur l'objet, log garde les requêtes."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FileHandler)
+    server.payload, server.etag, server.ranges, server.sent, server.log = b"", '"v1"', True, None, []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/dvf.csv.gz"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def http_file(http_server):
+    """serve(payload, sent=None) -> URL d'un fichier servi en local (tronqué si sent < taille)."""
+
+    def serve(payload, sent=None):
+        http_server.payload, http_server.sent = payload, sent
+        return http_server.url
+
+    return serve
@@ -0,0 +1,15 @@
+# test_app.py
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_main_has_no_side_effects():
+    # Importer main (benchmarks, tests, gunicorn) ne crée pas l'application ni ses threads
+    code = ("import threading, main; "
+            "assert main.dataset is None and main.warmup is None, 'application créée'; "
+            "assert threading.active_count() == 1, threading.enumerate()")
+    env = dict(os.environ, IMMOVIZ_DATA_DIR=os.path.join(ROOT, "missing"))
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True)
@@ -0,0 +1,65 @@
+# test_cache.py
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from src.utils.cache import ResultCache, SharedResults, fcntl
+
+
+def test_get_or_compute_failure_releases_pending():
+    shared = SharedResults()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("échec du calcul")
+
+    results = []
+    first = threading.Thread(target=lambda: pytest.raises(RuntimeError, shared.get_or_compute, 'k', failing))
+    first.start()
+    started.wait()
+    # Un callback qui attend la même clé recalcule après l'échec au lieu de rester bloqué
+    waiter = threading.Thread(target=lambda: results.append(shared.get_or_compute('k', lambda: 42)))
+    waiter.start()
+    first.join(5)
+    waiter.join(5)
+    assert results == [42]
+    assert shared._pending == {}
+    assert shared.get_or_compute('k', lambda: 0) == 42
+
+
+def _compute_once(disk_dir, computed):
+    """Ce que fait part_result dans un worker : verrou, relecture du cache, sinon calcul."""
+    cache = ResultCache("v1", disk_dir=disk_dir)
+    with cache.lock('k'):
+        if cache.contains('k'):
+            return
+        with open(computed, 'a') as f:
+            f.write("x")
+        time.sleep(0.2)
+        cache.set('k', [1])
+
+
+@pytest.mark.skipif(fcntl is None, reason="verrou de fichier indisponible")
+def test_lock_computes_once_across_processes(tmp_path):
+    computed = tmp_path / "computed"
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=_compute_once, args=(str(tmp_path / "cache"), str(computed)))
+               for _ in range(3)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join(30)
+    assert [p.exitcode for p in workers] == [0, 0, 0]
+    # Un seul worker a calculé, les autres ont lu son résultat sur disque
+    assert computed.read_text() == "x"
+    assert ResultCache("v1", disk_dir=str(tmp_path / "cache")).get('k') == [1]
+
+
+def test_lock_without_disk_dir_is_noop():
+    cache = ResultCache("v1")
+    with cache.lock('k'), cache.lock('k'):
+        pass
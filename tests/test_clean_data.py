@@ -0,0 +1,64 @@
+# test_clean_data.py
+import functools
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from benchmarks.synthetic import generate
+from src.utils import clean_data
+from src.utils.cube import load_frame
+
+YEAR = 2023
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Dossier de travail avec data/raw synthétique (chemins relatifs de clean_data)."""
+    generate(str(tmp_path / "data"), 5000, year=YEAR)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def partition_path():
+    return os.path.join(clean_data.PARQUET_DETAIL_DIR, f"annee={YEAR}", "part-0.parquet")
+
+
+def test_truncated_stream_keeps_previous_partition(workdir, http_file, monkeypatch):
+    with open(os.path.join("data", "raw", f"dvf_{YEAR}.csv.gz"), 'rb') as f:
+        payload = f.read()
+
+    # Petits lots : une partie de l'année est écrite avant la coupure du flux
+    monkeypatch.setattr(clean_data, 'arrow_batches', functools.partial(clean_data.arrow_batches, block_bytes=64 * 1024))
+    monkeypatch.setattr(clean_data, 'DATA_URL', http_file(payload))
+    clean_data.process_stream([YEAR], workers=1)
+    rows = pq.read_metadata(partition_path()).num_rows
+    with open(partition_path(), 'rb') as f:
+        partition = f.read()
+    cells = load_frame(os.path.join(clean_data.CELLS_DIR, f"communes_{YEAR}.npz"))
+    assert rows > 0 and cells['nb_ventes'].sum() == rows
+
+    # Même année, flux coupé à 90 % (lecture anticipée d'Arrow) : rien ne doit être remplacé
+    monkeypatch.setattr(clean_data, 'DATA_URL', http_file(payload, sent=len(payload) * 9 // 10))
+    clean_data.process_stream([YEAR], workers=1)
+    with open(partition_path(), 'rb') as f:
+        assert f.read() == partition
+    cells_after = load_frame(os.path.join(clean_data.CELLS_DIR, f"communes_{YEAR}.npz"))
+    assert cells_after['nb_ventes'].sum() == rows
+    assert not os.path.exists(clean_data.PARQUET_DETAIL_DIR + ".tmp")
+
+
+def test_discard_truncates_csv_year(tmp_path, monkeypatch):
+    # Sans pyarrow : les lignes de l'année abandonnée sont retirées du CSV
+    monkeypatch.setattr(clean_data, 'HAS_PYARROW', False)
+    csv_path = str(tmp_path / "detail.csv")
+    writer = clean_data.DetailWriter(root=str(tmp_path / "detail"), csv_path=csv_path)
+    writer.write(pd.DataFrame({'a': [1, 2]}), 2022)
+    size = os.path.getsize(csv_path)
+    writer.write(pd.DataFrame({'a': [3]}), 2023)
+    writer.discard(2023)
+    assert os.path.getsize(csv_path) == size
+    writer.discard(2022)
+    writer.write(pd.DataFrame({'a': [4]}), 2024)
+    assert pd.read_csv(csv_path)['a'].tolist() == [4]
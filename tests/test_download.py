@@ -0,0 +1,102 @@
+# test_download.py
+import os
+
+import pytest
+import requests
+
+from src.utils import download as dl
+from src.utils import get_data
+from src.utils.download import StreamingDownload, _if_range, download
+
+
+def test_if_range_ignores_weak_etag():
+    assert _if_range({'etag': '"abc"', 'last_modified': "Mon, 01 Jan 2024 00:00:00 GMT"}) == '"abc"'
+    assert _if_range({'etag': 'W/"abc"', 'last_modified': "Mon, 01 Jan 2024 00:00:00 GMT"}) \
+        == "Mon, 01 Jan 2024 00:00:00 GMT"
+    assert _if_range({'etag': 'W/"abc"', 'last_modified': None}) is None
+
+
+def test_download_ranged_then_up_to_date(http_server, http_file, tmp_path):
+    payload = os.urandom(200_000)
+    dest = str(tmp_path / "dvf.csv.gz")
+    assert download(http_file(payload), dest, connections=4)
+    with open(dest, 'rb') as f:
+        assert f.read() == payload
+    assert sum(status == 206 for method, _, _, status in http_server.log if method == 'GET') == 4
+    # Même ETag : pas de nouveau téléchargement
+    assert not download(http_file(payload), dest, connections=4)
+
+
+def test_download_resumes_after_dropped_connection(http_server, http_file, tmp_path, monkeypatch):
+    # Petits blocs et état sauvegardé à chaque bloc : la coupure laisse des segments entamés
+    monkeypatch.setattr(dl, 'CHUNK_SIZE', 4096)
+    monkeypatch.setattr(dl, 'STATE_EVERY', 1)
+    payload = os.urandom(200_000)
+    dest = str(tmp_path / "dvf.csv.gz")
+    with pytest.raises(requests.RequestException):
+        download(http_file(payload, sent=20_000), dest, connections=4)
+    assert not os.path.exists(dest)
+
+    del http_server.log[:]
+    assert download(http_file(payload), dest, connections=4)
+    with open(dest, 'rb') as f:
+        assert f.read() == payload
+    # Seule la fin de chaque segment est redemandée
+    resumed = [r for method, r, _, _ in http_server.log if method == 'GET']
+    starts = sorted(int(r.split('=')[1].split('-')[0]) for r in resumed)
+    assert starts[0] > 0 and all(start % 50_000 for start in starts)
+
+
+def test_download_weak_etag_uses_last_modified(http_server, http_file, tmp_path):
+    # Un If-Range avec ETag faible serait ignoré (réponse 200) : on envoie Last-Modified
+    http_server.etag = 'W/"v1"'
+    payload = os.urandom(200_000)
+    dest = str(tmp_path / "dvf.csv.gz")
+    assert download(http_file(payload), dest, connections=4)
+    with open(dest, 'rb') as f:
+        assert f.read() == payload
+    assert {if_range for method, _, if_range, _ in http_server.log if method == 'GET'} \
+        == {"Mon, 01 Jan 2024 00:00:00 GMT"}
+
+
+def test_download_without_ranges(http_server, http_file, tmp_path):
+    http_server.ranges = False
+    payload = os.urandom(200_000)
+    dest = str(tmp_path / "dvf.csv.gz")
+    assert download(http_file(payload), dest, connections=4)
+    with open(dest, 'rb') as f:
+        assert f.read() == payload
+    assert [r for method, r, _, _ in http_server.log if method == 'GET'] == [None]
+
+
+
+def test_missing_year_is_skipped(http_file, tmp_path, capsys):
+    # Année non publiée par le serveur : ni erreur ni fichier partiel
+    dest = str(tmp_path / "dvf_2014.csv.gz")
+    get_data.download_file(http_file(None), dest)
+    assert "[SKIP]" in capsys.readouterr().out
+    assert os.listdir(tmp_path) == []
+
+def test_streaming_download_complete(http_file, tmp_path):
+    payload = os.urandom(200_000)
+    keep = str(tmp_path / "dvf.csv.gz")
+    with StreamingDownload(http_file(payload), keep) as stream:
+        data = stream.read()
+    assert data == payload
+    with open(keep, 'rb') as f:
+        assert f.read() == payload
+
+
+def test_streaming_download_truncated_server(http_file):
+    url = http_file(os.urandom(200_000), sent=50_000)
+    with pytest.raises(Exception):
+        with StreamingDownload(url) as stream:
+            while stream.read(65536):
+                pass
+
+
+def test_streaming_download_incomplete_read_raises_without_keep(http_file):
+    # Sans keep_path (mode --stream par défaut), un flux incomplet n'est pas accepté
+    with pytest.raises(IOError, match="Flux incomplet"):
+        with StreamingDownload(http_file(os.urandom(200_000))) as stream:
+            stream.read(1000)
@@ -0,0 +1,223 @@
+# test_export.py
+import importlib
+import io
+import os
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from benchmarks.synthetic import generate
+from src.utils.backends import EXPORT_COLUMNS, DuckDBBackend
+from src.utils.export import parquet_chunks
+
+COLUMNS = ['date_mutation', 'code_commune', 'type_local', 'valeur_fonciere', 'surface_reelle_bati']
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    """Application créée sur des données synthétiques nettoyées."""
+    root = tmp_path_factory.mktemp("immoviz")
+    # Quelques milliers de communes : un lasso peut en sélectionner beaucoup (lien d'export)
+    generate(str(root / "data"), 5000, n_communes=3000)
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        from src.utils import clean_data
+        clean_data.process(workers=1)
+    finally:
+        os.chdir(cwd)
+    env = {'IMMOVIZ_DATA_DIR': str(root / "data"), 'IMMOVIZ_WARMUP': "0"}
+    saved = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    try:
+        main = importlib.import_module("main")
+        # warmup.py a pu être importé avant IMMOVIZ_WARMUP=0 (collecte des tests)
+        main.WARMUP_ENABLED = False
+        dash_app = main.create_app(str(root / "data"))
+        main.dataset.get()
+        yield dash_app
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+@pytest.fixture(scope="module")
+def main(app):
+    return importlib.import_module("main")
+
+
+@pytest.fixture
+def client(app):
+    return app.server.test_client()
+
+
+def filter_values(main, dept='all', types=None, year=None, price_range=None):
+    """Valeurs des contrôles de filtre (FILTER_STATES), par défaut toute la période."""
+    meta = main.metadata
+    annees = meta['annees']
+    return [dept, types if types is not None else meta['types_biens'],
+            1, 1, year or annees[0], 31, 12, year or annees[-1],
+            price_range or [meta['min_price'], meta['max_price']], 2]
+
+
+def links(main, selection=None, **filters):
+    """Liens d'export (CSV, Parquet) pour des filtres appliqués et une sélection sur la carte."""
+    return main.update_export_links({'filters': filter_values(main, **filters), 'stat': 'mean',
+                                     'selection': selection})
+
+
+def get(client, href):
+    response = client.get(href)
+    assert response.status_code == 200
+    return response
+
+
+def sorted_rows(df):
+    df = df[COLUMNS].copy()
+    df['date_mutation'] = pd.to_datetime(df['date_mutation']).dt.strftime('%Y-%m-%d')
+    df['code_commune'] = df['code_commune'].astype(str)
+    df['type_local'] = df['type_local'].astype(str)
+    df[['valeur_fonciere', 'surface_reelle_bati']] = df[['valeur_fonciere', 'surface_reelle_bati']].astype('float64')
+    return df.sort_values(COLUMNS).reset_index(drop=True)
+
+
+def export_rows(client, href):
+    return sorted_rows(pd.read_csv(io.BytesIO(get(client, href).data), dtype={'code_commune': str}))
+
+
+def test_export_csv_matches_detail_data(main, client):
+    meta = main.metadata
+    dept, kind, year = meta['departements'][0], meta['types_biens'][0], meta['annees'][-1]
+    csv_href, _ = links(main, dept=dept, types=[kind], year=year)
+    exported = pd.read_csv(io.BytesIO(get(client, csv_href).data), dtype={'code_commune': str})
+
+    detail = pd.read_parquet(os.path.join(main.DATA_DIR, "cleaned", "data_detail"))
+    detail = detail[(detail['code_departement'].astype(str) == dept) & (detail['type_local'].astype(str) == kind)
+                    & (detail['date_mutation'].dt.year == year)]
+    assert len(exported) > 0
+    pd.testing.assert_frame_equal(sorted_rows(exported), sorted_rows(detail), check_exact=False)
+
+
+def test_export_parquet_matches_csv(main, client):
+    csv_href, parquet_href = links(main)
+    from_csv = pd.read_csv(io.BytesIO(get(client, csv_href).data), dtype={'code_commune': str})
+    from_parquet = pd.read_parquet(io.BytesIO(get(client, parquet_href).data))
+    assert len(from_csv) > 0
+    pd.testing.assert_frame_equal(sorted_rows(from_parquet), sorted_rows(from_csv), check_exact=False)
+
+
+def test_export_without_rows_keeps_header(main, client):
+    csv_href, _ = links(main, price_range=[0, 1])
+    assert get(client, csv_href).data.decode('utf-8') == ",".join(EXPORT_COLUMNS) + "\n"
+
+
+def test_export_without_types_is_empty(main, client):
+    # Aucun type coché : le dashboard est vide, l'export aussi (et non toute la base)
+    csv_href, parquet_href = links(main, types=[])
+    assert parse_qs(urlsplit(csv_href).query, keep_blank_values=True)['types'] == ['']
+    assert get(client, csv_href).data.decode('utf-8') == ",".join(EXPORT_COLUMNS) + "\n"
+    assert pd.read_parquet(io.BytesIO(get(client, parquet_href).data)).empty
+
+
+def test_backends_export_same_parquet(main):
+    pytest.importorskip("duckdb")
+    meta = main.metadata
+    filters = ('all', meta['types_biens'], pd.Timestamp(meta['annees'][0], 1, 1),
+               pd.Timestamp(meta['annees'][-1], 12, 31), [meta['min_price'], meta['max_price']])
+    duckdb = DuckDBBackend(os.path.join(main.DATA_DIR, "cleaned", "data_detail"))
+    tables = [pq.read_table(io.BytesIO(b"".join(parquet_chunks(backend.export_batches(*filters)))))
+              for backend in (main.dataset.get().backend, duckdb)]
+    assert tables[0].schema.remove_metadata() == tables[1].schema.remove_metadata()
+    assert tables[0].schema.field('date_mutation').type == pa.date32()
+    pd.testing.assert_frame_equal(sorted_rows(tables[0].to_pandas()), sorted_rows(tables[1].to_pandas()),
+                                  check_exact=False)
+
+
+def test_export_unknown_format(client):
+    response = client.get("/api/v1/export?format=xlsx")
+    assert response.status_code == 400
+
+
+def test_export_links_follow_map_click(main, client):
+    everything = export_rows(client, links(main)[0])
+    code = everything['code_commune'].value_counts().index[0]
+
+    csv_href, parquet_href = links(main, {'code': code})
+    assert parse_qs(urlsplit(csv_href).query)['communes'] == [code]
+    assert parse_qs(urlsplit(parquet_href).query)['communes'] == [code]
+
+    selected = export_rows(client, csv_href)
+    expected = everything[everything['code_commune'] == code].reset_index(drop=True)
+    assert len(selected) > 0
+    pd.testing.assert_frame_equal(selected, expected)
+
+
+def lasso(spatial, fraction):
+    """Sélection rectangulaire centrée sur l'emprise des communes (fraction de sa largeur)."""
+    lon0, lat0, lon1, lat1 = spatial.x.min(), spatial.y.min(), spatial.x.max(), spatial.y.max()
+    cx, cy, dx, dy = (lon0 + lon1) / 2, (lat0 + lat1) / 2, (lon1 - lon0) * fraction / 2, (lat1 - lat0) * fraction / 2
+    return {'points': [[float(x), float(y)] for x, y in
+                       [(cx - dx, cy - dy), (cx + dx, cy - dy), (cx + dx, cy + dy), (cx - dx, cy + dy)]]}
+
+
+def test_export_links_follow_lasso(main, client):
+    everything = export_rows(client, links(main)[0])
+    selection = lasso(main.dataset.get().spatial, 1 / 3)
+    communes = main.selection_communes(selection)
+    assert communes
+
+    href = links(main, selection)[0]
+    query = parse_qs(urlsplit(href).query)
+    assert 'communes' not in query and len(query['polygon'][0].split(';')) == 4
+    selected = export_rows(client, href)
+    expected = everything[everything['code_commune'].isin(communes)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(selected, expected)
+
+
+def test_export_link_stays_short_for_large_lasso(main, client):
+    everything = export_rows(client, links(main)[0])
+    # Lasso tracé à la souris : des centaines de sommets autour de presque toutes les communes
+    corners = lasso(main.dataset.get().spatial, 0.95)['points']
+    points = [[x0 + (x1 - x0) * t / 200, y0 + (y1 - y0) * t / 200]
+              for (x0, y0), (x1, y1) in zip(corners, corners[1:] + corners[:1]) for t in range(200)]
+    selection = main.map_selection('map-graph.selectedData', None, {'lassoPoints': {'mapbox': points}})
+    assert len(selection['points']) <= 100
+    communes = main.selection_communes(selection)
+    assert len(communes) > 2000
+
+    href = links(main, selection)[0]
+    assert len(href) < 4000  # limite de ligne de requête de gunicorn : 4094 octets
+    selected = export_rows(client, href)
+    expected = everything[everything['code_commune'].isin(communes)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(selected, expected)
+
+
+def test_export_rejects_invalid_polygon(client):
+    assert client.get("/api/v1/export?polygon=1,2;3,4").status_code == 400
+    assert client.get("/api/v1/export?polygon=1,2;3,4;5,6&communes=75056").status_code == 400
+
+
+def test_export_without_selection_is_unchanged(main):
+    query = parse_qs(urlsplit(links(main)[0]).query)
+    assert 'communes' not in query and 'polygon' not in query
+
+
+def test_part_result_shares_parts_through_disk_cache(main, tmp_path, monkeypatch):
+    """Avec un cache disque partagé, la première partie met en cache toutes les parties des agrégats."""
+    from src.utils.cache import ResultCache, filter_key
+    cache = ResultCache(main.result_cache.version, disk_dir=str(tmp_path))
+    monkeypatch.setattr(main, 'result_cache', cache)
+    filters = main.parse_filters(*filter_values(main, dept='all'))
+    main.part_result('map', filters)
+    key = filter_key(*filters)
+    # Un autre worker (autre ResultCache, même dossier) lit les parties sans recalculer
+    other = ResultCache(cache.version, disk_dir=str(tmp_path))
+    assert all(other.contains(main.part_key(key, part)) for part in main.DASHBOARD_PARTS if part != 'hist')
+    assert not other.contains(main.part_key(key, 'hist'))
+    assert other.get(main.part_key(key, 'bar')) == main.part_result('bar', filters)
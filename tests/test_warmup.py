@@ -0,0 +1,34 @@
+# test_warmup.py
+from src.utils.warmup import WarmupScheduler
+
+
+def test_status_does_not_scan_the_cache():
+    cache, lookups = {'a'}, []
+
+    def is_cached(filters):
+        lookups.append(filters)
+        return filters in cache
+
+    tasks = [(name, name) for name in 'abcd']
+    scheduler = WarmupScheduler(tasks, cache.add, is_cached, cpu_budget=1.0, busy=lambda: False).start()
+    assert scheduler.join(5)
+    n = len(lookups)
+    for _ in range(10):
+        status = scheduler.status()
+    assert len(lookups) == n
+    assert (status['done'], status['skipped'], status['covered'], status['coverage']) == (3, 1, 4, 1.0)
+
+
+def test_status_counts_evictions():
+    # Cache d'une seule entrée : la deuxième combinaison évince la première
+    cache = []
+
+    def run(filters):
+        cache[:] = [filters]
+
+    scheduler = WarmupScheduler([('a', 'a'), ('b', 'b'), ('c', 'c')], run, lambda f: f in cache,
+                                cpu_budget=1.0, busy=lambda: False).start()
+    assert scheduler.join(5)
+    status = scheduler.status()
+    assert status['state'] == 'stopped'
+    assert status['covered'] == 1 and status['done'] == 2